@@ -0,0 +1,455 @@
+"""
+API HTTP (ASGI) para criar, executar e consultar tarefas sem a interface do Streamlit.
+
+Compartilha os modelos (db/models.py) e a camada de execução
+(utils/task_executor.py) com a interface: tarefas criadas aqui aparecem na
+lista do Streamlit e vice-versa. O acesso ao banco é síncrono (SQLAlchemy) e
+roda no pool de threads do Starlette, em sessões curtas, sem bloquear o event
+loop; para mais vazão, suba vários workers:
+
+    uvicorn api:app --host 0.0.0.0 --port 8080 --workers 4
+
+Rotas:
+    GET  /health
+    POST /tasks                   cria (e executa) uma tarefa
+    POST /tasks/bulk              cria várias tarefas em uma transação
+    GET  /tasks                   lista paginada (cursor), filtros status e batch_id
+    GET  /tasks/{id}              status e resultado (?include=history para o histórico)
+    GET  /tasks/{id}/events       eventos de passo e de status (Server-Sent Events)
+
+O campo 'settings' aceita apenas as chaves de SETTINGS_SCHEMA, com os tipos
+de DEFAULT_AGENT_SETTINGS (utils/agent_runner.py); chaves desconhecidas ou
+valores de tipo errado são rejeitados com 400. 'profile_name' (perfis
+persistentes do navegador, com cookies e sessões) só é aceito com
+API_ALLOW_PROFILES=1.
+
+Variáveis de ambiente: API_TOKENS (tokens aceitos em "Authorization: Bearer",
+separados por vírgula; vazio = sem autenticação), API_RUN_TASKS (executar as
+tarefas neste processo), API_ALLOW_PROFILES, API_MAX_BULK, API_PAGE_SIZE e
+API_SSE_POLL_INTERVAL.
+"""
+import os
+import hmac
+import json
+import uuid
+import base64
+import asyncio
+import logging
+from datetime import datetime
+from contextlib import asynccontextmanager
+
+from sqlalchemy import or_, and_
+from sqlalchemy.orm import load_only, undefer
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from utils.logging_config import setup_logging
+
+logger = logging.getLogger('api')
+
+API_TOKENS = [token.strip() for token in os.environ.get('API_TOKENS', '').split(',') if token.strip()]
+API_RUN_TASKS = os.environ.get('API_RUN_TASKS', '1') not in ('0', 'false', 'no')
+API_ALLOW_PROFILES = os.environ.get('API_ALLOW_PROFILES', '0') not in ('0', 'false', 'no')
+API_MAX_BULK = int(os.environ.get('API_MAX_BULK', 500))
+API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 50))
+API_MAX_PAGE_SIZE = 500
+SSE_POLL_INTERVAL = float(os.environ.get('API_SSE_POLL_INTERVAL', 1.0))
+
+LLM_PROVIDERS = ['openai', 'anthropic', 'azure', 'gemini', 'deepseek', 'ollama']
+TERMINAL_STATUSES = ('finished', 'failed', 'stopped')
+
+# Chaves de 'settings' aceitas pela API: (tipos, opções válidas ou valor mínimo).
+# Espelha DEFAULT_AGENT_SETTINGS sem importar utils/agent_runner.py (que carrega o agente)
+SETTINGS_SCHEMA = {
+    'use_vision': (bool, None),
+    'screenshot_max_width': (int, 0),
+    'max_history_messages': (int, 0),
+    'max_actions_per_step': (int, 1),
+    'block_profile': ((str, type(None)), 'block_profiles'),
+    'block_url_patterns': ((list, type(None)), None),
+    'network_mode': (str, 'network_modes'),
+    'har_source_task_id': ((str, type(None)), None),
+    'memory_limit_mb': ((int, type(None)), 1),
+    'launch_profile': ((str, type(None)), None),
+    'screenshot_policy': (str, 'screenshot_policies'),
+    'screenshot_crop_changes': (bool, None),
+    'use_macros': (bool, None),
+    'profiler': (str, 'profiler_modes'),
+    'parallel_subtasks': (bool, None),
+    'max_subtasks': (int, 1),
+    'subtask_concurrency': (int, 1),
+}
+
+
+class ApiError(Exception):
+    """Erro de validação ou de recurso, devolvido como JSON com o status HTTP"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def task_to_dict(task, output=False):
+    data = {
+        'id': task.id,
+        'status': task.status,
+        'instruction': task.task,
+        'llm_provider': task.llm_provider,
+        'llm_model': task.llm_model,
+        'created_at': _isoformat(task.created_at),
+        'finished_at': _isoformat(task.finished_at),
+        'batch_id': task.batch_id,
+    }
+    if output:
+        data['settings'] = json.loads(task.settings) if task.settings else {}
+        data['output'] = task.output
+    return data
+
+
+def encode_cursor(task):
+    raw = json.dumps([task.created_at.isoformat(), task.id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, task_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(created_at), task_id
+    except (ValueError, TypeError):
+        raise ApiError("Cursor inválido")
+
+
+def _setting_choices(name):
+    if name == 'block_profiles':
+        from utils.request_blocking import BLOCK_PROFILES
+        return list(BLOCK_PROFILES)
+    if name == 'network_modes':
+        from utils.har_archive import NETWORK_MODES
+        return NETWORK_MODES
+    if name == 'screenshot_policies':
+        from utils.screenshot_policy import SCREENSHOT_POLICIES
+        return SCREENSHOT_POLICIES
+    from utils.profiling import PROFILER_MODES
+    return PROFILER_MODES
+
+
+def _type_name(types):
+    names = {bool: 'booleano', int: 'inteiro', str: 'texto', list: 'lista', type(None): 'null'}
+    return ' ou '.join(names[t] for t in types)
+
+
+def parse_settings(settings):
+    """Valida as configurações do agente enviadas pelo cliente (chaves, tipos e valores)"""
+    if not isinstance(settings, dict):
+        raise ApiError("O campo 'settings' deve ser um objeto")
+    schema = dict(SETTINGS_SCHEMA)
+    if API_ALLOW_PROFILES:
+        schema['profile_name'] = ((str, type(None)), None)
+    elif 'profile_name' in settings:
+        raise ApiError("'settings.profile_name' não é aceito pela API (API_ALLOW_PROFILES desativado)")
+    unknown = sorted(set(settings) - set(schema))
+    if unknown:
+        raise ApiError(f"Configurações desconhecidas: {', '.join(unknown)}")
+
+    for key, value in settings.items():
+        types, constraint = schema[key]
+        types = types if isinstance(types, tuple) else (types,)
+        # bool é subclasse de int: True não é um número de passos válido
+        if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+            raise ApiError(f"'settings.{key}' deve ser {_type_name(types)}")
+        if value is None:
+            continue
+        if isinstance(constraint, int) and value < constraint:
+            raise ApiError(f"'settings.{key}' deve ser maior ou igual a {constraint}")
+        if isinstance(constraint, str) and value not in _setting_choices(constraint):
+            raise ApiError(f"'settings.{key}' inválido: {value}")
+
+    patterns = settings.get('block_url_patterns')
+    if patterns is not None and not all(isinstance(pattern, str) for pattern in patterns):
+        raise ApiError("'settings.block_url_patterns' deve ser uma lista de textos")
+    har_source = settings.get('har_source_task_id')
+    if har_source is not None:
+        # Vira parte do caminho do HAR; a existência da tarefa é conferida em _create
+        try:
+            uuid.UUID(har_source)
+        except ValueError:
+            raise ApiError("'settings.har_source_task_id' deve ser o id de uma tarefa")
+    return settings
+
+
+def parse_task_item(item, idempotency_key=None):
+    """Valida um item de criação de tarefa e o converte para o formato de create_tasks"""
+    from utils.task_executor import make_idempotency_key
+    from utils.webhooks import validate_subscription
+
+    if not isinstance(item, dict):
+        raise ApiError("Cada tarefa deve ser um objeto JSON")
+    instruction = str(item.get('instruction') or '').strip()
+    if not instruction:
+        raise ApiError("O campo 'instruction' é obrigatório")
+    provider = item.get('llm_provider') or 'openai'
+    if provider not in LLM_PROVIDERS:
+        raise ApiError(f"Provedor inválido: {provider}")
+    model = item.get('llm_model') or 'gpt-4o'
+    settings = parse_settings(item.get('settings') or {})
+    webhook_url = item.get('webhook_url')
+    webhook_events = item.get('webhook_events')
+    if webhook_url:
+        try:
+            webhook_events = validate_subscription(webhook_url, webhook_events)
+        except ValueError as e:
+            raise ApiError(str(e))
+    elif webhook_events is not None:
+        raise ApiError("O campo 'webhook_events' requer 'webhook_url'")
+    key = idempotency_key or item.get('idempotency_key')
+    return {
+        'instruction': instruction,
+        'llm_provider': provider,
+        'llm_model': model,
+        'settings': settings,
+        # Chaves do cliente têm tamanho livre; a coluna guarda o hash
+        'idempotency_key': make_idempotency_key('api', str(key)) if key else None,
+        'webhook_url': webhook_url,
+        'webhook_events': webhook_events,
+    }
+
+
+def _create(items, run):
+    from db.database import get_db_session
+    from db.models import Task
+    from utils.task_executor import create_tasks, start_task
+
+    har_sources = {item['settings']['har_source_task_id'] for item in items if item['settings'].get('har_source_task_id')}
+    if har_sources:
+        with get_db_session() as session:
+            existing = {task_id for task_id, in session.query(Task.id).filter(Task.id.in_(har_sources))}
+        missing = sorted(har_sources - existing)
+        if missing:
+            raise ApiError(f"'settings.har_source_task_id' não corresponde a uma tarefa: {', '.join(missing)}")
+
+    # As assinaturas de webhook são criadas na mesma transação que as tarefas
+    results = create_tasks(items)
+    for task_id, created in results:
+        if created and run and API_RUN_TASKS:
+            start_task(task_id)
+
+    ids = [task_id for task_id, _ in results]
+    with get_db_session() as session:
+        tasks = {task.id: task_to_dict(task) for task in session.query(Task).filter(Task.id.in_(ids))}
+    return [{**tasks[task_id], 'created': created} for task_id, created in results]
+
+
+async def _json_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise ApiError("Corpo da requisição não é um JSON válido")
+
+
+async def health(request):
+    return JSONResponse({'status': 'ok'})
+
+
+async def create_task_endpoint(request):
+    body = await _json_body(request)
+    item = parse_task_item(body, idempotency_key=request.headers.get('idempotency-key'))
+    task = (await run_in_threadpool(_create, [item], body.get('run', True)))[0]
+    return JSONResponse(task, status_code=201 if task['created'] else 200)
+
+
+async def create_tasks_bulk(request):
+    body = await _json_body(request)
+    raw_items = body.get('tasks') if isinstance(body, dict) else None
+    if not isinstance(raw_items, list) or not raw_items:
+        raise ApiError("O campo 'tasks' deve ser uma lista não vazia")
+    if len(raw_items) > API_MAX_BULK:
+        raise ApiError(f"Máximo de {API_MAX_BULK} tarefas por requisição")
+    items = []
+    for index, raw in enumerate(raw_items):
+        try:
+            items.append(parse_task_item(raw))
+        except ApiError as e:
+            raise ApiError(f"Tarefa {index}: {e}")
+    tasks = await run_in_threadpool(_create, items, body.get('run', True))
+    return JSONResponse({'tasks': tasks}, status_code=201)
+
+
+def _list_tasks(status, batch_id, limit, cursor):
+    from db.database import get_db_session
+    from db.models import Task
+
+    with get_db_session() as session:
+        query = session.query(Task).options(load_only(
+            Task.id, Task.status, Task.task, Task.llm_provider, Task.llm_model,
+            Task.created_at, Task.finished_at, Task.batch_id
+        ))
+        if status:
+            query = query.filter(Task.status == status)
+        if batch_id:
+            query = query.filter(Task.batch_id == batch_id)
+        if cursor:
+            # Paginação por chave (created_at, id): custo constante em qualquer página
+            created_at, task_id = cursor
+            query = query.filter(or_(
+                Task.created_at < created_at,
+                and_(Task.created_at == created_at, Task.id < task_id)
+            ))
+        tasks = query.order_by(Task.created_at.desc(), Task.id.desc()).limit(limit + 1).all()
+        page = tasks[:limit]
+        return {
+            'tasks': [task_to_dict(task) for task in page],
+            'next_cursor': encode_cursor(page[-1]) if len(tasks) > limit else None,
+        }
+
+
+async def list_tasks(request):
+    params = request.query_params
+    try:
+        limit = min(max(int(params.get('limit', API_PAGE_SIZE)), 1), API_MAX_PAGE_SIZE)
+    except ValueError:
+        raise ApiError("Parâmetro 'limit' inválido")
+    cursor = decode_cursor(params['cursor']) if params.get('cursor') else None
+    page = await run_in_threadpool(_list_tasks, params.get('status'), params.get('batch_id'), limit, cursor)
+    return JSONResponse(page)
+
+
+def _get_task(task_id, include_history):
+    from db.database import get_db_session
+    from db.models import Task, TaskHistory
+    from utils.storage import resolve_url
+
+    with get_db_session() as session:
+        task = session.query(Task).options(undefer(Task.output)).filter(Task.id == task_id).first()
+        if task is None:
+            return None
+        data = task_to_dict(task, output=True)
+        if include_history:
+            history = session.query(TaskHistory).filter(TaskHistory.task_id == task_id).first()
+            if history is not None:
+                screenshots = json.loads(history.screenshots) if history.screenshots else []
+                data['history'] = {
+                    'steps': json.loads(history.steps) if history.steps else [],
+                    'urls': json.loads(history.urls) if history.urls else [],
+                    'errors': json.loads(history.errors) if history.errors else [],
+                    'metrics': json.loads(history.metrics) if history.metrics else {},
+                    # URLs pré-assinadas (ou caminhos locais) para baixar as capturas direto do armazenamento
+                    'screenshots': [resolve_url(ref) or ref for ref in screenshots],
+                }
+        return data
+
+
+async def get_task(request):
+    include_history = 'history' in request.query_params.get('include', '').split(',')
+    task = await run_in_threadpool(_get_task, request.path_params['task_id'], include_history)
+    if task is None:
+        raise ApiError("Tarefa não encontrada", status_code=404)
+    return JSONResponse(task)
+
+
+def _event_snapshot(task_id, last_step):
+    """Status da tarefa e os passos concluídos após `last_step` (do checkpoint ou, ao final, do histórico)"""
+    from db.database import get_db_session
+    from db.models import Task, TaskHistory, TaskCheckpoint
+
+    with get_db_session() as session:
+        task = session.query(Task).options(load_only(Task.status, Task.finished_at)).filter(Task.id == task_id).first()
+        if task is None:
+            return None
+        snapshot = {'status': task.status, 'finished_at': _isoformat(task.finished_at), 'steps': []}
+        if task.status in TERMINAL_STATUSES:
+            source = session.query(TaskHistory.steps).filter(TaskHistory.task_id == task_id).scalar()
+        else:
+            checkpoint_step = session.query(TaskCheckpoint.step).filter(TaskCheckpoint.task_id == task_id).scalar()
+            source = None
+            if checkpoint_step and checkpoint_step > last_step:
+                source = session.query(TaskCheckpoint.steps).filter(TaskCheckpoint.task_id == task_id).scalar()
+        steps = json.loads(source) if source else []
+        snapshot['steps'] = steps[last_step:]
+        return snapshot
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+async def task_events(request):
+    task_id = request.path_params['task_id']
+
+    async def stream():
+        last_status = None
+        last_step = 0
+        while True:
+            snapshot = await run_in_threadpool(_event_snapshot, task_id, last_step)
+            if snapshot is None:
+                yield _sse('error', {'error': 'Tarefa não encontrada'})
+                return
+            for step in snapshot['steps']:
+                yield _sse('step', step)
+            last_step += len(snapshot['steps'])
+            if snapshot['status'] != last_status:
+                last_status = snapshot['status']
+                yield _sse('status', {'task_id': task_id, 'status': last_status, 'finished_at': snapshot['finished_at']})
+            if last_status in TERMINAL_STATUSES:
+                return
+            # Comentário SSE: mantém a conexão aberta através de proxies
+            yield ': keepalive\n\n'
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(SSE_POLL_INTERVAL)
+
+    return StreamingResponse(stream(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+async def api_error(request, exc):
+    return JSONResponse({'error': str(exc)}, status_code=exc.status_code)
+
+
+class TokenAuthMiddleware:
+    """Exige "Authorization: Bearer <token>" com um dos API_TOKENS (exceto em /health)"""
+
+    def __init__(self, app, tokens):
+        self.app = app
+        self.tokens = [token.encode('utf-8') for token in tokens]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and self.tokens and scope['path'] != '/health':
+            authorization = dict(scope['headers']).get(b'authorization', b'')
+            token = authorization[7:] if authorization[:7].lower() == b'bearer ' else b''
+            if not any(hmac.compare_digest(token, expected) for expected in self.tokens):
+                await JSONResponse({'error': 'Não autorizado'}, status_code=401)(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    setup_logging()
+    from db.database import init_db
+    await run_in_threadpool(init_db)
+    if not API_TOKENS:
+        logger.warning("API_TOKENS não configurado: a API aceita requisições sem autenticação")
+    if API_RUN_TASKS:
+        from utils.checkpoints import recover_orphaned_tasks
+        await run_in_threadpool(recover_orphaned_tasks)
+    yield
+
+
+routes = [
+    Route('/health', health),
+    Route('/tasks', create_task_endpoint, methods=['POST']),
+    Route('/tasks', list_tasks, methods=['GET']),
+    Route('/tasks/bulk', create_tasks_bulk, methods=['POST']),
+    Route('/tasks/{task_id}', get_task),
+    Route('/tasks/{task_id}/events', task_events),
+]
+
+app = Starlette(routes=routes, lifespan=lifespan, exception_handlers={ApiError: api_error})
+app.add_middleware(TokenAuthMiddleware, tokens=API_TOKENS)
@@ -5,7 +5,10 @@ import os
 import pandas as pd
 from datetime import datetime
 import tempfile
+import io
 import json
+import logging
+from sqlalchemy.orm import undefer
 import threading
 
 # Configuração inicial do Streamlit - versão simplificada para evitar problemas de renderização
@@ -15,25 +18,78 @@ st.set_page_config(
     layout="wide"
 )
 
+# Logging estruturado (fila + thread de escrita); configurado uma única vez por processo
+from utils.logging_config import setup_logging
+setup_logging()
+logger = logging.getLogger('app')
+
 # Verificar se estamos em ambiente Railway
 if os.environ.get('RAILWAY_ENVIRONMENT') or os.environ.get('RAILWAY_PUBLIC_DOMAIN'):
     try:
-        print("Ambiente Railway detectado, importando health_check")
+        logger.debug("Ambiente Railway detectado, importando health_check")
         from utils.health_check import setup_healthcheck
         setup_healthcheck()
-        print("Healthcheck configurado com sucesso")
+        logger.info("Healthcheck configurado com sucesso")
     except Exception as e:
-        print(f"Erro ao configurar healthcheck: {e}")
+        logger.error(f"Erro ao configurar healthcheck: {e}")
 
 # Importações internas
 try:
     from db.database import init_db, get_db_session
-    from db.models import Task, TaskHistory, ApiKey
-    from utils.agent_runner import run_agent_task
+    from db.models import Task, TaskHistory, ApiKey, ActionMacro, Batch
+    from utils.agent_runner import run_agent_task, DEFAULT_AGENT_SETTINGS
     from utils.helpers import format_datetime, get_status_color, generate_unique_id, get_llm_models
+    from utils.rate_limiter import DEFAULT_PROVIDER_LIMITS, FALLBACK_LIMITS
+    from utils.request_blocking import BLOCK_PROFILES
+    from utils.browser_profiles import list_profiles, DEFAULT_MAX_PROFILE_MB, DEFAULT_MAX_TOTAL_MB
+    from utils.resource_watchdog import DEFAULT_MEMORY_LIMIT_MB
+    from utils.browser_config import LAUNCH_FLAG_PROFILES
+    from utils.browser_pool import get_browser_pool, parse_endpoints
+    from utils.storage import resolve_url
+    from utils.webhooks import (
+        WEBHOOK_EVENTS, DEFAULT_EVENTS, subscribe, unsubscribe, list_subscriptions, get_default_secret, get_dispatcher
+    )
+    from utils.screenshot_policy import SCREENSHOT_POLICIES
+    from utils.retry_policy import DEFAULT_RETRY_SETTINGS
+    from utils.profiling import PROFILER_MODES, profile_page
+    from utils.logging_config import decompress_logs
+    from utils.checkpoints import recover_orphaned_tasks, load_checkpoint
+    from utils.task_executor import (
+        execute_task, create_task, claim_task, make_idempotency_key, create_batch, create_ab_batch, get_ab_comparison, start_batch, is_batch_running, get_batch_progress, get_batch_results,
+        template_fields, render_template, DEFAULT_BATCH_CONCURRENCY, MAX_BATCH_CONCURRENCY
+    )
 except ImportError as e:
     st.error(f"Erro ao importar módulos: {e}")
 
+# Rótulos dos perfis de bloqueio de requisições
+BLOCK_PROFILE_LABELS = {
+    'none': 'Nenhum (carregar tudo)',
+    'trackers': 'Analytics e anúncios',
+    'lean': 'Enxuto (sem imagens, mídia, fontes e rastreadores)',
+    'minimal': 'Mínimo (também sem CSS)',
+}
+
+# Rótulos dos perfis de flags de inicialização do Chromium
+LAUNCH_PROFILE_LABELS = {
+    'default': 'Padrão',
+    'balanced': 'Equilibrado (até 4 renderers, heap JS de 512 MB)',
+    'low_memory': 'Pouca memória (até 2 renderers, heap JS de 256 MB)',
+}
+
+# Rótulos das políticas de captura de screenshots
+SCREENSHOT_POLICY_LABELS = {
+    'adaptive': 'Adaptativa (apenas quando a página muda)',
+    'every_step': 'Todo passo',
+    'off': 'Desativada',
+}
+
+# Rótulos dos modos de perfilamento
+PROFILER_LABELS = {
+    'off': 'Desativado',
+    'sampling': 'Amostragem (flamegraph, baixo custo)',
+    'cprofile': 'cProfile (determinístico, arquivo .prof)',
+}
+
 # Inicialização de variáveis de sessão
 def init_session_state():
     """Inicializa variáveis de estado da sessão"""
@@ -41,6 +97,8 @@ def init_session_state():
         st.session_state.db_initialized = False
     if 'current_task' not in st.session_state:
         st.session_state.current_task = None
+    if 'current_batch' not in st.session_state:
+        st.session_state.current_batch = None
     if 'llm_provider' not in st.session_state:
         st.session_state.llm_provider = "openai"
     if 'llm_model' not in st.session_state:
@@ -54,11 +112,39 @@ def init_session_state():
             'browser_window_height': 1100,
             'highlight_elements': True,
             'chrome_instance_path': None,
+            'block_profile': 'none',
+            'block_url_patterns': [],
+            'blocklist_path': '',
+            'profile_name': '',
+            'profile_cache_mb': 256,
+            'profile_max_mb': DEFAULT_MAX_PROFILE_MB,
+            'profiles_max_total_mb': DEFAULT_MAX_TOTAL_MB,
+            'launch_profile': 'default',
+            'memory_limit_mb': DEFAULT_MEMORY_LIMIT_MB,
+            **DEFAULT_RETRY_SETTINGS,
         }
     if 'task_running' not in st.session_state:
         st.session_state.task_running = False
     if 'task_result' not in st.session_state:
         st.session_state.task_result = None
+    if 'form_nonces' not in st.session_state:
+        st.session_state.form_nonces = {}
+
+
+def form_nonce(form):
+    """
+    Nonce do formulário, gerado ao renderizá-lo: identifica o envio na chave de idempotência
+    e na chave do botão. Cliques repetidos no mesmo formulário produzem a mesma chave.
+    """
+    nonces = st.session_state.form_nonces
+    if form not in nonces:
+        nonces[form] = generate_unique_id()
+    return nonces[form]
+
+
+def rotate_form_nonce(form):
+    """Após um envio bem-sucedido: o próximo envio é um pedido novo, e o botão antigo deixa de existir"""
+    st.session_state.form_nonces[form] = generate_unique_id()
 
 # Interface Streamlit
 def auth_page():
@@ -217,6 +303,162 @@ def auth_page():
             value=st.session_state.browser_config['browser_window_height']
         )
     
+    st.markdown("#### Carregamento Enxuto de Páginas")
+    block_col1, block_col2 = st.columns(2)
+    
+    with block_col1:
+        block_profile = st.selectbox(
+            "Perfil de bloqueio de requisições",
+            options=list(BLOCK_PROFILES.keys()),
+            index=list(BLOCK_PROFILES.keys()).index(st.session_state.browser_config.get('block_profile', 'none')),
+            format_func=lambda x: BLOCK_PROFILE_LABELS.get(x, x),
+            help="Bloquear imagens também as remove dos screenshots enviados ao modelo."
+        )
+        blocklist_path = st.text_input(
+            "Lista local de domínios bloqueados (caminho do arquivo)",
+            value=st.session_state.browser_config.get('blocklist_path') or '',
+            help="Arquivo no formato hosts ou com um domínio por linha."
+        )
+    
+    with block_col2:
+        block_url_patterns = st.text_area(
+            "Padrões de URL adicionais a bloquear (um por linha)",
+            value="\n".join(st.session_state.browser_config.get('block_url_patterns') or []),
+            placeholder="*://*.exemplo.com/tracker/*"
+        )
+    
+    st.markdown("#### Recursos do Navegador")
+    resource_col1, resource_col2 = st.columns(2)
+    
+    with resource_col1:
+        launch_profile = st.selectbox(
+            "Perfil de inicialização do Chromium",
+            options=list(LAUNCH_FLAG_PROFILES.keys()),
+            index=list(LAUNCH_FLAG_PROFILES.keys()).index(st.session_state.browser_config.get('launch_profile') or 'default'),
+            format_func=lambda x: LAUNCH_PROFILE_LABELS.get(x, x),
+            help="Perfis econômicos limitam processos de renderização e o heap de JavaScript."
+        )
+    
+    with resource_col2:
+        memory_limit_mb = st.number_input(
+            "Teto de memória do navegador por tarefa (MB)",
+            min_value=256,
+            max_value=16384,
+            value=int(st.session_state.browser_config.get('memory_limit_mb', DEFAULT_MEMORY_LIMIT_MB)),
+            help="Se excedido, apenas o navegador da tarefa é encerrado e a tarefa falha."
+        )
+    
+    st.markdown("#### Navegadores Remotos")
+    st.caption("Endpoints CDP (ex.: containers headless-chrome) usados no lugar do navegador local. Cada tarefa usa "
+               "o endpoint saudável menos carregado; se a conexão falhar, o próximo é tentado.")
+    remote_col1, remote_col2 = st.columns(2)
+    
+    with remote_col1:
+        remote_browsers = st.text_area(
+            "Endpoints (um por linha, no formato url|capacidade)",
+            value="\n".join(
+                f"{endpoint['url']}|{endpoint['capacity']}"
+                for endpoint in parse_endpoints(st.session_state.browser_config.get('remote_browsers'))
+            ),
+            placeholder="ws://chrome-1:3000|4\nhttp://chrome-2:9222|4",
+            help="Vazio = navegador local. Tarefas com perfil persistente sempre usam o navegador local."
+        )
+    
+    with remote_col2:
+        remote_browser_timeout = st.number_input(
+            "Espera máxima por um endpoint livre (s)",
+            min_value=1,
+            max_value=3600,
+            value=int(st.session_state.browser_config.get('remote_browser_timeout', 60))
+        )
+        remote_browser_fallback_local = st.checkbox(
+            "Usar o navegador local se nenhum endpoint estiver disponível",
+            value=st.session_state.browser_config.get('remote_browser_fallback_local', False)
+        )
+    
+    browser_pool = get_browser_pool(st.session_state.browser_config)
+    if browser_pool:
+        if st.button("Verificar endpoints"):
+            asyncio.run(browser_pool.refresh(force=True))
+        st.dataframe(pd.DataFrame(browser_pool.stats()), use_container_width=True)
+    
+    st.markdown("#### Retry de Ações")
+    st.caption("Apenas erros transitórios (timeouts, conexão reiniciada, 5xx) em ações idempotentes são repetidos, "
+               "com espera exponencial. Falhas seguidas em um site abrem o circuito desse site temporariamente.")
+    retry_col1, retry_col2 = st.columns(2)
+    
+    with retry_col1:
+        retry_max_attempts = st.number_input(
+            "Tentativas por ação",
+            min_value=1,
+            max_value=10,
+            value=int(st.session_state.browser_config.get('retry_max_attempts', DEFAULT_RETRY_SETTINGS['retry_max_attempts']))
+        )
+        retry_base_delay = st.number_input(
+            "Espera inicial entre tentativas (s)",
+            min_value=0.0,
+            max_value=30.0,
+            value=float(st.session_state.browser_config.get('retry_base_delay', DEFAULT_RETRY_SETTINGS['retry_base_delay'])),
+            step=0.25
+        )
+    
+    with retry_col2:
+        circuit_failure_threshold = st.number_input(
+            "Falhas seguidas para abrir o circuito de um site",
+            min_value=1,
+            max_value=50,
+            value=int(st.session_state.browser_config.get('circuit_failure_threshold', DEFAULT_RETRY_SETTINGS['circuit_failure_threshold']))
+        )
+        circuit_reset_seconds = st.number_input(
+            "Tempo com o circuito aberto (s)",
+            min_value=1.0,
+            max_value=600.0,
+            value=float(st.session_state.browser_config.get('circuit_reset_seconds', DEFAULT_RETRY_SETTINGS['circuit_reset_seconds']))
+        )
+    
+    st.markdown("#### Perfis Persistentes")
+    st.caption("Um perfil mantém cookies, logins e o cache HTTP entre execuções. Cada perfil é usado por uma tarefa por vez. "
+               "Com um perfil de bloqueio de requisições ativo, o cache HTTP não é usado (limitação do Playwright).")
+    profile_col1, profile_col2 = st.columns(2)
+    
+    with profile_col1:
+        profile_name = st.text_input(
+            "Perfil padrão (vazio = sem persistência)",
+            value=st.session_state.browser_config.get('profile_name') or ''
+        )
+        profile_cache_mb = st.number_input(
+            "Tamanho do cache HTTP por perfil (MB)",
+            min_value=16,
+            max_value=4096,
+            value=int(st.session_state.browser_config.get('profile_cache_mb', 256))
+        )
+    
+    with profile_col2:
+        profile_max_mb = st.number_input(
+            "Tamanho máximo de cada perfil (MB)",
+            min_value=64,
+            max_value=16384,
+            value=int(st.session_state.browser_config.get('profile_max_mb', DEFAULT_MAX_PROFILE_MB))
+        )
+        profiles_max_total_mb = st.number_input(
+            "Tamanho máximo de todos os perfis (MB)",
+            min_value=128,
+            max_value=131072,
+            value=int(st.session_state.browser_config.get('profiles_max_total_mb', DEFAULT_MAX_TOTAL_MB))
+        )
+    
+    profiles = list_profiles()
+    if profiles:
+        st.dataframe(pd.DataFrame([
+            {
+                'Perfil': profile['name'],
+                'Tamanho (MB)': profile['size_mb'],
+                'Último uso': format_datetime(datetime.fromtimestamp(profile['last_used'])) if profile['last_used'] else 'N/A',
+                'Em uso': 'Sim' if profile['in_use'] else 'Não',
+            }
+            for profile in profiles
+        ]), use_container_width=True)
+    
     if st.button("Salvar Configurações do Navegador"):
         # Atualizar sessão
         browser_config = {
@@ -225,7 +467,24 @@ def auth_page():
             'browser_window_width': browser_window_width,
             'browser_window_height': browser_window_height,
             'highlight_elements': highlight_elements,
-            'chrome_instance_path': st.session_state.browser_config.get('chrome_instance_path')
+            'chrome_instance_path': st.session_state.browser_config.get('chrome_instance_path'),
+            'block_profile': block_profile,
+            'block_url_patterns': [p.strip() for p in block_url_patterns.splitlines() if p.strip()],
+            'blocklist_path': blocklist_path.strip(),
+            'profile_name': profile_name.strip(),
+            'profile_cache_mb': profile_cache_mb,
+            'profile_max_mb': profile_max_mb,
+            'profiles_max_total_mb': profiles_max_total_mb,
+            'launch_profile': launch_profile,
+            'memory_limit_mb': memory_limit_mb,
+            'retry_max_attempts': retry_max_attempts,
+            'retry_base_delay': retry_base_delay,
+            'retry_max_delay': st.session_state.browser_config.get('retry_max_delay', DEFAULT_RETRY_SETTINGS['retry_max_delay']),
+            'circuit_failure_threshold': circuit_failure_threshold,
+            'circuit_reset_seconds': circuit_reset_seconds,
+            'remote_browsers': parse_endpoints(remote_browsers),
+            'remote_browser_timeout': remote_browser_timeout,
+            'remote_browser_fallback_local': remote_browser_fallback_local
         }
         st.session_state.browser_config = browser_config
         
@@ -240,6 +499,198 @@ def auth_page():
             session.commit()
         
         st.success("Configurações do navegador salvas com sucesso!")
+    
+    st.divider()
+    
+    st.markdown("### Limites de Requisição do LLM")
+    st.caption("Os limites são compartilhados por todas as tarefas que usam o mesmo provedor e chave de API. "
+               "A concorrência se ajusta automaticamente: cai pela metade em erros 429/5xx e volta a crescer quando o provedor está saudável.")
+    
+    llm_config = json.loads(api_keys['llm_config']) if api_keys.get('llm_config') else {}
+    rate_limits = llm_config.get('rate_limits', {})
+    
+    limit_provider = st.selectbox(
+        "Provedor",
+        options=["openai", "anthropic", "azure", "gemini", "deepseek", "ollama"],
+        key="rate_limit_provider"
+    )
+    current_limits = dict(DEFAULT_PROVIDER_LIMITS.get(limit_provider, FALLBACK_LIMITS))
+    current_limits.update(rate_limits.get(limit_provider, {}))
+    
+    limit_col1, limit_col2, limit_col3 = st.columns(3)
+    with limit_col1:
+        requests_per_minute = st.number_input(
+            "Requisições por minuto (0 = sem limite)",
+            min_value=0,
+            value=int(current_limits.get('requests_per_minute') or 0),
+            key=f"rpm_{limit_provider}"
+        )
+    with limit_col2:
+        tokens_per_minute = st.number_input(
+            "Tokens por minuto (0 = sem limite)",
+            min_value=0,
+            value=int(current_limits.get('tokens_per_minute') or 0),
+            key=f"tpm_{limit_provider}"
+        )
+    with limit_col3:
+        max_concurrency = st.number_input(
+            "Concorrência máxima",
+            min_value=1,
+            max_value=256,
+            value=int(current_limits.get('max_concurrency') or 1),
+            key=f"concurrency_{limit_provider}"
+        )
+    
+    if st.button("Salvar Limites do LLM"):
+        rate_limits[limit_provider] = {
+            'requests_per_minute': requests_per_minute or None,
+            'tokens_per_minute': tokens_per_minute or None,
+            'max_concurrency': max_concurrency,
+        }
+        llm_config['rate_limits'] = rate_limits
+        
+        with get_db_session() as session:
+            key = session.query(ApiKey).filter(ApiKey.provider == 'llm_config').first()
+            if key:
+                key.api_key = json.dumps(llm_config)
+            else:
+                key = ApiKey(provider='llm_config', api_key=json.dumps(llm_config))
+                session.add(key)
+            session.commit()
+        
+        st.success(f"Limites de {limit_provider} salvos com sucesso!")
+    
+    st.markdown("### Hedging de Requisições")
+    st.caption("Quando uma chamada ao LLM demora mais que o percentil escolhido da latência recente, "
+               "uma requisição duplicada é disparada e a primeira resposta válida é usada. Consome tokens extras.")
+    
+    hedge_config = llm_config.get('hedge', {})
+    hedge_col1, hedge_col2, hedge_col3 = st.columns(3)
+    with hedge_col1:
+        hedge_enabled = st.checkbox(
+            "Ativar hedging",
+            value=hedge_config.get('enabled', False)
+        )
+        hedge_percentile = st.slider(
+            "Percentil de latência",
+            min_value=50,
+            max_value=99,
+            value=int(hedge_config.get('percentile', 95))
+        )
+    with hedge_col2:
+        hedge_fallback_provider = st.selectbox(
+            "Provedor de fallback",
+            options=["", "openai", "anthropic", "azure", "gemini", "deepseek", "ollama"],
+            index=["", "openai", "anthropic", "azure", "gemini", "deepseek", "ollama"].index(hedge_config.get('fallback_provider', '')),
+            format_func=lambda x: x or "Mesmo provedor da tarefa",
+            help="O fallback deve ser do mesmo provedor da tarefa para que as ferramentas do agente sejam compatíveis."
+        )
+    with hedge_col3:
+        hedge_fallback_model = st.text_input(
+            "Modelo de fallback",
+            value=hedge_config.get('fallback_model', ''),
+            help="Deixe vazio para repetir a requisição no mesmo modelo."
+        )
+    
+    if st.button("Salvar Hedging"):
+        llm_config['hedge'] = {
+            'enabled': hedge_enabled,
+            'percentile': hedge_percentile,
+            'fallback_provider': hedge_fallback_provider,
+            'fallback_model': hedge_fallback_model.strip(),
+        }
+        
+        with get_db_session() as session:
+            key = session.query(ApiKey).filter(ApiKey.provider == 'llm_config').first()
+            if key:
+                key.api_key = json.dumps(llm_config)
+            else:
+                key = ApiKey(provider='llm_config', api_key=json.dumps(llm_config))
+                session.add(key)
+            session.commit()
+        
+        st.success("Configuração de hedging salva com sucesso!")
+    
+    st.divider()
+    
+    st.markdown("### Macros de Ações")
+    st.caption("Sequências de ações gravadas de execuções concluídas, reproduzidas sem o LLM quando a mesma instrução é executada novamente.")
+    with get_db_session() as session:
+        macros = [
+            {
+                'id': macro.id,
+                'Instrução': macro.instruction[:80],
+                'Ações': len(json.loads(macro.actions)),
+                'Replays': macro.replay_count or 0,
+                'Replays completos': macro.full_replay_count or 0,
+                'Atualizada em': format_datetime(macro.updated_at or macro.created_at),
+            }
+            for macro in session.query(ActionMacro).order_by(ActionMacro.created_at.desc()).all()
+        ]
+    
+    if macros:
+        st.dataframe(pd.DataFrame(macros).drop(columns=['id']), use_container_width=True)
+        macro_to_delete = st.selectbox(
+            "Remover macro",
+            options=[''] + [macro['id'] for macro in macros],
+            format_func=lambda x: next((m['Instrução'] for m in macros if m['id'] == x), '') if x else "Selecione..."
+        )
+        if macro_to_delete and st.button("Remover Macro"):
+            with get_db_session() as session:
+                session.query(ActionMacro).filter(ActionMacro.id == macro_to_delete).delete()
+            st.success("Macro removida.")
+            st.experimental_rerun()
+    else:
+        st.info("Nenhuma macro gravada ainda.")
+    
+    st.divider()
+    
+    st.markdown("### Webhooks")
+    st.caption("Integrações recebem um POST assinado (HMAC-SHA256) quando o status de uma tarefa muda, sem precisar "
+               "consultar a interface. Assinaturas globais valem para todas as tarefas.")
+    st.markdown("**Segredo das assinaturas** (valide o cabeçalho X-Webhook-Signature com ele):")
+    st.code(get_default_secret())
+    
+    webhook_col1, webhook_col2 = st.columns([3, 2])
+    with webhook_col1:
+        webhook_url = st.text_input("URL do webhook", placeholder="https://exemplo.com/webhooks/tarefas")
+    with webhook_col2:
+        webhook_events = st.multiselect("Eventos", options=WEBHOOK_EVENTS, default=DEFAULT_EVENTS)
+    if st.button("Adicionar Webhook"):
+        try:
+            subscribe(webhook_url.strip(), events=webhook_events)
+        except ValueError as e:
+            st.error(str(e))
+        else:
+            st.success("Webhook adicionado.")
+            st.experimental_rerun()
+    
+    subscriptions = list_subscriptions()
+    if subscriptions:
+        st.dataframe(pd.DataFrame([
+            {
+                'URL': subscription['url'],
+                'Eventos': ', '.join(subscription['events']),
+                'Última entrega': format_datetime(subscription['last_delivery_at']) if subscription['last_delivery_at'] else 'N/A',
+                'Último status': subscription['last_status'] or '',
+                'Falhas seguidas': subscription['failure_count'],
+            }
+            for subscription in subscriptions
+        ]), use_container_width=True)
+        webhook_to_delete = st.selectbox(
+            "Remover webhook",
+            options=[''] + [subscription['id'] for subscription in subscriptions],
+            format_func=lambda x: next((w['url'] for w in subscriptions if w['id'] == x), '') if x else "Selecione..."
+        )
+        if webhook_to_delete and st.button("Remover Webhook"):
+            unsubscribe(webhook_to_delete)
+            st.success("Webhook removido.")
+            st.experimental_rerun()
+    
+    dispatcher_stats = get_dispatcher().stats()
+    if dispatcher_stats['queued']:
+        st.caption(f"Entregas neste processo: {dispatcher_stats['delivered']} entregues, "
+                   f"{dispatcher_stats['failed']} descartadas, {dispatcher_stats['pending']} pendentes.")
 
 def create_task_page():
     """Página para criar novas tarefas"""
@@ -252,39 +703,215 @@ def create_task_page():
     col1, col2 = st.columns([3, 1])
     
     with col1:
-        task_instructions = st.text_area(
-            "Instruções para o Agente", 
-            height=200, 
-            placeholder="Digite instruções detalhadas para o agente de IA...\n\nExemplo: Abra https://www.google.com e pesquise por 'Browser Use'"
-        )
-        
-        # Seleção de LLM
-        model_col1, model_col2 = st.columns(2)
-        
-        with model_col1:
-            llm_provider = st.selectbox(
-                "Provedor de LLM",
-                options=["openai", "anthropic", "azure", "gemini", "deepseek", "ollama"],
-                index=["openai", "anthropic", "azure", "gemini", "deepseek", "ollama"].index(st.session_state.llm_provider),
-                format_func=lambda x: {
-                    'openai': 'OpenAI',
-                    'anthropic': 'Anthropic',
-                    'azure': 'Azure OpenAI',
-                    'gemini': 'Google Gemini',
-                    'deepseek': 'DeepSeek',
-                    'ollama': 'Ollama (Local)'
-                }.get(x, x)
+        task_mode = st.radio("Modo", options=["Tarefa única", "Lote (CSV)", "Comparar modelos (A/B)"], horizontal=True)
+        batch_rows = []
+        
+        if task_mode != "Lote (CSV)":
+            task_instructions = st.text_area(
+                "Instruções para o Agente", 
+                height=200, 
+                placeholder="Digite instruções detalhadas para o agente de IA...\n\nExemplo: Abra https://www.google.com e pesquise por 'Browser Use'"
             )
-            st.session_state.llm_provider = llm_provider
-        
-        with model_col2:
-            models = get_llm_models(llm_provider)
-            selected_model = st.selectbox(
-                "Modelo",
-                options=models,
-                index=0 if st.session_state.llm_model not in models else models.index(st.session_state.llm_model)
+        else:
+            csv_file = st.file_uploader("Arquivo CSV com os dados de entrada", type=["csv"])
+            csv_text = st.text_area(
+                "Ou cole as linhas do CSV (com cabeçalho)",
+                height=120,
+                placeholder="produto,url\nCaneta,https://loja.exemplo.com/caneta"
+            )
+            task_instructions = st.text_area(
+                "Modelo de instrução",
+                height=150,
+                placeholder="Abra {url} e retorne o preço do produto {produto}.",
+                help="Use {coluna} para inserir o valor da coluna do CSV. Use {{ e }} para chaves literais."
+            )
+            batch_col1, batch_col2 = st.columns(2)
+            with batch_col1:
+                batch_name = st.text_input("Nome do lote (opcional)")
+            with batch_col2:
+                batch_concurrency = st.number_input(
+                    "Tarefas simultâneas",
+                    min_value=1,
+                    max_value=MAX_BATCH_CONCURRENCY,
+                    value=DEFAULT_BATCH_CONCURRENCY,
+                    help="Cada tarefa simultânea abre um navegador próprio."
+                )
+            
+            csv_source = csv_file if csv_file is not None else (io.StringIO(csv_text) if csv_text.strip() else None)
+            if csv_source is not None:
+                try:
+                    batch_df = pd.read_csv(csv_source, dtype=str, keep_default_na=False)
+                    batch_rows = batch_df.to_dict(orient='records')
+                    st.caption(f"{len(batch_rows)} linhas, colunas: {', '.join(batch_df.columns)}")
+                except Exception as e:
+                    st.error(f"Não foi possível ler o CSV: {e}")
+            
+            if batch_rows and task_instructions.strip():
+                try:
+                    missing = [field for field in template_fields(task_instructions) if field not in batch_rows[0]]
+                    if missing:
+                        st.error(f"Colunas ausentes no CSV: {', '.join(missing)}")
+                    else:
+                        with st.expander("Pré-visualização das instruções"):
+                            for row in batch_rows[:5]:
+                                st.code(render_template(task_instructions, row))
+                except ValueError as e:
+                    st.error(f"Modelo de instrução inválido: {e}")
+        
+        # Seleção dos modelos a comparar (apenas provedores com chave configurada)
+        ab_models = []
+        if task_mode == "Comparar modelos (A/B)":
+            configured_providers = [
+                provider for provider in ["openai", "anthropic", "azure", "gemini", "deepseek", "ollama"]
+                if provider == 'ollama' or (api_keys.get(provider) and (provider != 'azure' or api_keys.get('azure_endpoint')))
+            ]
+            model_pairs = [f"{provider}/{model}" for provider in configured_providers for model in get_llm_models(provider)]
+            ab_col1, ab_col2 = st.columns([3, 1])
+            with ab_col1:
+                selected_pairs = st.multiselect(
+                    "Modelos a comparar",
+                    options=model_pairs,
+                    help="Todos os modelos recebem a mesma instrução e executam ao mesmo tempo, cada um em um navegador isolado."
+                )
+            with ab_col2:
+                ab_repetitions = st.number_input("Repetições por modelo", min_value=1, max_value=5, value=1)
+            ab_models = [tuple(pair.split('/', 1)) for pair in selected_pairs]
+        
+        # Seleção de LLM (no modo A/B os modelos vêm da lista de comparação)
+        if task_mode == "Comparar modelos (A/B)":
+            llm_provider, selected_model = ab_models[0] if ab_models else (st.session_state.llm_provider, st.session_state.llm_model)
+        else:
+            model_col1, model_col2 = st.columns(2)
+            
+            with model_col1:
+                llm_provider = st.selectbox(
+                    "Provedor de LLM",
+                    options=["openai", "anthropic", "azure", "gemini", "deepseek", "ollama"],
+                    index=["openai", "anthropic", "azure", "gemini", "deepseek", "ollama"].index(st.session_state.llm_provider),
+                    format_func=lambda x: {
+                        'openai': 'OpenAI',
+                        'anthropic': 'Anthropic',
+                        'azure': 'Azure OpenAI',
+                        'gemini': 'Google Gemini',
+                        'deepseek': 'DeepSeek',
+                        'ollama': 'Ollama (Local)'
+                    }.get(x, x)
+                )
+                st.session_state.llm_provider = llm_provider
+            
+            with model_col2:
+                models = get_llm_models(llm_provider)
+                selected_model = st.selectbox(
+                    "Modelo",
+                    options=models,
+                    index=0 if st.session_state.llm_model not in models else models.index(st.session_state.llm_model)
+                )
+                st.session_state.llm_model = selected_model
+        
+        # Configurações de contexto e visão do agente
+        with st.expander("⚙️ Configurações do Agente"):
+            st.caption("Desativar a visão e limitar o histórico reduz a latência e os tokens por passo em tarefas baseadas em texto.")
+            settings_col1, settings_col2 = st.columns(2)
+            with settings_col1:
+                use_vision = st.checkbox(
+                    "Enviar screenshots ao modelo (visão)",
+                    value=DEFAULT_AGENT_SETTINGS['use_vision']
+                )
+                screenshot_max_width = st.number_input(
+                    "Largura máxima dos screenshots enviados (0 = original)",
+                    min_value=0,
+                    max_value=2560,
+                    value=DEFAULT_AGENT_SETTINGS['screenshot_max_width'],
+                    step=64,
+                    disabled=not use_vision
+                )
+            with settings_col2:
+                max_history_messages = st.number_input(
+                    "Máximo de mensagens de histórico no contexto (0 = todas)",
+                    min_value=0,
+                    max_value=200,
+                    value=DEFAULT_AGENT_SETTINGS['max_history_messages']
+                )
+                max_actions_per_step = st.number_input(
+                    "Máximo de ações por passo",
+                    min_value=1,
+                    max_value=20,
+                    value=DEFAULT_AGENT_SETTINGS['max_actions_per_step']
+                )
+        
+            profile_override = st.text_input(
+                "Perfil persistente do navegador",
+                placeholder="Vazio = usar o perfil padrão da configuração",
+                help="Reutiliza cookies, logins e cache de execuções anteriores com o mesmo perfil."
+            )
+            memory_limit_override = st.number_input(
+                "Teto de memória do navegador (MB, 0 = configuração global)",
+                min_value=0,
+                max_value=16384,
+                value=0,
+                step=256
             )
-            st.session_state.llm_model = selected_model
+            use_macros = st.checkbox(
+                "Reutilizar ações de execuções anteriores (macro)",
+                value=DEFAULT_AGENT_SETTINGS['use_macros'],
+                help="Se a mesma instrução já foi concluída, as ações gravadas são repetidas sem o LLM; "
+                     "o agente assume a partir do primeiro passo que divergir."
+            )
+            parallel_subtasks = st.checkbox(
+                "Dividir em subtarefas paralelas",
+                value=DEFAULT_AGENT_SETTINGS['parallel_subtasks'],
+                help="O modelo divide instruções com partes independentes (ex.: consultar vários sites) em subtarefas "
+                     "executadas ao mesmo tempo, cada uma em seu próprio contexto do navegador."
+            )
+            subtask_concurrency = st.number_input(
+                "Subtarefas simultâneas",
+                min_value=1,
+                max_value=8,
+                value=DEFAULT_AGENT_SETTINGS['subtask_concurrency'],
+                disabled=not parallel_subtasks
+            )
+            record_har = st.checkbox(
+                "Gravar tráfego de rede (HAR) para replay offline",
+                help="Permite reexecutar a tarefa depois sem acessar a rede, a partir da página de detalhes."
+            )
+            screenshot_policy = st.selectbox(
+                "Captura de screenshots",
+                options=SCREENSHOT_POLICIES,
+                format_func=lambda x: SCREENSHOT_POLICY_LABELS.get(x, x),
+                help="A política adaptativa descarta quadros quase idênticos ao anterior."
+            )
+            screenshot_crop_changes = st.checkbox(
+                "Gravar apenas a região alterada da página",
+                disabled=screenshot_policy == 'off'
+            )
+            block_profile_override = st.selectbox(
+                "Perfil de bloqueio de requisições",
+                options=[''] + list(BLOCK_PROFILES.keys()),
+                format_func=lambda x: BLOCK_PROFILE_LABELS.get(x, x) if x else "Usar configuração do navegador"
+            )
+            profiler_mode = st.selectbox(
+                "Perfilamento da execução",
+                options=PROFILER_MODES,
+                format_func=lambda x: PROFILER_LABELS.get(x, x),
+                help="Grava um flamegraph ou arquivo .prof da execução, acessível na página de detalhes."
+            )
+        
+        agent_settings = {
+            'use_vision': use_vision,
+            'screenshot_max_width': int(screenshot_max_width),
+            'max_history_messages': int(max_history_messages),
+            'max_actions_per_step': int(max_actions_per_step),
+            'block_profile': block_profile_override or None,
+            'profile_name': profile_override.strip() or None,
+            'network_mode': 'record' if record_har else 'live',
+            'memory_limit_mb': int(memory_limit_override) or None,
+            'screenshot_policy': screenshot_policy,
+            'screenshot_crop_changes': screenshot_crop_changes,
+            'use_macros': use_macros,
+            'profiler': profiler_mode,
+            'parallel_subtasks': parallel_subtasks,
+            'subtask_concurrency': int(subtask_concurrency),
+        }
         
         # Verificar se a chave API está configurada
         api_key = api_keys.get(llm_provider, '')
@@ -292,36 +919,72 @@ def create_task_page():
         
         # Verificar se as chaves necessárias estão configuradas
         api_configured = True
-        if llm_provider == 'azure' and (not api_key or not azure_endpoint):
+        if task_mode == "Comparar modelos (A/B)":
+            pass  # apenas provedores configurados são oferecidos para comparação
+        elif llm_provider == 'azure' and (not api_key or not azure_endpoint):
             st.error("Azure OpenAI requer configuração de endpoint e chave API. Configure-os na aba Configuração.")
             api_configured = False
         elif llm_provider != 'ollama' and not api_key:
             st.error(f"Chave API para {llm_provider} não configurada. Configure-a na aba Configuração.")
             api_configured = False
         
+        # Botão para criar e iniciar a comparação entre modelos
+        if task_mode == "Comparar modelos (A/B)":
+            if st.button("Comparar Modelos", type="primary", use_container_width=True, disabled=len(ab_models) < 2):
+                if not task_instructions.strip():
+                    st.error("As instruções não podem estar vazias.")
+                else:
+                    batch_id = create_ab_batch(
+                        instruction=task_instructions,
+                        models=ab_models,
+                        settings=agent_settings,
+                        repetitions=int(ab_repetitions)
+                    )
+                    start_batch(batch_id, browser_config=dict(st.session_state.browser_config))
+                    st.session_state.current_batch = batch_id
+                    st.success(f"Comparação iniciada com {len(ab_models)} modelos! Acompanhe na aba 'Lotes'.")
+        
+        # Botão para criar e iniciar o lote
+        elif task_mode == "Lote (CSV)":
+            if st.button("Criar e Executar Lote", type="primary", use_container_width=True, disabled=not api_configured):
+                if not task_instructions.strip() or not batch_rows:
+                    st.error("Informe o CSV e o modelo de instrução.")
+                else:
+                    try:
+                        batch_id = create_batch(
+                            template=task_instructions,
+                            rows=batch_rows,
+                            llm_provider=llm_provider,
+                            llm_model=selected_model,
+                            settings=agent_settings,
+                            concurrency=int(batch_concurrency),
+                            name=batch_name.strip() or None
+                        )
+                    except ValueError as e:
+                        st.error(str(e))
+                    else:
+                        start_batch(batch_id, browser_config=dict(st.session_state.browser_config))
+                        st.session_state.current_batch = batch_id
+                        st.success(f"Lote criado com {len(batch_rows)} tarefas! Acompanhe na aba 'Lotes'.")
+        
         # Botão para iniciar a tarefa
-        if st.button("Iniciar Tarefa", type="primary", use_container_width=True, disabled=not api_configured):
+        elif st.button("Iniciar Tarefa", type="primary", use_container_width=True, disabled=not api_configured,
+                       key=f"start_task_{form_nonce('create_task')}"):
             if not task_instructions.strip():
                 st.error("As instruções não podem estar vazias.")
             else:
-                # Gerar ID único para a tarefa
-                task_id = generate_unique_id()
-                
-                # Criar objeto da tarefa no banco de dados
-                with get_db_session() as session:
-                    new_task = Task(
-                        id=task_id,
-                        task=task_instructions,
-                        status='created',
-                        created_at=datetime.now(),
-                        llm_provider=llm_provider,
-                        llm_model=selected_model
-                    )
-                    session.add(new_task)
-                    session.commit()
+                # Cliques repetidos neste formulário reutilizam a tarefa já criada
+                task_id, created = create_task(
+                    task_instructions, llm_provider, selected_model, agent_settings,
+                    idempotency_key=make_idempotency_key(form_nonce('create_task'))
+                )
+                rotate_form_nonce('create_task')
                 
                 st.session_state.current_task = task_id
-                st.success(f"Tarefa criada! ID: {task_id}")
+                if created:
+                    st.success(f"Tarefa criada! ID: {task_id}")
+                else:
+                    st.info(f"Esta tarefa já foi enviada. Abrindo a tarefa existente: {task_id}")
                 
                 # Redirecionar para página de detalhes
                 time.sleep(1)
@@ -402,13 +1065,119 @@ def task_list_page():
         st.error(f"Ocorreu um erro ao carregar as tarefas: {str(e)}")
         st.code(str(e))
 
-def execute_task_thread(task_id):
+def batch_page():
+    """Página de acompanhamento dos lotes de tarefas"""
+    st.title("📦 Lotes de Tarefas")
+    
+    with get_db_session() as session:
+        batches = [
+            {
+                'id': batch.id,
+                'name': batch.name,
+                'kind': batch.kind or 'csv',
+                'template': batch.template,
+                'status': batch.status,
+                'created_at': batch.created_at,
+                'finished_at': batch.finished_at,
+                'concurrency': batch.concurrency,
+                'total_tasks': batch.total_tasks,
+            }
+            for batch in session.query(Batch).order_by(Batch.created_at.desc()).all()
+        ]
+    
+    if not batches:
+        st.info("Nenhum lote criado ainda. Use o modo 'Lote (CSV)' na aba 'Criar Tarefa'.")
+        return
+    
+    batch_ids = [batch['id'] for batch in batches]
+    selected_index = batch_ids.index(st.session_state.current_batch) if st.session_state.current_batch in batch_ids else 0
+    batch_id = st.selectbox(
+        "Lote",
+        options=batch_ids,
+        index=selected_index,
+        format_func=lambda x: next(
+            f"{'[A/B] ' if b['kind'] == 'ab' else ''}{b['name'] or b['template'][:50]} ({format_datetime(b['created_at'])})"
+            for b in batches if b['id'] == x
+        )
+    )
+    st.session_state.current_batch = batch_id
+    batch = next(b for b in batches if b['id'] == batch_id)
+    
+    st.markdown("**Modelo de instrução:**")
+    st.code(batch['template'])
+    
+    # Progresso agregado
+    progress = get_batch_progress(batch_id)
+    counts = progress['counts']
+    st.progress(progress['done'] / progress['total'] if progress['total'] else 0.0,
+                text=f"{progress['done']} de {progress['total']} tarefas concluídas")
+    count_col1, count_col2, count_col3, count_col4 = st.columns(4)
+    count_col1.metric("Aguardando", counts.get('created', 0))
+    count_col2.metric("Em execução", counts.get('running', 0))
+    count_col3.metric("Concluídas", counts.get('finished', 0))
+    count_col4.metric("Falharam", counts.get('failed', 0))
+    
+    action_col1, action_col2 = st.columns(2)
+    with action_col1:
+        if st.button("🔄 Atualizar", use_container_width=True):
+            st.experimental_rerun()
+    with action_col2:
+        # Retomar tarefas pendentes (ex.: após reinício do servidor)
+        if counts.get('created') and not is_batch_running(batch_id):
+            if st.button("▶️ Executar pendentes", use_container_width=True):
+                start_batch(batch_id, browser_config=dict(st.session_state.browser_config))
+                st.experimental_rerun()
+    
+    # Comparação entre modelos (lotes A/B)
+    if batch['kind'] == 'ab':
+        runs = pd.DataFrame(get_ab_comparison(batch_id))
+        finished_runs = runs[runs['status'].isin(['finished', 'failed'])] if not runs.empty else runs
+        if not finished_runs.empty:
+            st.markdown("### Comparação de Modelos")
+            comparison = finished_runs.assign(
+                modelo=finished_runs['provider'] + '/' + finished_runs['model'],
+                tokens=finished_runs['input_tokens'].fillna(0) + finished_runs['output_tokens'].fillna(0)
+            ).groupby('modelo').agg(
+                execucoes=('success', 'size'),
+                taxa_de_sucesso=('success', 'mean'),
+                tempo_total_s=('wall_time', 'mean'),
+                passos=('steps', 'mean'),
+                tokens=('tokens', 'mean'),
+                chamadas_llm=('llm_calls', 'mean'),
+                latencia_llm_s=('llm_latency_mean', 'mean'),
+            ).round(2).sort_values(['taxa_de_sucesso', 'tempo_total_s'], ascending=[False, True])
+            st.dataframe(comparison, use_container_width=True)
+            st.bar_chart(comparison['tempo_total_s'])
+            st.caption("Ordenado pela taxa de sucesso e, em seguida, pelo tempo total médio.")
+    
+    # Resultados por linha
+    results = get_batch_results(batch_id)
+    if results:
+        results_df = pd.DataFrame(results)
+        st.dataframe(results_df, use_container_width=True)
+        st.download_button(
+            "⬇️ Baixar resultados (CSV)",
+            data=results_df.to_csv(index=False).encode('utf-8'),
+            file_name=f"lote_{batch_id[:8]}.csv",
+            mime="text/csv"
+        )
+        
+        task_to_open = st.selectbox(
+            "Abrir detalhes de uma tarefa do lote",
+            options=[''] + [row['task_id'] for row in results],
+            format_func=lambda x: x or "Selecione..."
+        )
+        if task_to_open and st.button("Ver Detalhes"):
+            st.session_state.current_task = task_to_open
+            st.experimental_rerun()
+
+def execute_task_thread(task_id, browser_config=None, claimed=False):
     """Executa uma tarefa em uma thread separada"""
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     
     try:
-        result = loop.run_until_complete(execute_task_async(task_id))
+        result = loop.run_until_complete(execute_task_async(task_id, browser_config, claimed=claimed))
         st.session_state.task_result = result
     except Exception as e:
         st.session_state.task_result = {"error": str(e)}
@@ -416,76 +1185,9 @@ def execute_task_thread(task_id):
         st.session_state.task_running = False
         loop.close()
 
-async def execute_task_async(task_id):
+async def execute_task_async(task_id, browser_config=None, claimed=False):
     """Executa uma tarefa específica assincronamente"""
-    # Obter dados da tarefa e chaves da API do banco de dados
-    with get_db_session() as session:
-        task = session.query(Task).filter(Task.id == task_id).first()
-        api_keys = {key.provider: key.api_key for key in session.query(ApiKey).all()}
-    
-    if not task:
-        return {"error": "Tarefa não encontrada"}
-    
-    # Atualizar status para 'running'
-    with get_db_session() as session:
-        task = session.query(Task).filter(Task.id == task_id).first()
-        task.status = 'running'
-        session.commit()
-    
-    # Preparar API Key para o modelo selecionado
-    if task.llm_provider == 'azure':
-        api_key = api_keys.get('azure', '')
-        endpoint = api_keys.get('azure_endpoint', '')
-        llm_info = {
-            'provider': task.llm_provider,
-            'model': task.llm_model,
-            'api_key': api_key,
-            'endpoint': endpoint
-        }
-    else:
-        api_key = api_keys.get(task.llm_provider, '')
-        llm_info = {
-            'provider': task.llm_provider,
-            'model': task.llm_model,
-            'api_key': api_key
-        }
-    
-    # Executar o agente
-    result = await run_agent_task(
-        task_id=task_id,
-        task_instructions=task.task,
-        llm=llm_info,
-        browser_config=st.session_state.browser_config
-    )
-    
-    # Atualizar o status da tarefa no banco de dados
-    with get_db_session() as session:
-        task = session.query(Task).filter(Task.id == task_id).first()
-        task.status = result['status']
-        task.finished_at = datetime.now() if result['status'] in ['finished', 'failed'] else None
-        task.output = result.get('output', '')
-        
-        # Criar ou atualizar o histórico da tarefa
-        task_history = session.query(TaskHistory).filter(TaskHistory.task_id == task_id).first()
-        
-        if task_history:
-            task_history.steps = json.dumps(result.get('steps', []))
-            task_history.urls = json.dumps(result.get('urls', []))
-            task_history.screenshots = json.dumps(result.get('screenshots', []))
-            task_history.errors = json.dumps(result.get('errors', []))
-        else:
-            task_history = TaskHistory(
-                task_id=task_id,
-                steps=json.dumps(result.get('steps', [])),
-                urls=json.dumps(result.get('urls', [])),
-                screenshots=json.dumps(result.get('screenshots', [])),
-                errors=json.dumps(result.get('errors', []))
-            )
-            session.add(task_history)
-        
-        session.commit()
-    
-    return result
+    return await execute_task(task_id, browser_config, claimed=claimed)
 
 def task_detail_page():
     """Página de detalhes da tarefa atual"""
@@ -497,7 +1199,7 @@ def task_detail_page():
     
     # Obter tarefa e histórico do banco de dados
     with get_db_session() as session:
-        task = session.query(Task).filter(Task.id == task_id).first()
+        task = session.query(Task).options(undefer(Task.output)).filter(Task.id == task_id).first()
         
         if not task:
             st.error(f"Tarefa {task_id} não encontrada.")
@@ -515,7 +1217,8 @@ def task_detail_page():
             'llm_provider': task.llm_provider,
             'llm_model': task.llm_model,
             'task': task.task,
-            'output': task.output
+            'output': task.output,
+            'settings': json.loads(task.settings) if task.settings else {}
         }
         
         # Obter o histórico da tarefa
@@ -526,7 +1229,8 @@ def task_detail_page():
                 'steps': task_history.steps,
                 'urls': task_history.urls,
                 'screenshots': task_history.screenshots,
-                'errors': task_history.errors
+                'errors': task_history.errors,
+                'metrics': task_history.metrics
             }
     
     # Exibir cabeçalho
@@ -548,10 +1252,20 @@ def task_detail_page():
             st.info("Tarefa em execução. Aguarde a conclusão ou atualize a página para ver o progresso.")
         elif status == 'created':
             if st.button("▶️ Executar Tarefa", key="run_task", use_container_width=True):
-                if not st.session_state.task_running:
+                # Só reivindicar quando a thread vai de fato ser iniciada; a reivindicação é atômica
+                # no banco: outra aba ou sessão não executa a mesma tarefa
+                if st.session_state.task_running:
+                    st.warning("Já existe uma tarefa em execução nesta sessão.")
+                elif not claim_task(task_id):
+                    st.warning("Esta tarefa já foi iniciada em outra sessão.")
+                else:
                     st.session_state.task_running = True
                     # Iniciar thread para executar a tarefa
-                    thread = threading.Thread(target=execute_task_thread, args=(task_id,))
+                    thread = threading.Thread(
+                        target=execute_task_thread,
+                        args=(task_id, dict(st.session_state.browser_config)),
+                        kwargs={'claimed': True}
+                    )
                     thread.daemon = True
                     thread.start()
                     st.info("Iniciando execução da tarefa...")
@@ -568,16 +1282,55 @@ def task_detail_page():
             st.markdown(f"**Concluída em:** {format_datetime(task_data['finished_at'])}")
         st.markdown(f"**Modelo:** {task_data['llm_provider']} / {task_data['llm_model']}")
     
+    with col2:
+        if task_data['settings']:
+            settings = task_data['settings']
+            st.markdown(f"**Visão:** {'Sim' if settings.get('use_vision', True) else 'Não'}")
+            if settings.get('screenshot_max_width'):
+                st.markdown(f"**Largura máx. dos screenshots:** {settings['screenshot_max_width']}px")
+            st.markdown(f"**Histórico no contexto:** {settings.get('max_history_messages') or 'completo'}")
+            st.markdown(f"**Ações por passo:** {settings.get('max_actions_per_step', DEFAULT_AGENT_SETTINGS['max_actions_per_step'])}")
+            if settings.get('screenshot_policy'):
+                st.markdown(f"**Screenshots:** {SCREENSHOT_POLICY_LABELS.get(settings['screenshot_policy'], settings['screenshot_policy'])}")
+            if settings.get('profile_name'):
+                st.markdown(f"**Perfil do navegador:** {settings['profile_name']}")
+            if settings.get('network_mode') == 'record':
+                st.markdown("**Rede:** gravando HAR")
+            elif settings.get('network_mode') == 'replay':
+                st.markdown(f"**Rede:** replay offline de `{settings.get('har_source_task_id')}`")
+    
     # Instruções
     st.markdown("### Instruções")
     st.code(task_data['task'])
     
+    # Notificações por webhook desta tarefa (além das globais)
+    if status in ('created', 'running'):
+        with st.expander("🔔 Notificar por webhook"):
+            task_webhook_url = st.text_input("URL", key="task_webhook_url",
+                                             placeholder="https://exemplo.com/webhooks/tarefas")
+            if st.button("Adicionar", key="add_task_webhook"):
+                try:
+                    subscribe(task_webhook_url.strip(), task_id=task_id)
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    st.success("Você será notificado quando a tarefa terminar.")
+            for subscription in list_subscriptions(task_id, include_global=False):
+                st.caption(f"{subscription['url']} ({', '.join(subscription['events'])})")
+    
     # Se a tarefa estiver em execução, mostrar informações de progresso
     if st.session_state.task_running:
         st.info("A tarefa está sendo executada em segundo plano... Isso pode levar alguns minutos.")
         if st.button("Atualizar Status"):
             st.experimental_rerun()
     
+    # Progresso salvo da execução em andamento (usado para retomá-la após um reinício)
+    if status == 'running':
+        checkpoint = load_checkpoint(task_id, with_storage_state=False)
+        if checkpoint:
+            st.caption(f"Último checkpoint: passo {checkpoint['step']} em {format_datetime(checkpoint['updated_at'])}"
+                       + (f" | Retomada {checkpoint['resume_count']}x após reinício" if checkpoint['resume_count'] else ""))
+    
     # Se o resultado da tarefa estiver disponível na sessão, exibi-lo
     if st.session_state.task_result and not st.session_state.task_running:
         st.success("Tarefa concluída!")
@@ -597,6 +1350,7 @@ def task_detail_page():
         urls = json.loads(history_data['urls']) if history_data['urls'] else []
         screenshots = json.loads(history_data['screenshots']) if history_data['screenshots'] else []
         errors = json.loads(history_data['errors']) if history_data['errors'] else []
+        metrics = json.loads(history_data['metrics']) if history_data.get('metrics') else {}
         
         # Mostrar passos da execução
         if steps:
@@ -612,6 +1366,137 @@ def task_detail_page():
                         st.markdown("**Ação:**")
                         st.success(step['next_goal'])
         
+        # Retomada a partir de checkpoint após um reinício do processo
+        checkpoint_metrics = metrics.get('checkpoints') or {}
+        if checkpoint_metrics.get('resumed_from_step'):
+            st.info(f"Execução retomada do passo {checkpoint_metrics['resumed_from_step']} após um reinício do processo "
+                    f"({checkpoint_metrics.get('resume_count', 1)}ª retomada); os passos anteriores não foram repetidos.")
+        
+        # Subtarefas executadas em paralelo
+        subtask_metrics = metrics.get('subtasks') or []
+        if subtask_metrics:
+            st.markdown("### Subtarefas Paralelas")
+            st.caption(f"A instrução foi dividida em {len(subtask_metrics)} subtarefas independentes; "
+                       f"a duração total acompanha a subtarefa mais lenta.")
+            st.dataframe(pd.DataFrame(subtask_metrics), use_container_width=True)
+        
+        # Navegador remoto usado pela tarefa
+        remote_browser = metrics.get('remote_browser') or {}
+        if remote_browser:
+            st.caption(f"Navegador remoto: {remote_browser.get('endpoint')}"
+                       + (f" (após {remote_browser['failovers']} falha(s) de conexão)" if remote_browser.get('failovers') else ''))
+        
+        # Mostrar o replay da macro gravada
+        macro_metrics = metrics.get('macro') or {}
+        if macro_metrics:
+            st.markdown("### Replay de Macro")
+            macro_col1, macro_col2 = st.columns(2)
+            macro_col1.metric("Ações reproduzidas sem LLM",
+                              f"{macro_metrics.get('replayed_actions', 0)}/{macro_metrics.get('total_actions', 0)}")
+            macro_col2.metric("Duração do replay (s)", macro_metrics.get('duration', 0))
+            if macro_metrics.get('diverged_at') is not None:
+                st.caption(f"Divergiu na ação {macro_metrics['diverged_at'] + 1}: {macro_metrics.get('reason')}")
+        
+        # Mostrar uso de tokens por passo
+        token_usage = metrics.get('token_usage', [])
+        if token_usage:
+            st.markdown("### Uso de Tokens")
+            llm_metrics = metrics.get('llm') or {}
+            token_col1, token_col2, token_col3 = st.columns(3)
+            token_col1.metric("Tokens de entrada", llm_metrics.get('input_tokens', 0))
+            token_col2.metric("Tokens de saída", llm_metrics.get('output_tokens', 0))
+            token_col3.metric("Latência média do LLM (s)", llm_metrics.get('latency_mean') or 0)
+            st.dataframe(pd.DataFrame(token_usage), use_container_width=True)
+        
+        # Mostrar consumo de recursos do navegador
+        resources = metrics.get('resources') or {}
+        if resources.get('samples'):
+            st.markdown("### Recursos do Navegador")
+            resource_col1, resource_col2, resource_col3 = st.columns(3)
+            resource_col1.metric("Pico de memória (MB)", resources.get('peak_rss_mb', 0))
+            resource_col2.metric("Pico de CPU (%)", resources.get('peak_cpu_percent', 0))
+            resource_col3.metric("Processos (pico)", resources.get('peak_processes', 0))
+            if resources.get('exceeded'):
+                st.error(f"O navegador excedeu o teto de {resources.get('memory_limit_mb')} MB e foi encerrado.")
+        
+        # Mostrar retries e circuit breakers
+        retries = metrics.get('retries') or {}
+        if retries.get('retries') or retries.get('circuit_rejections'):
+            st.markdown("### Retries de Ações")
+            retry_col1, retry_col2, retry_col3 = st.columns(3)
+            retry_col1.metric("Retries", retries.get('retries', 0))
+            retry_col2.metric("Recuperadas após retry", retries.get('recovered', 0))
+            retry_col3.metric("Bloqueadas por circuito aberto", retries.get('circuit_rejections', 0))
+            st.caption(f"Espera total em backoff: {retries.get('backoff_seconds', 0)}s | "
+                       f"Erros transitórios: {retries.get('transient_errors', 0)} | "
+                       f"Erros permanentes: {retries.get('permanent_errors', 0)}")
+            if retries.get('circuits'):
+                st.dataframe(pd.DataFrame([
+                    {'Domínio': domain, 'Estado': circuit['state'], 'Vezes aberto': circuit['times_opened']}
+                    for domain, circuit in retries['circuits'].items()
+                ]), use_container_width=True)
+
+        # Perfil da execução (flamegraph ou .prof)
+        profiling = metrics.get('profiling') or {}
+        if profiling:
+            st.markdown("### Perfil de Execução")
+            if profiling.get('mode') == 'sampling':
+                st.caption(f"{PROFILER_LABELS['sampling']}: {profiling.get('samples', 0)} amostras a cada "
+                           f"{profiling.get('interval_ms')} ms em {profiling.get('duration')}s | "
+                           f"Custo do perfilamento: {profiling.get('overhead', 0):.2%}")
+            else:
+                st.caption(f"{PROFILER_LABELS['cprofile']}: {profiling.get('calls', 0)} chamadas em "
+                           f"{profiling.get('duration')}s")
+
+            profile_files = [
+                (profiling.get('svg'), "⬇️ Flamegraph (SVG)", 'image/svg+xml'),
+                (profiling.get('collapsed'), "⬇️ Pilhas (collapsed)", 'text/plain'),
+                (profiling.get('prof'), "⬇️ Arquivo .prof", 'application/octet-stream'),
+                (profiling.get('top'), "⬇️ Funções mais custosas", 'text/plain'),
+            ]
+            profile_files = [(path, label, mime) for path, label, mime in profile_files if path and os.path.exists(path)]
+            if not profile_files:
+                st.info("Os arquivos do perfil não estão mais disponíveis neste servidor.")
+            for column, (path, label, mime) in zip(st.columns(max(1, len(profile_files))), profile_files):
+                with open(path, 'rb') as f:
+                    column.download_button(label, f.read(), file_name=os.path.basename(path), mime=mime,
+                                           key=f"profile_{os.path.basename(path)}")
+                column.caption(f"`{path}`")
+            if profiling.get('svg') and os.path.exists(profiling['svg']):
+                with st.expander("Ver flamegraph"):
+                    with open(profiling['svg'], 'r') as f:
+                        st.markdown(f.read(), unsafe_allow_html=True)
+            if profiling.get('top') and os.path.exists(profiling['top']):
+                with st.expander("Ver funções mais custosas"):
+                    with open(profiling['top'], 'r') as f:
+                        st.code(f.read())
+
+        # Mostrar estatísticas de requisições bloqueadas
+        network = metrics.get('network') or {}
+        if network.get('blocked'):
+            st.markdown("### Requisições Bloqueadas")
+            st.markdown(f"**Perfil:** {BLOCK_PROFILE_LABELS.get(network.get('profile'), network.get('profile'))} | "
+                        f"**Bloqueadas:** {network['blocked']} de {network.get('total', 0)}")
+            if network.get('by_resource_type'):
+                st.bar_chart(pd.Series(network['by_resource_type'], name="Requisições"))
+        
+        # Replay offline a partir do HAR gravado
+        har = metrics.get('har') or {}
+        if har.get('mode') == 'record' and os.path.exists(har.get('path', '')):
+            st.markdown("### Replay Offline")
+            st.caption(f"Tráfego gravado em `{har['path']}` ({har.get('size_bytes', 0) / (1024 * 1024):.1f} MB).")
+            replay_form = f"replay_har_{task_id}"
+            if st.button("🔁 Reexecutar com replay do HAR", key=f"{replay_form}_{form_nonce(replay_form)}"):
+                replay_settings = dict(task_data['settings'])
+                replay_settings.update({'network_mode': 'replay', 'har_source_task_id': task_id})
+                replay_id, _ = create_task(
+                    task_data['task'], task_data['llm_provider'], task_data['llm_model'], replay_settings,
+                    idempotency_key=make_idempotency_key(form_nonce(replay_form))
+                )
+                rotate_form_nonce(replay_form)
+                st.session_state.current_task = replay_id
+                st.experimental_rerun()
+        
         # Mostrar URLs visitadas
         if urls:
             st.markdown("### URLs Visitadas")
@@ -622,9 +1507,22 @@ def task_detail_page():
         if screenshots:
             st.markdown("### Capturas de Tela")
             
+            screenshot_metrics = metrics.get('screenshots') or {}
+            if screenshot_metrics.get('deduplicated'):
+                st.caption(f"{screenshot_metrics['deduplicated']} de {screenshot_metrics.get('offered', 0)} "
+                           f"quadros eram repetidos e não foram gravados.")
+            # Quadros gravados apenas com a região alterada
+            regions = {frame['path']: frame for frame in screenshot_metrics.get('frames', [])
+                       if 'path' in frame and 'region' in frame}
+            
             for i, screenshot in enumerate(screenshots):
-                if os.path.exists(screenshot):
-                    st.image(screenshot, caption=f"Captura {i+1}")
+                # Caminho local ou URL pré-assinada do armazenamento (a imagem não passa por este processo)
+                image_url = resolve_url(screenshot)
+                if image_url:
+                    caption = f"Captura {i+1}"
+                    if screenshot in regions:
+                        caption += f" (região alterada {tuple(regions[screenshot]['region'])})"
+                    st.image(image_url, caption=caption)
                 else:
                     st.warning(f"Imagem não encontrada: {screenshot}")
         
@@ -638,7 +1536,47 @@ def task_detail_page():
             st.markdown("### Erros")
             for error in errors:
                 st.error(error)
-    
+
+        # Conteúdo extraído pelo agente: carregado (e descomprimido) apenas quando solicitado
+        if st.checkbox("Mostrar conteúdo extraído", key="show_extracted_content"):
+            with get_db_session() as session:
+                extracted_json = session.query(TaskHistory.extracted_content).filter(TaskHistory.task_id == task_id).scalar()
+            extracted = [content for content in (json.loads(extracted_json) if extracted_json else []) if content]
+            if not extracted:
+                st.info("Nenhum conteúdo extraído gravado para esta tarefa.")
+            for i, content in enumerate(extracted):
+                with st.expander(f"Conteúdo {i + 1}"):
+                    st.markdown(content)
+
+        # Logs da execução: carregados (e descomprimidos) apenas quando solicitados
+        if st.checkbox("Mostrar logs da execução", key="show_task_logs"):
+            with get_db_session() as session:
+                logs_blob = session.query(TaskHistory.logs).filter(TaskHistory.task_id == task_id).scalar()
+            log_records = decompress_logs(logs_blob)
+            if not log_records:
+                st.info("Nenhum log gravado para esta tarefa.")
+            else:
+                levels = sorted({record.get('level') for record in log_records})
+                selected_levels = st.multiselect("Níveis", options=levels, default=levels, key="task_log_levels")
+                logs_df = pd.DataFrame([
+                    {
+                        'Horário': record.get('ts'),
+                        'Nível': record.get('level'),
+                        'Fase': record.get('phase'),
+                        'Duração (s)': record.get('duration'),
+                        'Mensagem': record.get('message'),
+                        'Módulo': record.get('logger'),
+                    }
+                    for record in log_records if record.get('level') in selected_levels
+                ])
+                st.dataframe(logs_df, use_container_width=True)
+                st.download_button(
+                    "⬇️ Baixar logs (JSON Lines)",
+                    '\n'.join(json.dumps(record, ensure_ascii=False) for record in log_records),
+                    file_name=f"logs-{task_id}.jsonl",
+                    mime='application/x-ndjson'
+                )
+
     # Botão para voltar à lista
     if st.button("← Voltar à lista de tarefas", key="back_to_list"):
         st.session_state.current_task = None
@@ -649,9 +1587,9 @@ def main():
     # Inicializar banco de dados se necessário
     if not st.session_state.get('db_initialized', False):
         try:
-            print("Inicializando banco de dados...")
+            logger.info("Inicializando banco de dados...")
             init_db()
-            print("Banco de dados inicializado com sucesso")
+            logger.info("Banco de dados inicializado com sucesso")
             
             # Carregar configurações do navegador do banco de dados
             with get_db_session() as session:
@@ -659,12 +1597,18 @@ def main():
                 if browser_config and browser_config.api_key:
                     try:
                         st.session_state.browser_config = json.loads(browser_config.api_key)
-                        print("Configurações do navegador carregadas do banco de dados")
+                        logger.info("Configurações do navegador carregadas do banco de dados")
                     except Exception as e:
-                        print(f"Erro ao carregar configurações do navegador: {e}")
+                        logger.error(f"Erro ao carregar configurações do navegador: {e}")
+            
+            # Tarefas interrompidas por um reinício: retomar do checkpoint ou marcar como falha (uma vez por processo)
+            recovery = recover_orphaned_tasks()
+            if recovery['resumed'] or recovery['failed']:
+                st.toast(f"Tarefas interrompidas: {len(recovery['resumed'])} retomadas, "
+                         f"{len(recovery['failed'])} marcadas como falha")
             
             st.session_state.db_initialized = True
-            print("Inicialização concluída")
+            logger.info("Inicialização concluída")
         except Exception as e:
             st.error(f"Erro ao inicializar banco de dados: {e}")
     
@@ -676,7 +1620,7 @@ def main():
         st.title("🤖 Gerenciador de Agentes IA")
         
         # Menu simplificado
-        nav_options = ["Configuração", "Criar Tarefa", "Minhas Tarefas"]
+        nav_options = ["Configuração", "Criar Tarefa", "Minhas Tarefas", "Lotes"]
         if st.session_state.current_task:
             nav_options.append("Detalhes da Tarefa")
             
@@ -688,10 +1632,23 @@ def main():
     
     # Conteúdo principal
     if nav_option == "Configuração":
-        auth_page()
+        page = auth_page
     elif nav_option == "Detalhes da Tarefa" and st.session_state.current_task:
-        task_detail_page()
+        page = task_detail_page
     elif nav_option == "Minhas Tarefas":
-        task_list_page()
+        page = task_list_page
+    elif nav_option == "Lotes":
+        page = batch_page
     else:
-        create_task_page()
\ No newline at end of file
+        page = create_task_page
+    
+    # Perfilamento da renderização sob demanda: ?profile=sampling ou ?profile=cprofile na URL
+    profile_mode = st.query_params.get('profile')
+    if profile_mode not in PROFILER_MODES:
+        profile_mode = 'sampling' if profile_mode else None
+    with profile_page(page.__name__, mode=profile_mode) as profiler:
+        page()
+    if profiler is not None and profile_mode:
+        artifacts = profiler.artifacts or {}
+        st.sidebar.caption(f"Perfil desta página ({artifacts.get('duration')}s): "
+                           f"`{artifacts.get('svg') or artifacts.get('prof')}`")
\ No newline at end of file
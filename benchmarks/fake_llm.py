@@ -0,0 +1,103 @@
+"""
+LLM roteirizado e determinístico para os benchmarks.
+
+Cada chamada com ferramentas (o formato usado pelo browser_use para obter a
+próxima ação) devolve o próximo passo do roteiro como uma chamada da
+ferramenta AgentOutput. Ações que precisam do índice de um elemento usam
+`match`: o índice é resolvido procurando o trecho no estado da página
+enviado pelo agente (linhas no formato "[12]<button>Enviar</button>").
+"""
+import re
+import copy
+import time
+import asyncio
+from typing import Any, List
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+ELEMENT_LINE = re.compile(r'\[(\d+)\]<')
+
+
+def _message_text(message):
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return '\n'.join(part.get('text', '') for part in content if isinstance(part, dict))
+
+
+def resolve_element_index(messages, match):
+    """Índice do último elemento interativo cujo trecho do estado contém `match`"""
+    for message in reversed(messages):
+        for line in _message_text(message).splitlines():
+            found = ELEMENT_LINE.search(line)
+            if found and match in line:
+                return int(found.group(1))
+    raise ValueError(f"Elemento '{match}' não encontrado no estado da página")
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Modelo de chat que segue um roteiro fixo de ações, com latência simulada"""
+
+    script: List[Any]
+    latency: float = 0.0
+    position: int = 0
+
+    @property
+    def _llm_type(self):
+        return 'scripted'
+
+    def bind_tools(self, tools, tool_choice=None, **kwargs):
+        return self.bind(tools=tools, **kwargs)
+
+    def with_structured_output(self, schema, *, include_raw=False, method=None, **kwargs):
+        # O browser_use informa `method`; o roteiro sempre responde por chamada de ferramenta
+        return super().with_structured_output(schema, include_raw=include_raw)
+
+    def _next_step(self, messages):
+        if self.position < len(self.script):
+            step = copy.deepcopy(self.script[self.position])
+        else:
+            step = [{'done': {'text': 'Roteiro concluído', 'success': True}}]
+        self.position += 1
+
+        for action in step:
+            for params in action.values():
+                if isinstance(params, dict) and 'match' in params:
+                    params['index'] = resolve_element_index(messages, params.pop('match'))
+        return {
+            'current_state': {
+                'page_summary': '',
+                'evaluation_previous_goal': 'Success' if self.position > 1 else 'Unknown',
+                'memory': f"Passo {self.position} do roteiro",
+                'next_goal': ', '.join(name for action in step for name in action),
+            },
+            'action': step,
+        }
+
+    def _respond(self, messages, tools):
+        if not tools:
+            # Chamadas sem ferramentas (ex.: extração de conteúdo) recebem texto simples
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content='Conteúdo extraído'))])
+        tool = tools[0]
+        name = getattr(tool, '__name__', None) or convert_to_openai_tool(tool)['function']['name']
+        # Uso de tokens estimado (~4 caracteres por token), para exercitar as métricas de tokens
+        input_tokens = sum(len(_message_text(m)) for m in messages) // 4
+        message = AIMessage(
+            content='',
+            tool_calls=[{'name': name, 'args': self._next_step(messages), 'id': f"call_{self.position}"}],
+            usage_metadata={'input_tokens': input_tokens, 'output_tokens': 50, 'total_tokens': input_tokens + 50},
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(messages, kwargs.get('tools'))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(messages, kwargs.get('tools'))
@@ -0,0 +1,304 @@
+"""
+Teste de carga da interface Streamlit e do banco de dados.
+
+Simula vários usuários simultâneos executando as páginas reais do app.py
+(task_list_page, task_detail_page, create_task_page) com o AppTest do
+Streamlit, sobre um banco populado com o número de tarefas desejado. A
+execução de tarefas é substituída por funções vazias: apenas a camada de
+interface e o banco são medidos. O relatório traz os percentis de latência de
+cada rerun e o número de consultas SQL por página.
+
+Cada usuário roda em um processo próprio: o AppTest substitui o Runtime global
+do Streamlit a cada execução e não pode ser usado por threads paralelas.
+
+Uso:
+    python -m benchmarks.load_test --users 10 --iterations 20 --tasks 1000
+    DATABASE_URL=postgresql://... python -m benchmarks.load_test --no-seed
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import threading
+import statistics
+from pathlib import Path
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+RESULTS_DIR = Path(__file__).parent / 'results'
+
+# Peso de cada página no sorteio das ações de um usuário
+PAGE_WEIGHTS = {
+    'task_list_page': 5,
+    'task_detail_page': 4,
+    'create_task_page': 1,
+}
+
+# Contagem de consultas SQL por execução de página
+QUERY_COUNTS = {}
+_current_run = threading.local()
+_counts_lock = threading.Lock()
+
+
+@contextmanager
+def track_queries(run_id):
+    """Atribui à execução `run_id` as consultas feitas nesta thread"""
+    _current_run.run_id = run_id
+    try:
+        yield
+    finally:
+        _current_run.run_id = None
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    run_id = getattr(_current_run, 'run_id', None)
+    if run_id is not None:
+        with _counts_lock:
+            QUERY_COUNTS[run_id] = QUERY_COUNTS.get(run_id, 0) + 1
+
+
+def page_script(page, run_id, task_id=None):
+    """Script executado pelo AppTest: renderiza uma página do app com a execução desativada"""
+    import streamlit as st
+    import app
+    from benchmarks import load_test
+
+    if not getattr(app, '_load_test_stubbed', False):
+        # Nenhuma tarefa ou lote é executado de fato durante o teste de carga
+        app.execute_task_thread = lambda *args, **kwargs: None
+        app.start_batch = lambda *args, **kwargs: True
+        app._load_test_stubbed = True
+
+    st.session_state.db_initialized = True
+    app.init_session_state()
+    if task_id:
+        st.session_state.current_task = task_id
+
+    with load_test.track_queries(run_id):
+        getattr(app, page)()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Teste de carga da interface Streamlit")
+    parser.add_argument('--users', type=int, default=10, help="Usuários simultâneos")
+    parser.add_argument('--iterations', type=int, default=20, help="Ações (reruns) por usuário")
+    parser.add_argument('--tasks', type=int, default=500, help="Tarefas no banco populado")
+    parser.add_argument('--steps-per-task', type=int, default=15, help="Passos no histórico de cada tarefa")
+    parser.add_argument('--no-seed', action='store_true', help="Usar o banco existente (DATABASE_URL) sem populá-lo")
+    parser.add_argument('--create-clicks', action='store_true',
+                        help="Na página de criação, preencher e enviar o formulário (grava uma tarefa)")
+    parser.add_argument('--timeout', type=float, default=30.0, help="Tempo máximo de cada rerun (s)")
+    parser.add_argument('--seed', type=int, default=42, help="Semente do sorteio das ações")
+    parser.add_argument('--output', help="Arquivo JSON de saída (padrão: benchmarks/results/load-<data>.json)")
+    return parser.parse_args()
+
+
+def seed_database(task_count, steps_per_task):
+    """Popula o banco com tarefas concluídas e seus históricos, em inserções em massa"""
+    from db.database import get_db_session
+    from db.models import Task, TaskHistory, ApiKey
+
+    now = datetime.now()
+    tasks, histories = [], []
+    for i in range(task_count):
+        task_id = str(uuid.uuid4())
+        status = random.choice(['finished', 'finished', 'finished', 'failed', 'created'])
+        tasks.append({
+            'id': task_id,
+            'task': f"Abra https://loja.exemplo.com/produto/{i} e informe o preço e a disponibilidade do produto.",
+            'status': status,
+            'created_at': now - timedelta(minutes=task_count - i),
+            'finished_at': now - timedelta(minutes=task_count - i - 1) if status != 'created' else None,
+            'llm_provider': 'openai',
+            'llm_model': 'gpt-4o',
+            'output': f"Preço: R$ {i * 1.5:.2f}" if status == 'finished' else None,
+            'settings': json.dumps({'use_vision': False, 'max_actions_per_step': 10}),
+        })
+        if status == 'created':
+            continue
+        histories.append({
+            'task_id': task_id,
+            'steps': json.dumps([
+                {'step': s + 1, 'evaluation_previous_goal': 'Sucesso ' * 20, 'next_goal': f"Ação {s + 1}"}
+                for s in range(steps_per_task)
+            ]),
+            'urls': json.dumps([f"https://loja.exemplo.com/produto/{i}?p={s}" for s in range(steps_per_task)]),
+            'screenshots': json.dumps([]),
+            'errors': json.dumps([] if status == 'finished' else ['Timeout']),
+            'metrics': json.dumps({
+                'token_usage': [
+                    {'step': s + 1, 'input_tokens': 3000 + s * 200, 'output_tokens': 120, 'latency': 1.5}
+                    for s in range(steps_per_task)
+                ],
+                'llm': {'calls': steps_per_task, 'input_tokens': 60000, 'output_tokens': 1800, 'latency_mean': 1.5},
+            }),
+        })
+
+    with get_db_session() as session:
+        session.bulk_insert_mappings(Task, tasks)
+        session.bulk_insert_mappings(TaskHistory, histories)
+        if not session.query(ApiKey).filter(ApiKey.provider == 'openai').first():
+            session.add(ApiKey(provider='openai', api_key='sk-load-test'))
+    print(f"Banco populado com {len(tasks)} tarefas e {len(histories)} históricos")
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return round(values[index], 4)
+
+
+class SimulatedUser:
+    """Um usuário: mantém uma sessão (AppTest) por página e sorteia as ações"""
+
+    def __init__(self, user_id, task_ids, args, rng):
+        self.user_id = user_id
+        self.task_ids = task_ids
+        self.args = args
+        self.rng = rng
+        self.sessions = {}
+        self.samples = []
+
+    def _session(self, page, task_id):
+        from streamlit.testing.v1 import AppTest
+
+        key = (page, task_id)
+        if key not in self.sessions:
+            run_id = f"{self.user_id}:{page}:{task_id}"
+            self.sessions[key] = (run_id, AppTest.from_function(
+                page_script,
+                args=(page, run_id, task_id),
+                default_timeout=self.args.timeout
+            ))
+        return self.sessions[key]
+
+    def step(self):
+        page = self.rng.choices(list(PAGE_WEIGHTS), weights=list(PAGE_WEIGHTS.values()))[0]
+        task_id = self.rng.choice(self.task_ids) if page == 'task_detail_page' and self.task_ids else None
+        run_id, at = self._session(page, task_id)
+
+        with _counts_lock:
+            QUERY_COUNTS.pop(run_id, None)
+        started = time.perf_counter()
+        error = None
+        try:
+            at.run()
+            if page == 'create_task_page' and self.args.create_clicks and at.text_area:
+                at.text_area[0].input(f"Tarefa de carga {uuid.uuid4().hex[:6]}")
+                next(button for button in at.button if button.label == "Iniciar Tarefa").click()
+                at.run()
+            if at.exception:
+                error = at.exception[0].message
+        except Exception as e:
+            error = str(e)
+        latency = time.perf_counter() - started
+        with _counts_lock:
+            queries = QUERY_COUNTS.pop(run_id, 0)
+        self.samples.append({'page': page, 'latency': latency, 'queries': queries, 'error': error})
+
+    def run(self):
+        for _ in range(self.args.iterations):
+            self.step()
+        return self.samples
+
+
+def run_user(user_id, task_ids, args):
+    """Executa um usuário simulado no processo atual e retorna suas amostras"""
+    from sqlalchemy import event
+    from db.database import engine
+
+    event.listen(engine, 'before_cursor_execute', _count_query)
+    # A primeira importação do app verifica e instala dependências: fica fora da medição
+    import app  # noqa: F401
+    return SimulatedUser(user_id, task_ids, args, random.Random(args.seed + user_id)).run()
+
+
+def summarize(samples, elapsed):
+    report = {}
+    for page in PAGE_WEIGHTS:
+        page_samples = [sample for sample in samples if sample['page'] == page]
+        if not page_samples:
+            continue
+        latencies = [sample['latency'] for sample in page_samples]
+        queries = [sample['queries'] for sample in page_samples]
+        errors = [sample['error'] for sample in page_samples if sample['error']]
+        report[page] = {
+            'reruns': len(page_samples),
+            'latency_mean': round(statistics.mean(latencies), 4),
+            'latency_p50': percentile(latencies, 50),
+            'latency_p95': percentile(latencies, 95),
+            'latency_p99': percentile(latencies, 99),
+            'latency_max': percentile(latencies, 100),
+            'queries_mean': round(statistics.mean(queries), 2),
+            'queries_max': max(queries),
+            'errors': len(errors),
+            'first_error': errors[0] if errors else None,
+        }
+    return {
+        'elapsed': round(elapsed, 3),
+        'reruns_per_second': round(len(samples) / elapsed, 2) if elapsed else None,
+        'pages': report,
+    }
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+
+    if not args.no_seed and not os.environ.get('DATABASE_URL'):
+        # Banco temporário e descartável
+        db_path = Path(tempfile.mkdtemp(prefix='load_test_')) / 'load_test.db'
+        os.environ['DATABASE_URL'] = f"sqlite:///{db_path}"
+
+    from db.database import init_db, engine, get_db_session
+    from db.models import Task
+
+    init_db()
+    if not args.no_seed:
+        seed_database(args.tasks, args.steps_per_task)
+
+    with get_db_session() as session:
+        task_ids = [task_id for (task_id,) in session.query(Task.id).filter(Task.status != 'created').limit(1000)]
+    # As conexões não são compartilhadas com os processos dos usuários
+    engine.dispose()
+
+    print(f"Executando {args.users} usuários x {args.iterations} ações...")
+    started = time.perf_counter()
+    # spawn: cada usuário importa o app do zero, como uma sessão nova no servidor
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=args.users, mp_context=context) as pool:
+        futures = [pool.submit(run_user, user_id, task_ids, args) for user_id in range(args.users)]
+        samples = [sample for future in futures for sample in future.result()]
+    elapsed = time.perf_counter() - started
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'config': vars(args),
+        'database': os.environ.get('DATABASE_URL', '').split('@')[-1],
+        **summarize(samples, elapsed),
+    }
+    for page, stats in report['pages'].items():
+        print(f"{page}: p50 {stats['latency_p50']}s, p95 {stats['latency_p95']}s, "
+              f"{stats['queries_mean']} consultas/rerun, {stats['errors']} erros")
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"load-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, default=str))
+    print(f"Resultados gravados em {output}")
+
+
+if __name__ == '__main__':
+    # Usar a cópia importável do módulo: o script do AppTest importa benchmarks.load_test,
+    # e o contador de consultas precisa ser o mesmo nos dois lados
+    from benchmarks.load_test import main as module_main
+    module_main()
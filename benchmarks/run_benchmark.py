@@ -0,0 +1,219 @@
+"""
+Benchmark de ponta a ponta do run_agent_task com site local e LLM roteirizado.
+
+Para cada nível de concorrência e cenário, executa as tarefas em threads com
+event loops próprios (o mesmo modelo da aplicação) e mede vazão, latência por
+fase (LLM, inicialização do navegador, execução do agente, fechamento,
+pós-processamento e gravação no banco), memória e custo de abrir o navegador.
+O resultado é gravado em JSON para comparação entre commits.
+
+Uso:
+    python -m benchmarks.run_benchmark --concurrency 1,2,4 --iterations 3
+    python -m benchmarks.run_benchmark --scenarios form_fill --with-db --output resultado.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.site_server import start_site_server
+from benchmarks.scenarios import SCENARIOS, build_scenario
+
+RESULTS_DIR = Path(__file__).parent / 'results'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de ponta a ponta do agente")
+    parser.add_argument('--concurrency', default='1,2,4', help="Níveis de concorrência separados por vírgula")
+    parser.add_argument('--iterations', type=int, default=2, help="Tarefas por cenário em cada nível de concorrência")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Cenários separados por vírgula")
+    parser.add_argument('--llm-latency', type=float, default=0.0, help="Latência simulada de cada chamada ao LLM (s)")
+    parser.add_argument('--launch-profile', default='default', help="Perfil de flags do Chromium")
+    parser.add_argument('--block-profile', default='none', help="Perfil de bloqueio de requisições")
+    parser.add_argument('--vision', action='store_true', help="Enviar screenshots ao modelo")
+    parser.add_argument('--headed', action='store_true', help="Exibir o navegador")
+    parser.add_argument('--with-db', action='store_true', help="Gravar os resultados no banco (mede a fase db_write)")
+    parser.add_argument('--output', help="Arquivo JSON de saída (padrão: benchmarks/results/<data>.json)")
+    return parser.parse_args()
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=Path(__file__).parent, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return round(values[index], 3)
+
+
+def record_in_db(task_id, instruction, result):
+    """Cria a tarefa e grava o resultado, como a aplicação faz ao final de uma execução"""
+    from db.database import get_db_session
+    from db.models import Task
+    from utils.task_executor import save_task_result
+
+    with get_db_session() as session:
+        session.add(Task(id=task_id, task=instruction, status='running', created_at=datetime.now(),
+                         llm_provider='scripted', llm_model='benchmark'))
+    save_task_result(task_id, result)
+
+
+def run_task(scenario, base_url, args):
+    """Executa uma tarefa do cenário em um event loop novo (thread atual)"""
+    from utils.agent_runner import run_agent_task
+    from benchmarks.fake_llm import ScriptedChatModel
+
+    instruction, script = build_scenario(scenario, base_url)
+    task_id = f"bench-{scenario}-{uuid.uuid4().hex[:8]}"
+    browser_config = {
+        'headless': not args.headed,
+        'disable_security': True,
+        'highlight_elements': False,
+        'launch_profile': args.launch_profile,
+        'block_profile': args.block_profile,
+    }
+    agent_settings = {
+        'use_vision': args.vision,
+        'use_macros': False,
+        'screenshot_policy': 'off',
+    }
+
+    started = time.monotonic()
+    result = asyncio.run(run_agent_task(
+        task_id=task_id,
+        task_instructions=instruction,
+        llm={'provider': 'scripted', 'model': scenario, 'api_key': ''},
+        browser_config=browser_config,
+        agent_settings=agent_settings,
+        llm_instance=ScriptedChatModel(script=script, latency=args.llm_latency)
+    ))
+    metrics = result.get('metrics', {})
+
+    if args.with_db:
+        db_started = time.monotonic()
+        record_in_db(task_id, instruction, result)
+        metrics.setdefault('phases', {})['db_write'] = round(time.monotonic() - db_started, 3)
+
+    return {
+        'scenario': scenario,
+        'status': result['status'],
+        'success': result['status'] == 'finished' and bool(metrics.get('is_done')),
+        'wall_time': round(time.monotonic() - started, 3),
+        'phases': metrics.get('phases', {}),
+        'steps': metrics.get('agent_steps'),
+        'llm': metrics.get('llm'),
+        'resources': metrics.get('resources'),
+        'errors': result.get('errors', [])[:1] if result['status'] != 'finished' else [],
+    }
+
+
+def summarize(runs, elapsed):
+    wall_times = [run['wall_time'] for run in runs]
+    phase_names = sorted({name for run in runs for name in run['phases']})
+    peak_rss = [run['resources']['peak_rss_mb'] for run in runs if (run.get('resources') or {}).get('samples')]
+    return {
+        'tasks': len(runs),
+        'success_rate': round(sum(run['success'] for run in runs) / len(runs), 3) if runs else None,
+        'elapsed': round(elapsed, 3),
+        'throughput_per_min': round(len(runs) / elapsed * 60, 2) if elapsed else None,
+        'wall_time': {
+            'mean': round(statistics.mean(wall_times), 3) if wall_times else None,
+            'p50': percentile(wall_times, 50),
+            'p95': percentile(wall_times, 95),
+            'max': percentile(wall_times, 100),
+        },
+        'phases': {
+            name: {
+                'mean': round(statistics.mean(values), 3),
+                'p95': percentile(values, 95),
+            }
+            for name in phase_names
+            for values in [[run['phases'][name] for run in runs if name in run['phases']]]
+        },
+        # Custo de abrir o navegador e a primeira página
+        'browser_launch_mean': round(statistics.mean(
+            [run['phases']['browser_start'] for run in runs if 'browser_start' in run['phases']] or [0]
+        ), 3),
+        'peak_browser_rss_mb': max(peak_rss) if peak_rss else None,
+    }
+
+
+def main():
+    args = parse_args()
+    # Checkpoints gravariam no banco da aplicação a cada passo (mesmo sem --with-db) e o tempo
+    # de gravação entraria na fase agent_run; definido antes de importar utils.checkpoints
+    os.environ.setdefault('CHECKPOINT_EVERY_STEPS', '0')
+    from utils.logging_config import setup_logging
+    setup_logging()
+    if args.with_db and not os.environ.get('DATABASE_URL'):
+        # Banco isolado para não misturar tarefas de benchmark com as reais
+        os.environ['DATABASE_URL'] = f"sqlite:///{RESULTS_DIR / 'benchmark.db'}"
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    if args.with_db:
+        from db.database import init_db
+        init_db()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Cenários desconhecidos: {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    server, base_url = start_site_server()
+    report = {
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': vars(args),
+        'levels': [],
+    }
+
+    try:
+        for concurrency in levels:
+            for scenario in scenarios:
+                print(f"Cenário {scenario}, concorrência {concurrency}...")
+                started = time.monotonic()
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    runs = list(pool.map(
+                        lambda _: run_task(scenario, base_url, args),
+                        range(concurrency * args.iterations)
+                    ))
+                summary = summarize(runs, time.monotonic() - started)
+                report['levels'].append({'concurrency': concurrency, 'scenario': scenario, 'summary': summary, 'runs': runs})
+                print(f"  {summary['tasks']} tarefas, sucesso {summary['success_rate']}, "
+                      f"{summary['throughput_per_min']} tarefas/min, p95 {summary['wall_time']['p95']}s")
+    finally:
+        server.shutdown()
+
+    # Pico de memória deste processo (o navegador é medido pelo watchdog de cada tarefa)
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    report['harness_max_rss_mb'] = round(max_rss / 1024 if sys.platform != 'darwin' else max_rss / (1024 * 1024), 1)
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}-{report['revision'] or 'local'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, default=str))
+    print(f"Resultados gravados em {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Cenários dos benchmarks: instrução da tarefa e roteiro de ações do LLM roteirizado.
+
+Os roteiros usam {base_url} para a URL do site local e `match` para localizar
+elementos pelo trecho exibido no estado da página.
+"""
+
+SCENARIOS = {
+    # Navegação entre páginas estáticas e leitura de uma tabela longa
+    'static_navigation': {
+        'instruction': "Abra {base_url}/index.html, entre na lista de produtos e informe o preço do Produto 10.",
+        'script': [
+            [{'go_to_url': {'url': '{base_url}/index.html'}}],
+            [{'click_element': {'match': 'Lista de produtos'}}],
+            [{'scroll_down': {}}],
+            [{'done': {'text': 'Produto 10: R$ 37.00', 'success': True}}],
+        ],
+    },
+    # Preenchimento e envio de formulário
+    'form_fill': {
+        'instruction': "Abra {base_url}/form.html, preencha o formulário de contato e envie.",
+        'script': [
+            [{'go_to_url': {'url': '{base_url}/form.html'}}],
+            [
+                {'input_text': {'match': 'Seu nome', 'text': 'Maria'}},
+                {'input_text': {'match': 'Seu e-mail', 'text': 'maria@exemplo.com'}},
+                {'input_text': {'match': 'Sua mensagem', 'text': 'Mensagem de teste'}},
+            ],
+            [{'click_element': {'match': 'Enviar mensagem'}}],
+            [{'done': {'text': 'Mensagem enviada', 'success': True}}],
+        ],
+    },
+    # Conteúdo carregado por JavaScript com latência de rede
+    'dynamic_content': {
+        'instruction': "Abra {base_url}/dynamic.html, carregue mais ofertas duas vezes e informe a última oferta.",
+        'script': [
+            [{'go_to_url': {'url': '{base_url}/dynamic.html'}}],
+            [{'click_element': {'match': 'Carregar mais ofertas'}}],
+            [{'click_element': {'match': 'Carregar mais ofertas'}}],
+            [{'done': {'text': 'Oferta 30: R$ 75.00', 'success': True}}],
+        ],
+    },
+}
+
+
+def _format(value, base_url):
+    if isinstance(value, str):
+        return value.replace('{base_url}', base_url)
+    if isinstance(value, dict):
+        return {key: _format(item, base_url) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_format(item, base_url) for item in value]
+    return value
+
+
+def build_scenario(name, base_url):
+    """Retorna (instrução, roteiro) do cenário com a URL do site local"""
+    scenario = SCENARIOS[name]
+    return _format(scenario['instruction'], base_url), _format(scenario['script'], base_url)
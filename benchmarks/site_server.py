@@ -0,0 +1,52 @@
+"""
+Servidor HTTP local com as páginas de teste dos benchmarks.
+
+Serve os arquivos estáticos de benchmarks/site e uma API simples
+(/api/items) com atraso configurável, usada pela página dinâmica.
+"""
+import json
+import time
+import threading
+from pathlib import Path
+from functools import partial
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+SITE_DIR = Path(__file__).parent / 'site'
+
+
+class SiteHandler(SimpleHTTPRequestHandler):
+    """Arquivos estáticos do site de testes + API de itens com latência simulada"""
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path == '/api/items':
+            params = parse_qs(parsed.query)
+            page = int(params.get('page', ['1'])[0])
+            count = int(params.get('count', ['10'])[0])
+            time.sleep(int(params.get('delay', ['0'])[0]) / 1000)
+            items = [
+                {'name': f"Oferta {(page - 1) * count + i}", 'price': f"{((page - 1) * count + i) * 2.5:.2f}"}
+                for i in range(1, count + 1)
+            ]
+            body = json.dumps(items).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_site_server(host='127.0.0.1', port=0):
+    """Inicia o servidor em uma thread; retorna (servidor, URL base)"""
+    server = ThreadingHTTPServer((host, port), partial(SiteHandler, directory=str(SITE_DIR)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://{host}:{server.server_address[1]}"
+    print(f"Site de testes em {base_url}")
+    return server, base_url
@@ -0,0 +1,374 @@
+"""
+Execução de tarefas sem interface, para cron e pipelines de CI.
+
+Recebe uma instrução (ou um arquivo com várias), executa cada uma com
+run_agent_task e escreve um resultado JSON por linha, à medida que as tarefas
+terminam, em stdout ou no arquivo de --output. Os logs vão para stderr, para
+que stdout contenha apenas os resultados.
+
+A inicialização é rápida: o Streamlit nunca é importado, o agente e o
+navegador só são carregados depois da leitura dos argumentos, e o banco de
+dados apenas com --db. Sem --db, as chaves vêm de --api-key ou das variáveis
+de ambiente do provedor (OPENAI_API_KEY, ANTHROPIC_API_KEY,
+AZURE_OPENAI_API_KEY/AZURE_OPENAI_ENDPOINT, GEMINI_API_KEY ou GOOGLE_API_KEY,
+DEEPSEEK_API_KEY), e checkpoints e macros, que dependem do banco, ficam
+desativados. Com --db, as tarefas são gravadas no banco como as criadas pela
+interface (histórico, logs, screenshots e webhooks), e as chaves e a
+configuração do navegador salvas na página de Configuração são usadas como
+padrão.
+
+O arquivo de --file tem uma instrução por linha (linhas vazias e iniciadas por
+'#' são ignoradas) ou objetos JSON por linha com "instruction" e, opcionalmente,
+"settings". Com '-', as instruções são lidas de stdin.
+
+O código de saída é 0 se todas as tarefas terminaram com status 'finished', 1
+se alguma falhou e 130 se a execução foi interrompida. No Ctrl-C, as tarefas
+ainda não iniciadas são descartadas e as em andamento são canceladas (com --db,
+gravadas como falhas); o processo espera os navegadores fecharem, e um segundo
+Ctrl-C encerra sem esperar.
+
+Uso:
+    python cli.py "Abra example.com e retorne o título da página" --provider openai --model gpt-4o
+    python cli.py --file instrucoes.txt --concurrency 3 --output resultados.jsonl
+    cat tarefas.jsonl | python cli.py --file - --db --remote-browser ws://chrome:3000
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+import contextlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+PROVIDER_ENV_KEYS = {
+    'openai': ['OPENAI_API_KEY'],
+    'anthropic': ['ANTHROPIC_API_KEY'],
+    'azure': ['AZURE_OPENAI_API_KEY'],
+    'gemini': ['GEMINI_API_KEY', 'GOOGLE_API_KEY'],
+    'deepseek': ['DEEPSEEK_API_KEY'],
+    'ollama': [],
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Executa tarefas do agente sem interface e escreve os resultados em JSON lines")
+    parser.add_argument('instruction', nargs='?', help="Instrução da tarefa (ou use --file)")
+    parser.add_argument('--file', help="Arquivo com uma instrução ou objeto JSON por linha ('-' para stdin)")
+    parser.add_argument('--provider', default='openai', choices=list(PROVIDER_ENV_KEYS), help="Provedor do LLM")
+    parser.add_argument('--model', default='gpt-4o', help="Modelo do LLM")
+    parser.add_argument('--api-key', help="Chave da API (padrão: variável de ambiente do provedor ou chave salva, com --db)")
+    parser.add_argument('--endpoint', help="Endpoint do Azure OpenAI (padrão: AZURE_OPENAI_ENDPOINT)")
+    parser.add_argument('--concurrency', type=int, default=1, help="Tarefas simultâneas")
+    parser.add_argument('--output', help="Arquivo JSON lines de saída (padrão: stdout)")
+    parser.add_argument('--db', action='store_true', help="Gravar as tarefas e os resultados no banco de dados")
+    parser.add_argument('--headed', action='store_true', help="Exibir o navegador")
+    parser.add_argument('--width', type=int, help="Largura da janela do navegador")
+    parser.add_argument('--height', type=int, help="Altura da janela do navegador")
+    parser.add_argument('--block-profile', help="Perfil de bloqueio de requisições")
+    parser.add_argument('--launch-profile', help="Perfil de flags do Chromium")
+    parser.add_argument('--remote-browser', action='append', default=[],
+                        help="Endpoint CDP remoto no formato url[|capacidade] (pode ser repetido)")
+    parser.add_argument('--no-vision', action='store_true', help="Não enviar screenshots ao modelo")
+    parser.add_argument('--settings', help="Configurações do agente em JSON (ver DEFAULT_AGENT_SETTINGS)")
+    parser.add_argument('--log-level', default='WARNING', help="Nível dos logs escritos em stderr")
+    parser.add_argument('--log-format', choices=['json', 'text'], help="Formato dos logs (padrão: LOG_FORMAT)")
+    args = parser.parse_args(argv)
+
+    if bool(args.instruction) == bool(args.file):
+        parser.error("informe uma instrução ou --file (apenas um dos dois)")
+    if args.concurrency < 1:
+        parser.error("--concurrency deve ser pelo menos 1")
+    if args.settings:
+        try:
+            args.settings = json.loads(args.settings)
+        except ValueError as e:
+            parser.error(f"--settings não é um JSON válido: {e}")
+        if not isinstance(args.settings, dict):
+            parser.error("--settings deve ser um objeto JSON")
+    return args
+
+
+def load_instructions(args):
+    """Lista de {'instruction', 'settings'} a partir do argumento ou do arquivo"""
+    if args.instruction:
+        return [{'instruction': args.instruction, 'settings': {}}]
+
+    if args.file == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(args.file, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+
+    items = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('{'):
+            try:
+                data = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Linha {number}: JSON inválido: {e}")
+            if not isinstance(data, dict):
+                raise ValueError(f"Linha {number}: esperado um objeto JSON")
+            instruction = data.get('instruction')
+            if not isinstance(instruction, str) or not instruction.strip():
+                raise ValueError(f"Linha {number}: campo 'instruction' ausente ou não é texto")
+            settings = data.get('settings') or {}
+            if not isinstance(settings, dict):
+                raise ValueError(f"Linha {number}: campo 'settings' deve ser um objeto")
+            items.append({'instruction': instruction.strip(), 'settings': settings})
+        else:
+            items.append({'instruction': line, 'settings': {}})
+    return items
+
+
+def build_llm(args, api_keys):
+    """Informações do LLM: --api-key, depois a chave salva (com --db), depois a variável de ambiente"""
+    if args.db:
+        from utils.task_executor import build_llm_info
+        llm = build_llm_info(args.provider, args.model, api_keys)
+    else:
+        llm = {'provider': args.provider, 'model': args.model, 'api_key': '', 'rate_limits': None}
+
+    env_key = next((os.environ[name] for name in PROVIDER_ENV_KEYS[args.provider] if os.environ.get(name)), '')
+    llm['api_key'] = args.api_key or llm['api_key'] or env_key
+    if args.provider == 'azure':
+        llm['endpoint'] = args.endpoint or llm.get('endpoint') or os.environ.get('AZURE_OPENAI_ENDPOINT', '')
+        if not llm['endpoint']:
+            raise ValueError("O provedor azure requer --endpoint ou AZURE_OPENAI_ENDPOINT")
+    if args.provider != 'ollama' and not llm['api_key']:
+        raise ValueError(f"Chave da API não encontrada para o provedor {args.provider}")
+    return llm
+
+
+def build_browser_config(args, api_keys):
+    """Configuração do navegador: a salva no banco (com --db) sobrescrita pelas opções da linha de comando"""
+    browser_config = {}
+    if args.db:
+        from utils.task_executor import load_browser_config
+        browser_config = load_browser_config(api_keys)
+
+    browser_config['headless'] = not args.headed
+    if args.width:
+        browser_config['browser_window_width'] = args.width
+    if args.height:
+        browser_config['browser_window_height'] = args.height
+    if args.block_profile:
+        browser_config['block_profile'] = args.block_profile
+    if args.launch_profile:
+        browser_config['launch_profile'] = args.launch_profile
+    if args.remote_browser:
+        browser_config['remote_browsers'] = args.remote_browser
+    return browser_config
+
+
+def build_settings(args, item):
+    settings = dict(args.settings or {})
+    if args.no_vision:
+        settings['use_vision'] = False
+    if not args.db:
+        # Macros são guardadas no banco
+        settings['use_macros'] = False
+    settings.update(item['settings'])
+    return settings
+
+
+def summarize(index, task_id, instruction, result):
+    """Linha de saída de uma tarefa"""
+    metrics = result.get('metrics') or {}
+    return {
+        'index': index,
+        'task_id': task_id,
+        'instruction': instruction,
+        'status': result.get('status'),
+        'is_done': result.get('is_done', False),
+        'output': result.get('output'),
+        'urls': result.get('urls', []),
+        'errors': result.get('errors', []),
+        'screenshots': result.get('screenshots', []),
+        'metrics': {
+            'wall_time': metrics.get('wall_time'),
+            'agent_steps': metrics.get('agent_steps'),
+            'phases': metrics.get('phases'),
+            'remote_browser': metrics.get('remote_browser'),
+        },
+    }
+
+
+def failure_result(task_id, instruction, error):
+    return {
+        'id': task_id,
+        'task': instruction,
+        'status': 'failed',
+        'output': f"Erro: {error}",
+        'steps': [],
+        'errors': [str(error)],
+        'is_done': False,
+        'has_errors': True,
+        'metrics': {},
+    }
+
+
+async def run_one(args, item, llm, browser_config):
+    """Executa uma instrução; com --db, registra a tarefa e o resultado como o executor da aplicação"""
+    from utils.helpers import generate_unique_id
+    from utils.agent_runner import run_agent_task
+
+    settings = build_settings(args, item)
+    if not args.db:
+        task_id = generate_unique_id()
+        try:
+            return task_id, await run_agent_task(task_id, item['instruction'], llm, browser_config, agent_settings=settings)
+        except Exception as e:
+            return task_id, failure_result(task_id, item['instruction'], e)
+
+    from utils.task_executor import create_task, claim_task, save_task_result
+    from utils.checkpoints import register_running_task, unregister_running_task, delete_checkpoint
+    from utils.logging_config import task_log_context
+
+    task_id, _ = create_task(item['instruction'], args.provider, args.model, settings)
+    claim_task(task_id)
+    register_running_task(task_id)
+    interrupted = False
+    try:
+        with task_log_context(task_id) as task_logs:
+            try:
+                result = await run_agent_task(task_id, item['instruction'], llm, browser_config, agent_settings=settings)
+            except asyncio.CancelledError:
+                # Ctrl-C: a tarefa não pode ficar como 'running' no banco
+                interrupted = True
+                result = failure_result(task_id, item['instruction'], "execução interrompida")
+            except Exception as e:
+                result = failure_result(task_id, item['instruction'], e)
+        result['logs'] = task_logs.records
+        save_task_result(task_id, result)
+        delete_checkpoint(task_id)
+    finally:
+        unregister_running_task(task_id)
+    if interrupted:
+        raise asyncio.CancelledError()
+    return task_id, result
+
+
+# (loop, task) das tarefas em andamento, para cancelá-las no Ctrl-C
+_running = set()
+_running_lock = threading.Lock()
+
+
+def run_in_thread(args, item, llm, browser_config):
+    """Cada tarefa roda em uma thread com event loop próprio, como na aplicação"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    task = loop.create_task(run_one(args, item, llm, browser_config))
+    entry = (loop, task)
+    with _running_lock:
+        _running.add(entry)
+    try:
+        return loop.run_until_complete(task)
+    finally:
+        with _running_lock:
+            _running.discard(entry)
+        try:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+
+def cancel_running():
+    """Cancela as tarefas em andamento; o finally de run_agent_task fecha os navegadores"""
+    with _running_lock:
+        entries = list(_running)
+    for loop, task in entries:
+        try:
+            loop.call_soon_threadsafe(task.cancel)
+        except RuntimeError:
+            pass  # o loop terminou entre a cópia e o cancelamento
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        items = load_instructions(args)
+    except (OSError, ValueError) as e:
+        print(f"Erro ao ler as instruções: {e}", file=sys.stderr)
+        return 2
+    if not items:
+        print("Nenhuma instrução para executar", file=sys.stderr)
+        return 2
+
+    if not args.db:
+        # Checkpoints são gravados no banco; sem --db não há como retomar a tarefa
+        os.environ.setdefault('CHECKPOINT_EVERY_STEPS', '0')
+
+    from utils.logging_config import setup_logging, flush_logs
+    setup_logging(level=args.log_level.upper(), log_format=args.log_format, stream=sys.stderr)
+
+    api_keys = {}
+    if args.db:
+        from db.database import init_db
+        from utils.task_executor import load_api_keys
+        init_db()
+        api_keys = load_api_keys()
+    try:
+        llm = build_llm(args, api_keys)
+    except ValueError as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 2
+    browser_config = build_browser_config(args, api_keys)
+    # Carregado uma vez antes das threads: a importação verifica e instala as dependências do agente,
+    # e as mensagens dos instaladores não podem se misturar aos resultados em stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        import utils.agent_runner  # noqa: F401
+
+    output = open(args.output, 'a', encoding='utf-8') if args.output else sys.stdout
+    write_lock = threading.Lock()
+    failed = 0
+    executor = ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix='cli-task')
+    try:
+        futures = {
+            executor.submit(run_in_thread, args, item, llm, browser_config): (index, item)
+            for index, item in enumerate(items)
+        }
+        for future in as_completed(futures):
+            index, item = futures[future]
+            try:
+                task_id, result = future.result()
+            except Exception as e:
+                task_id, result = None, failure_result(None, item['instruction'], e)
+            line = summarize(index, task_id, item['instruction'], result)
+            if line['status'] != 'finished':
+                failed += 1
+            with write_lock:
+                output.write(json.dumps(line, ensure_ascii=False, default=str) + '\n')
+                output.flush()
+    except KeyboardInterrupt:
+        print("Interrompido: cancelando as tarefas em andamento (Ctrl-C novamente para sair sem esperar)", file=sys.stderr)
+        executor.shutdown(wait=False, cancel_futures=True)
+        cancel_running()
+        try:
+            executor.shutdown(wait=True)
+        except KeyboardInterrupt:
+            # As threads do executor não são daemon e prenderiam o processo na saída
+            if output is not sys.stdout:
+                output.close()
+            os._exit(130)
+        return 130
+    finally:
+        executor.shutdown(wait=False)
+        if output is not sys.stdout:
+            output.close()
+
+    if args.db:
+        # Entregas de webhook ainda na fila (o processo termina logo em seguida)
+        from utils.webhooks import get_dispatcher
+        get_dispatcher().wait(timeout=30)
+    flush_logs()
+    print(f"{len(items) - failed}/{len(items)} tarefa(s) concluída(s)", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
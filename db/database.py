@@ -1,12 +1,15 @@
 import os
+import logging
 import time
 from contextlib import contextmanager
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy_utils import database_exists, create_database
 from db.models import Base
 
+logger = logging.getLogger(__name__)
+
 # Obter URL do banco de dados da variável de ambiente ou usar SQLite por padrão
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
@@ -17,7 +20,7 @@ elif not DATABASE_URL:
     # Usar SQLite para desenvolvimento local
     DATABASE_URL = "sqlite:///./browser_agent.db"
 
-print(f"Usando banco de dados: {DATABASE_URL.split('@')[0]}@*****")
+logger.info(f"Usando banco de dados: {DATABASE_URL.split('@')[0]}@*****")
 
 # Verificar se estamos usando SQLite ou PostgreSQL
 is_sqlite = DATABASE_URL.startswith('sqlite:')
@@ -50,49 +53,71 @@ while retry_count < max_retries:
 
         # Testar conexão
         engine.connect()
-        print("Conexão com o banco de dados estabelecida com sucesso!")
+        logger.info("Conexão com o banco de dados estabelecida com sucesso!")
         break
     except Exception as e:
         retry_count += 1
-        print(f"Erro ao conectar ao banco de dados (tentativa {retry_count}/{max_retries}): {e}")
+        logger.warning(f"Erro ao conectar ao banco de dados (tentativa {retry_count}/{max_retries}): {e}")
         if retry_count < max_retries:
-            print(f"Tentando novamente em {retry_delay} segundos...")
+            logger.warning(f"Tentando novamente em {retry_delay} segundos...")
             time.sleep(retry_delay)
             retry_delay *= 1.5
         else:
-            print("Falha ao conectar ao banco de dados após várias tentativas.")
+            logger.error("Falha ao conectar ao banco de dados após várias tentativas.")
             # Se já estiver usando SQLite, apenas aceite o erro e continue
             if is_sqlite:
-                print("Usando SQLite com configurações padrão.")
+                logger.info("Usando SQLite com configurações padrão.")
                 engine = create_engine(DATABASE_URL, echo=False)
             else:
                 # Usar SQLite como fallback se PostgreSQL falhar
-                print("Usando SQLite como fallback")
+                logger.warning("Usando SQLite como fallback")
                 DATABASE_URL = "sqlite:///./browser_agent_fallback.db"
                 engine = create_engine(DATABASE_URL, echo=False)
 
 SessionFactory = sessionmaker(bind=engine)
 Session = scoped_session(SessionFactory)
 
+def add_missing_columns():
+    """Adiciona a tabelas existentes as colunas e índices novos dos modelos (migração simples, apenas colunas anuláveis)"""
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            logger.info(f"Adicionando coluna {table.name}.{column.name} ({column_type})")
+            with engine.begin() as connection:
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+        # Índices (inclusive os únicos) de colunas adicionadas depois da criação da tabela
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                logger.info(f"Criando índice {index.name}")
+                index.create(engine)
+
 def init_db():
     """Inicializa o banco de dados, criando as tabelas necessárias"""
     try:
         # Criar banco de dados se não existir (apenas PostgreSQL)
         if not is_sqlite and not database_exists(engine.url):
-            print("Banco de dados não existe, criando...")
+            logger.info("Banco de dados não existe, criando...")
             create_database(engine.url)
         
         # Criar tabelas
-        print("Criando tabelas no banco de dados...")
+        logger.debug("Criando tabelas no banco de dados...")
         Base.metadata.create_all(engine)
-        print("Banco de dados inicializado com sucesso!")
+        add_missing_columns()
+        logger.info("Banco de dados inicializado com sucesso!")
         
         return True
     except Exception as e:
-        print(f"Erro ao inicializar banco de dados: {e}")
+        logger.error(f"Erro ao inicializar banco de dados: {e}")
         # Em modo de produção, continuar mesmo com erros
         if "RAILWAY_ENVIRONMENT" in os.environ:
-            print("Ambiente de produção detectado. Continuando apesar do erro...")
+            logger.warning("Ambiente de produção detectado. Continuando apesar do erro...")
             return True
         return False
 
@@ -104,7 +129,7 @@ def get_db_session():
         yield session
         session.commit()
     except Exception as e:
-        print(f"Erro na sessão do banco de dados: {e}")
+        logger.error(f"Erro na sessão do banco de dados: {e}")
         session.rollback()
         raise
     finally:
@@ -1,7 +1,10 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey, Text, Boolean
+from sqlalchemy import Column, String, DateTime, ForeignKey, Text, Boolean, Integer, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
 
+from db.types import CompressedText
+
 Base = declarative_base()
 
 class Task(Base):
@@ -15,20 +18,49 @@ class Task(Base):
     finished_at = Column(DateTime, nullable=True)
     llm_provider = Column(String(50), nullable=False)
     llm_model = Column(String(100), nullable=False)
-    output = Column(Text, nullable=True)
+    # Carregada apenas quando acessada (a lista de tarefas não a exibe)
+    output = deferred(Column(CompressedText(), nullable=True))
+    settings = Column(Text, nullable=True)  # JSON com configurações do agente (visão, histórico, ações por passo)
+    batch_id = Column(String(36), ForeignKey('batches.id'), nullable=True, index=True)
+    batch_index = Column(Integer, nullable=True)  # posição da linha no CSV do lote
+    batch_row = Column(Text, nullable=True)  # JSON com os valores da linha do CSV usada no modelo de instrução
+    heartbeat_at = Column(DateTime, nullable=True)  # atualizado periodicamente pelo processo que executa a tarefa
+    worker_id = Column(String(100), nullable=True)  # processo (host:pid) que executa a tarefa
+    # Chave de idempotência da criação: reenvios com a mesma chave retornam a tarefa já criada
+    idempotency_key = Column(String(64), nullable=True, unique=True, index=True)
 
     def __repr__(self):
         return f"<Task(id='{self.id}', status='{self.status}')>"
 
+class Batch(Base):
+    """Modelo para representar um lote de tarefas criadas a partir de um CSV e um modelo de instrução"""
+    __tablename__ = 'batches'
+
+    id = Column(String(36), primary_key=True)
+    name = Column(String(200), nullable=True)
+    kind = Column(String(20), default='csv')  # csv (linhas de um CSV) ou ab (mesma instrução em vários modelos)
+    template = Column(Text, nullable=False)  # Instrução com marcadores {coluna}
+    status = Column(String(20), default='created')  # created, running, finished, failed
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    finished_at = Column(DateTime, nullable=True)
+    concurrency = Column(Integer, default=2)
+    total_tasks = Column(Integer, default=0)
+
+    def __repr__(self):
+        return f"<Batch(id='{self.id}', status='{self.status}')>"
+
 class TaskHistory(Base):
     """Modelo para armazenar o histórico detalhado de uma tarefa"""
     __tablename__ = 'task_history'
 
     task_id = Column(String(36), ForeignKey('tasks.id'), primary_key=True)
-    steps = Column(Text, nullable=True)  # JSON string com os passos de execução
-    urls = Column(Text, nullable=True)   # JSON string com URLs visitadas
-    screenshots = Column(Text, nullable=True)  # JSON string com caminhos para screenshots
-    errors = Column(Text, nullable=True)  # JSON string com erros encontrados
+    steps = Column(CompressedText(), nullable=True)  # JSON string com os passos de execução
+    urls = Column(CompressedText(), nullable=True)   # JSON string com URLs visitadas
+    screenshots = Column(CompressedText(), nullable=True)  # JSON string com caminhos para screenshots
+    errors = Column(CompressedText(), nullable=True)  # JSON string com erros encontrados
+    metrics = Column(CompressedText(), nullable=True)  # JSON string com métricas de execução (tokens por passo, LLM)
+    extracted_content = deferred(Column(CompressedText(), nullable=True))  # JSON string com o conteúdo extraído pelo agente
+    logs = deferred(Column(LargeBinary, nullable=True))  # registros de log da execução, JSON Lines comprimido (zlib)
 
     def __repr__(self):
         return f"<TaskHistory(task_id='{self.task_id}')>"
@@ -41,4 +73,55 @@ class ApiKey(Base):
     api_key = Column(Text, nullable=False)  # Para o provider 'browser_config', isso armazena um JSON com as configurações
 
     def __repr__(self):
-        return f"<ApiKey(provider='{self.provider}')>"
\ No newline at end of file
+        return f"<ApiKey(provider='{self.provider}')>"
+
+class ActionMacro(Base):
+    """Modelo para armazenar a sequência de ações de uma execução bem-sucedida, para replay sem o LLM"""
+    __tablename__ = 'action_macros'
+
+    id = Column(String(64), primary_key=True)  # sha256 da instrução normalizada
+    instruction = Column(Text, nullable=False)
+    actions = Column(Text, nullable=False)  # JSON com as ações gravadas (ação, parâmetros, xpath, URL)
+    source_task_id = Column(String(36), nullable=True)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    updated_at = Column(DateTime, nullable=True)
+    replay_count = Column(Integer, default=0)
+    full_replay_count = Column(Integer, default=0)  # replays sem nenhuma divergência
+
+    def __repr__(self):
+        return f"<ActionMacro(id='{self.id[:12]}')>"
+
+class TaskCheckpoint(Base):
+    """Modelo para armazenar o último checkpoint de uma tarefa em execução, para retomá-la após um reinício"""
+    __tablename__ = 'task_checkpoints'
+
+    task_id = Column(String(36), ForeignKey('tasks.id'), primary_key=True)
+    step = Column(Integer, default=0)  # passos concluídos (somando execuções anteriores retomadas)
+    url = Column(Text, nullable=True)  # URL da página atual no momento do checkpoint
+    steps = Column(CompressedText(), nullable=True)  # JSON com o resumo dos passos concluídos
+    actions = Column(CompressedText(), nullable=True)  # JSON com as ações executadas com sucesso
+    memory = Column(Text, nullable=True)  # memória do agente no último passo
+    storage_state = deferred(Column(CompressedText(), nullable=True))  # JSON do Playwright: cookies e localStorage
+    updated_at = Column(DateTime, nullable=True)
+    resume_count = Column(Integer, default=0)
+
+    def __repr__(self):
+        return f"<TaskCheckpoint(task_id='{self.task_id}', step={self.step})>"
+
+class WebhookSubscription(Base):
+    """Modelo para representar uma assinatura de webhook das mudanças de status das tarefas"""
+    __tablename__ = 'webhook_subscriptions'
+
+    id = Column(String(36), primary_key=True)
+    url = Column(Text, nullable=False)
+    secret = Column(String(128), nullable=False)  # chave do HMAC-SHA256 enviado no cabeçalho X-Webhook-Signature
+    task_id = Column(String(36), ForeignKey('tasks.id'), nullable=True, index=True)  # None = todas as tarefas
+    events = Column(String(200), nullable=False, default='finished,failed')  # status notificados, separados por vírgula
+    active = Column(Boolean, default=True)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    last_delivery_at = Column(DateTime, nullable=True)
+    last_status = Column(String(200), nullable=True)  # resposta HTTP ou erro da última entrega
+    failure_count = Column(Integer, default=0)  # entregas seguidas que falharam após todas as tentativas
+
+    def __repr__(self):
+        return f"<WebhookSubscription(id='{self.id}', task_id='{self.task_id}')>"
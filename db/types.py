@@ -0,0 +1,89 @@
+"""
+Tipos de coluna personalizados.
+
+CompressedText guarda textos grandes (saídas, históricos em JSON) comprimidos
+com zstd, se o pacote zstandard estiver instalado, ou zlib. Apenas valores
+acima de DB_COMPRESS_MIN_BYTES são comprimidos; os menores, e todos os valores
+gravados antes da compressão existir, continuam em texto puro. O valor
+comprimido é gravado em base64 após um marcador (::zstd:: ou ::zlib::), o que
+mantém a coluna como TEXT: não há migração, e a leitura distingue os dois
+formatos pelo prefixo.
+
+Variáveis de ambiente: DB_COMPRESSION (auto, zstd, zlib ou off) e
+DB_COMPRESS_MIN_BYTES.
+"""
+import os
+import zlib
+import base64
+
+from sqlalchemy.types import TypeDecorator, Text
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DB_COMPRESSION = os.environ.get('DB_COMPRESSION', 'auto').lower()
+DB_COMPRESS_MIN_BYTES = int(os.environ.get('DB_COMPRESS_MIN_BYTES', 2048))
+
+MARKERS = {
+    'zstd': '::zstd::',
+    'zlib': '::zlib::',
+}
+
+
+def _codec():
+    if DB_COMPRESSION == 'off':
+        return None
+    if DB_COMPRESSION in ('auto', 'zstd') and zstandard is not None:
+        return 'zstd'
+    return 'zlib'
+
+
+def compress_text(value, min_bytes=DB_COMPRESS_MIN_BYTES):
+    """Comprime o texto se ele passar do limite (ou se puder ser confundido com um valor comprimido)"""
+    data = value.encode('utf-8')
+    ambiguous = value.startswith(tuple(MARKERS.values()))
+    codec = _codec() or ('zlib' if ambiguous else None)
+    if codec is None or (len(data) < min_bytes and not ambiguous):
+        return value
+    if codec == 'zstd':
+        packed = zstandard.ZstdCompressor(level=3).compress(data)
+    else:
+        packed = zlib.compress(data, 6)
+    return MARKERS[codec] + base64.b64encode(packed).decode('ascii')
+
+
+def decompress_text(value):
+    """Inverso de compress_text; textos sem marcador são devolvidos como estão"""
+    if not value or not value.startswith('::'):
+        return value
+    if value.startswith(MARKERS['zlib']):
+        return zlib.decompress(base64.b64decode(value[len(MARKERS['zlib']):])).decode('utf-8')
+    if value.startswith(MARKERS['zstd']):
+        if zstandard is None:
+            raise RuntimeError("Valor comprimido com zstd, mas o pacote zstandard não está instalado")
+        packed = base64.b64decode(value[len(MARKERS['zstd']):])
+        return zstandard.ZstdDecompressor().decompress(packed).decode('utf-8')
+    return value
+
+
+class CompressedText(TypeDecorator):
+    """Coluna TEXT com compressão transparente de valores grandes"""
+
+    impl = Text
+    cache_ok = True
+
+    def __init__(self, min_bytes=DB_COMPRESS_MIN_BYTES, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_bytes = min_bytes
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return compress_text(value, self.min_bytes)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decompress_text(value)
@@ -102,4 +102,5 @@ for i in range(5):
 
 # Iniciar o Streamlit
 echo "🚀 Iniciando Streamlit com aplicativo: $APP_TO_RUN"
-streamlit run $APP_TO_RUN --server.port=$PORT --server.address=0.0.0.0 --logger.level=debug
\ No newline at end of file
+# Logs da aplicação: LOG_LEVEL/LOG_FORMAT (utils/logging_config.py); o logger do Streamlit fica em warning
+streamlit run $APP_TO_RUN --server.port=$PORT --server.address=0.0.0.0 --logger.level=${STREAMLIT_LOG_LEVEL:-warning}
\ No newline at end of file
@@ -0,0 +1,332 @@
+"""
+Macros de ações aprendidas a partir de execuções bem-sucedidas.
+
+Ao final de uma execução concluída, a sequência de ações (URL, xpath do
+elemento, parâmetros) é gravada com a instrução normalizada como chave. Na
+próxima tarefa com a mesma instrução, as ações são reproduzidas diretamente
+no navegador, validando cada passo (URL esperada, elemento único, mesmo tipo
+de elemento). Extrações são refeitas na página atual e precisam produzir o
+mesmo conteúdo gravado; o `done` gravado fornece o resultado final. Um replay
+completo monta o resultado sem o agente; na primeira divergência o replay para
+e o agente com LLM continua a partir do estado atual da página.
+"""
+import re
+import json
+import logging
+import time
+import asyncio
+import hashlib
+import unicodedata
+from datetime import datetime
+from urllib.parse import urlparse, quote_plus
+
+logger = logging.getLogger(__name__)
+
+# Ações que não dependem da página atual (a URL anterior não é validada)
+NAVIGATION_ACTIONS = {'go_to_url', 'search_google', 'open_tab'}
+
+# Ações suportadas pelo replay; as demais encerram o replay e o LLM continua
+REPLAYABLE_ACTIONS = NAVIGATION_ACTIONS | {
+    'click_element', 'input_text', 'send_keys', 'go_back', 'switch_tab',
+    'scroll_down', 'scroll_up', 'wait', 'extract_content', 'done',
+}
+
+DEFAULT_STEP_TIMEOUT_MS = 10000
+
+
+class MacroDivergence(Exception):
+    """A página não corresponde mais ao que foi gravado"""
+
+
+def normalize_instruction(text):
+    """Normaliza a instrução (acentos compostos, caixa e espaços) para uso como chave"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    return re.sub(r'\s+', ' ', text).strip().rstrip('.!')
+
+
+def macro_key(text):
+    return hashlib.sha256(normalize_instruction(text).encode('utf-8')).hexdigest()
+
+
+def run_succeeded(history):
+    """
+    Execução que pode virar macro: concluída com `done` bem-sucedido. Sem o campo de
+    sucesso (versões antigas do browser_use), exige uma execução sem erros
+    """
+    if not history.is_done():
+        return False
+    is_successful = getattr(history, 'is_successful', None)
+    if callable(is_successful):
+        success = is_successful()
+        if success is not None:
+            return bool(success)
+    return not history.has_errors()
+
+
+def actions_from_history(history):
+    """Extrai as ações executadas com sucesso do histórico do agente, na ordem"""
+    actions = []
+    for item in history.history:
+        output = getattr(item, 'model_output', None)
+        if output is None:
+            continue
+        state = getattr(item, 'state', None)
+        elements = getattr(state, 'interacted_element', None) or []
+        # O browser_use pode interromper as ações de um passo; zip considera apenas as executadas
+        for i, (action, result) in enumerate(zip(output.action, item.result or [])):
+            if getattr(result, 'error', None):
+                continue
+            data = action.model_dump(exclude_unset=True)
+            name = next((key for key, value in data.items() if value is not None), None)
+            if name is None:
+                continue
+            element = elements[i] if i < len(elements) else None
+            entry = {
+                'action': name,
+                'params': data[name],
+                # Apenas a primeira ação do passo tem a URL de partida garantida
+                'url': getattr(state, 'url', None) if i == 0 else None,
+                'xpath': getattr(element, 'xpath', None),
+                'tag': getattr(element, 'tag_name', None),
+            }
+            if name == 'extract_content':
+                # O `done` foi escrito a partir deste conteúdo: o replay confere se ele se repete
+                entry['content'] = getattr(result, 'extracted_content', None)
+            actions.append(entry)
+    return actions
+
+
+def load_macro(instruction):
+    """Retorna a macro gravada para a instrução ou None"""
+    from db.database import get_db_session
+    from db.models import ActionMacro
+
+    with get_db_session() as session:
+        macro = session.query(ActionMacro).filter(ActionMacro.id == macro_key(instruction)).first()
+        if macro is None:
+            return None
+        return {'id': macro.id, 'actions': json.loads(macro.actions), 'source_task_id': macro.source_task_id}
+
+
+def save_macro(instruction, actions, task_id):
+    """Grava (ou substitui) a macro da instrução"""
+    from db.database import get_db_session
+    from db.models import ActionMacro
+
+    key = macro_key(instruction)
+    with get_db_session() as session:
+        macro = session.query(ActionMacro).filter(ActionMacro.id == key).first()
+        if macro is None:
+            macro = ActionMacro(id=key, instruction=normalize_instruction(instruction), replay_count=0, full_replay_count=0)
+            session.add(macro)
+        macro.actions = json.dumps(actions)
+        macro.source_task_id = task_id
+        macro.updated_at = datetime.now()
+    logger.info(f"Macro gravada com {len(actions)} ações")
+    return key
+
+
+def record_replay(macro_id, full):
+    """Atualiza os contadores de uso da macro"""
+    from db.database import get_db_session
+    from db.models import ActionMacro
+
+    with get_db_session() as session:
+        macro = session.query(ActionMacro).filter(ActionMacro.id == macro_id).first()
+        if macro is not None:
+            macro.replay_count = (macro.replay_count or 0) + 1
+            if full:
+                macro.full_replay_count = (macro.full_replay_count or 0) + 1
+
+
+def _same_page(current, expected):
+    current, expected = urlparse(current or ''), urlparse(expected or '')
+    return (current.netloc, current.path.rstrip('/')) == (expected.netloc, expected.path.rstrip('/'))
+
+
+def describe_action(entry):
+    params = entry.get('params') or {}
+    details = ', '.join(f"{key}={value!r}" for key, value in params.items() if key != 'index')
+    return f"{entry['action']}({details})"
+
+
+def continuation_instructions(task_instructions, replayed):
+    """Instruções para o agente continuar a partir do ponto em que o replay parou"""
+    if not replayed:
+        return task_instructions
+    done_list = '\n'.join(f"- {describe_action(entry)}" for entry in replayed)
+    return (
+        f"{task_instructions}\n\n"
+        f"Nota: as ações abaixo já foram executadas automaticamente, repetindo uma execução anterior "
+        f"desta tarefa, e o navegador está no estado resultante. Continue a partir daqui sem repeti-las:\n"
+        f"{done_list}"
+    )
+
+
+class MacroHistory:
+    """Resultado de um replay completo, com a interface do AgentHistoryList"""
+
+    def __init__(self, replayer):
+        self.replayer = replayer
+        self.history = []  # nenhum passo do agente
+
+    def final_result(self):
+        return self.replayer.final_result
+
+    def is_successful(self):
+        return self.replayer.success
+
+    def model_actions(self):
+        return [{entry['action']: entry.get('params') or {}, 'interacted_element': None}
+                for entry in self.replayer.replayed]
+
+    def urls(self):
+        return self.replayer.urls
+
+    def extracted_content(self):
+        return self.replayer.extracted_content + [self.replayer.final_result]
+
+    def errors(self):
+        return []
+
+    def is_done(self):
+        return True
+
+    def has_errors(self):
+        return False
+
+
+class MacroReplayer:
+    """Reproduz as ações de uma macro no contexto do navegador, parando na primeira divergência"""
+
+    def __init__(self, browser_context, actions, controller=None, page_extraction_llm=None,
+                 step_timeout_ms=DEFAULT_STEP_TIMEOUT_MS):
+        self.browser_context = browser_context
+        self.actions = actions
+        self.controller = controller
+        self.page_extraction_llm = page_extraction_llm
+        self.step_timeout_ms = step_timeout_ms
+        self.replayed = []
+        self.urls = []
+        self.extracted_content = []
+        self.final_result = None
+        self.success = None
+        self.diverged_at = None
+        self.reason = None
+        self.duration = 0.0
+
+    @property
+    def complete(self):
+        """Todas as ações reproduzidas, terminando no `done`: o resultado dispensa o agente"""
+        return self.diverged_at is None and len(self.replayed) == len(self.actions) and self.final_result is not None
+
+    def history(self):
+        return MacroHistory(self)
+
+    async def _extract(self, entry):
+        if self.controller is None or self.page_extraction_llm is None:
+            raise MacroDivergence("extração sem controller ou LLM")
+        if entry.get('content') is None:
+            raise MacroDivergence("conteúdo extraído não foi gravado")
+        from utils.llm_control import llm_call_scope
+
+        action = self.controller.registry.create_action_model()(**{'extract_content': entry.get('params') or {}})
+        with llm_call_scope('macro_extract'):
+            result = await self.controller.act(action, self.browser_context, page_extraction_llm=self.page_extraction_llm)
+        if getattr(result, 'error', None):
+            raise MacroDivergence(f"extração falhou: {result.error}")
+        if (result.extracted_content or '').strip() != entry['content'].strip():
+            raise MacroDivergence("conteúdo extraído difere do gravado")
+        self.extracted_content.append(result.extracted_content)
+
+    async def _locate(self, page, entry):
+        if not entry.get('xpath'):
+            raise MacroDivergence("elemento gravado sem xpath")
+        locator = page.locator(f"xpath=/{entry['xpath'].lstrip('/')}")
+        count = await locator.count()
+        if count != 1:
+            raise MacroDivergence(f"{count} elementos encontrados para o xpath gravado")
+        await locator.wait_for(state='visible', timeout=self.step_timeout_ms)
+        if entry.get('tag'):
+            tag = await locator.evaluate('el => el.tagName.toLowerCase()')
+            if tag != entry['tag'].lower():
+                raise MacroDivergence(f"elemento é <{tag}>, esperado <{entry['tag']}>")
+        return locator
+
+    async def _execute(self, page, entry):
+        name, params = entry['action'], entry.get('params') or {}
+        timeout = self.step_timeout_ms
+        if name == 'go_to_url':
+            await page.goto(params['url'], wait_until='domcontentloaded', timeout=timeout)
+        elif name == 'search_google':
+            await page.goto(f"https://www.google.com/search?q={quote_plus(params['query'])}",
+                            wait_until='domcontentloaded', timeout=timeout)
+        elif name == 'open_tab':
+            await self.browser_context.create_new_tab(params['url'])
+        elif name == 'switch_tab':
+            await self.browser_context.switch_to_tab(params['page_id'])
+        elif name == 'go_back':
+            await page.go_back(wait_until='domcontentloaded', timeout=timeout)
+        elif name == 'click_element':
+            locator = await self._locate(page, entry)
+            await locator.click(timeout=timeout)
+        elif name == 'input_text':
+            locator = await self._locate(page, entry)
+            await locator.fill(params.get('text', ''), timeout=timeout)
+        elif name == 'send_keys':
+            await page.keyboard.press(params['keys'])
+        elif name in ('scroll_down', 'scroll_up'):
+            amount = params.get('amount') or 'window.innerHeight'
+            sign = '-' if name == 'scroll_up' else ''
+            await page.evaluate(f"window.scrollBy(0, {sign}({amount}))")
+        elif name == 'wait':
+            await asyncio.sleep(params.get('seconds', 3))
+        elif name == 'extract_content':
+            await self._extract(entry)
+        elif name == 'done':
+            self.final_result = params.get('text')
+            self.success = params.get('success', True)
+
+    async def run(self):
+        """Executa as ações; retorna a lista de ações reproduzidas"""
+        start = time.monotonic()
+        for index, entry in enumerate(self.actions):
+            try:
+                if entry['action'] not in REPLAYABLE_ACTIONS:
+                    raise MacroDivergence(f"ação '{entry['action']}' não é reproduzível")
+                if self.final_result is not None:
+                    raise MacroDivergence("ações gravadas após o 'done'")
+                page = await self.browser_context.get_current_page()
+                if entry['action'] not in NAVIGATION_ACTIONS and entry.get('url') and not _same_page(page.url, entry['url']):
+                    raise MacroDivergence(f"página atual {page.url} difere da gravada {entry['url']}")
+                await self._execute(page, entry)
+                page = await self.browser_context.get_current_page()
+                try:
+                    await page.wait_for_load_state('domcontentloaded', timeout=self.step_timeout_ms)
+                except Exception:
+                    pass
+                if page.url not in self.urls:
+                    self.urls.append(page.url)
+            except Exception as e:
+                self.diverged_at = index
+                self.reason = str(e)
+                logger.warning(f"Replay da macro divergiu na ação {index + 1} ({entry['action']}): {e}")
+                break
+            self.replayed.append(entry)
+        else:
+            if self.final_result is None:
+                # Macros gravadas antes do `done` ser registrado: o agente conclui a tarefa
+                self.diverged_at = len(self.actions)
+                self.reason = "macro sem a ação 'done'"
+        self.duration = time.monotonic() - start
+        logger.info(f"Replay da macro: {len(self.replayed)}/{len(self.actions)} ações em {self.duration:.1f}s")
+        return self.replayed
+
+    def stats(self):
+        return {
+            'total_actions': len(self.actions),
+            'replayed_actions': len(self.replayed),
+            'diverged_at': self.diverged_at,
+            'reason': self.reason,
+            'duration': round(self.duration, 2),
+        }
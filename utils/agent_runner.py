@@ -1,11 +1,40 @@
 import os
 import json
+import time
 import asyncio
+import logging
 from datetime import datetime
 import tempfile
 from pathlib import Path
 import traceback
 
+from utils.llm_control import get_llm_stats, get_llm_calls, set_context_budget, instrument_llm
+from utils.profiling import start_task_profiler
+
+logger = logging.getLogger(__name__)
+
+# Configurações padrão de contexto e visão por tarefa
+DEFAULT_AGENT_SETTINGS = {
+    'use_vision': True,
+    'screenshot_max_width': 0,  # 0 = enviar screenshots no tamanho original
+    'max_history_messages': 0,  # 0 = manter todo o histórico
+    'max_actions_per_step': 10,
+    'block_profile': None,  # None = usar o perfil da configuração do navegador
+    'block_url_patterns': None,  # padrões extras da tarefa, somados aos da configuração do navegador
+    'profile_name': None,  # None = usar o perfil padrão da configuração do navegador
+    'network_mode': 'live',  # live, record (gravar HAR) ou replay (reproduzir HAR sem rede)
+    'har_source_task_id': None,  # tarefa cujo HAR será reproduzido no modo replay
+    'memory_limit_mb': None,  # None = usar o teto de memória da configuração do navegador
+    'launch_profile': None,  # None = usar o perfil de flags da configuração do navegador
+    'screenshot_policy': 'adaptive',  # adaptive, every_step ou off
+    'screenshot_crop_changes': False,  # gravar apenas a região alterada da página
+    'use_macros': True,  # reproduzir/gravar macros de ações para instruções repetidas
+    'profiler': 'off',  # off, sampling ou cprofile (ver utils/profiling.py)
+    'parallel_subtasks': False,  # dividir a instrução em subtarefas independentes (ver utils/subtasks.py)
+    'max_subtasks': 4,
+    'subtask_concurrency': 3,  # agentes (contextos de navegador) simultâneos
+}
+
 # Importar instaladores dinâmicos
 try:
     from install_langchain import setup_langchain
@@ -28,7 +57,7 @@ try:
     from browser_use.browser.context import BrowserContextConfig
     from utils.browser_config import get_browser_config
 except ImportError as e:
-    print(f"Erro ao importar pacotes do browser_use: {e}")
+    logger.warning(f"Erro ao importar pacotes do browser_use: {e}")
     # Definir funções de fallback para evitar erros fatais
     class Browser:
         def __init__(self, config):
@@ -37,7 +66,7 @@ except ImportError as e:
             pass
     
     class Agent:
-        def __init__(self, task, llm, browser):
+        def __init__(self, task, llm, browser, **kwargs):
             self.task = task
             self.llm = llm
             self.browser = browser
@@ -54,23 +83,28 @@ except ImportError as e:
                 'has_errors': lambda: True
             }
 
-def get_llm_instance(provider, model, api_key, endpoint=None):
-    """Retorna uma instância do LLM configurado"""
+def get_llm_instance(provider, model, api_key, endpoint=None, rate_limits=None, hedge=None):
+    """
+    Retorna uma instância do LLM configurado, com limitação de taxa compartilhada por provedor.
+    
+    Se `hedge` estiver habilitado, chamadas mais lentas que o percentil configurado
+    disparam uma requisição duplicada (no mesmo modelo ou no modelo de fallback).
+    """
     try:
         if provider == 'openai':
             from langchain_openai import ChatOpenAI
             os.environ["OPENAI_API_KEY"] = api_key
-            return ChatOpenAI(model=model, temperature=0.0)
+            llm = ChatOpenAI(model=model, temperature=0.0)
             
         elif provider == 'anthropic':
             from langchain_anthropic import ChatAnthropic
             os.environ["ANTHROPIC_API_KEY"] = api_key
-            return ChatAnthropic(model_name=model, temperature=0.0)
+            llm = ChatAnthropic(model_name=model, temperature=0.0)
             
         elif provider == 'azure':
             from langchain_openai import AzureChatOpenAI
             from pydantic import SecretStr
-            return AzureChatOpenAI(
+            llm = AzureChatOpenAI(
                 model=model,
                 api_version='2024-10-21',
                 azure_endpoint=endpoint,
@@ -81,109 +115,384 @@ def get_llm_instance(provider, model, api_key, endpoint=None):
             from langchain_google_genai import ChatGoogleGenerativeAI
             from pydantic import SecretStr
             os.environ["GEMINI_API_KEY"] = api_key
-            return ChatGoogleGenerativeAI(model=model, api_key=SecretStr(api_key))
+            llm = ChatGoogleGenerativeAI(model=model, api_key=SecretStr(api_key))
             
         elif provider == 'deepseek':
             from langchain_openai import ChatOpenAI
             from pydantic import SecretStr
-            return ChatOpenAI(base_url='https://api.deepseek.com/v1', model=model, api_key=SecretStr(api_key))
+            llm = ChatOpenAI(base_url='https://api.deepseek.com/v1', model=model, api_key=SecretStr(api_key))
             
         elif provider == 'ollama':
             from langchain_ollama import ChatOllama
-            return ChatOllama(model=model, num_ctx=32000)
+            llm = ChatOllama(model=model, num_ctx=32000)
         
         else:
             # Por padrão, usar OpenAI
             from langchain_openai import ChatOpenAI
             os.environ["OPENAI_API_KEY"] = api_key
-            return ChatOpenAI(model=model, temperature=0.0)
+            llm = ChatOpenAI(model=model, temperature=0.0)
     except Exception as e:
-        print(f"Erro ao criar instância LLM ({provider}/{model}): {e}")
+        logger.error(f"Erro ao criar instância LLM ({provider}/{model}): {e}")
         # Retornar um objeto dummy que apenas registra o erro
         class DummyLLM:
             def __call__(self, *args, **kwargs):
                 return f"Erro: {e}"
         return DummyLLM()
+    
+    # Limitador compartilhado por todas as tarefas que usam o mesmo provedor/chave
+    from utils.rate_limiter import get_provider_limiter
+    from utils.llm_control import instrument_llm, HedgePolicy, get_latency_tracker
+    limiter = get_provider_limiter(provider, api_key, **(rate_limits or {}))
+    
+    hedge_policy = None
+    if hedge and hedge.get('enabled'):
+        fallback = None
+        fallback_provider = hedge.get('fallback_provider') or provider
+        fallback_model = hedge.get('fallback_model')
+        if fallback_model:
+            if fallback_provider != provider:
+                # As ferramentas já vêm formatadas para o provedor principal
+                logger.warning(f"Hedging com provedor diferente ({fallback_provider}) pode ser incompatível com as ferramentas de {provider}")
+            fallback = get_llm_instance(
+                fallback_provider,
+                fallback_model,
+                hedge.get('fallback_api_key') or api_key,
+                hedge.get('fallback_endpoint') or endpoint,
+                rate_limits=rate_limits if fallback_provider == provider else None
+            )
+        hedge_policy = HedgePolicy(
+            get_latency_tracker(provider, model),
+            percentile=hedge.get('percentile', 95),
+            min_samples=hedge.get('min_samples', 20),
+            min_delay=hedge.get('min_delay', 1.0),
+            max_delay=hedge.get('max_delay', 60.0),
+            fallback=fallback
+        )
+    
+    return instrument_llm(llm, limiter=limiter, hedge=hedge_policy)
+
+def _end_phase(metrics, name, started):
+    """Registra a duração de uma fase da execução e retorna o início da próxima"""
+    now = time.monotonic()
+    metrics['phases'][name] = round(now - started, 3)
+    logger.info(f"Fase {name} concluída em {metrics['phases'][name]}s",
+                extra={'phase': name, 'duration': metrics['phases'][name]})
+    return now
+
+async def _close_browser(browser, browser_context):
+    """Fecha contexto e navegador, ignorando erros (o processo pode já ter sido encerrado)"""
+    for closable in (browser_context, browser):
+        if closable is None:
+            continue
+        try:
+            await closable.close()
+        except Exception as e:
+            logger.warning(f"Erro ao fechar navegador: {e}")
 
-async def run_agent_task(task_id, task_instructions, llm, browser_config, save_path=None):
-    """Executa uma tarefa de agente de forma assíncrona"""
+async def run_agent_task(task_id, task_instructions, llm, browser_config, save_path=None, agent_settings=None,
+                         llm_instance=None, checkpoint=None):
+    """
+    Executa uma tarefa de agente de forma assíncrona.
+    
+    `llm_instance` substitui o modelo descrito em `llm` (usado pelos benchmarks com um LLM roteirizado).
+    `checkpoint` (de utils.checkpoints.load_checkpoint) retoma uma execução interrompida.
+    """
+    settings = {**DEFAULT_AGENT_SETTINGS, **(agent_settings or {})}
+    metrics = {'settings': settings, 'phases': {}}
+    profile_lease = None
+    browser_lease = None
+    browser = None
+    browser_context = None
+    watchdog = None
+    watchdog_task = None
+    controller = None
+    checkpointer = None
+    profiler = start_task_profiler(task_id, settings)
+    started = phase_started = time.monotonic()
     try:
-        print(f"Iniciando tarefa {task_id}")
+        logger.info(f"Iniciando tarefa {task_id}")
         
         # Criar diretório para armazenar screenshots
         screenshot_dir = Path(tempfile.gettempdir()) / "browser_agent_screenshots" / task_id
         screenshot_dir.mkdir(parents=True, exist_ok=True)
-        print(f"Diretório de screenshots criado: {screenshot_dir}")
+        logger.debug(f"Diretório de screenshots criado: {screenshot_dir}")
         
         # Configurar o modelo LLM
-        llm_instance = get_llm_instance(
-            llm['provider'], 
-            llm['model'], 
-            llm['api_key'], 
-            llm.get('endpoint')
+        if llm_instance is not None:
+            llm_instance = instrument_llm(llm_instance)
+        else:
+            llm_instance = get_llm_instance(
+                llm['provider'], 
+                llm['model'], 
+                llm['api_key'], 
+                llm.get('endpoint'),
+                rate_limits=llm.get('rate_limits'),
+                hedge=llm.get('hedge')
+            )
+        set_context_budget(
+            llm_instance,
+            max_history_messages=settings['max_history_messages'],
+            screenshot_max_width=settings['screenshot_max_width'] if settings['use_vision'] else None
         )
-        print(f"LLM configurado: {llm['provider']}/{llm['model']}")
+        logger.info(f"LLM configurado: {llm['provider']}/{llm['model']}")
+        phase_started = _end_phase(metrics, 'llm_setup', phase_started)
+        
+        # Planejamento opcional: subtarefas independentes rodam em paralelo, cada uma em seu contexto.
+        # Não se aplica a retomadas nem à gravação de HAR (um único arquivo por tarefa)
+        subtasks = []
+        if settings['parallel_subtasks'] and not checkpoint and settings['network_mode'] != 'record':
+            from utils.subtasks import plan_subtasks
+            subtasks = await plan_subtasks(llm_instance, task_instructions, settings['max_subtasks'])
+            phase_started = _end_phase(metrics, 'planning', phase_started)
+        
+        # Perfil de flags de inicialização: sobrescrita da tarefa ou configuração global
+        if settings.get('launch_profile'):
+            browser_config = {**browser_config, 'launch_profile': settings['launch_profile']}
         
         # Configurar o navegador usando a configuração otimizada
         try:
             from utils.browser_config import get_browser_config
-            browser_conf = get_browser_config(browser_config)
-            print("Configuração do navegador carregada")
+            browser_conf = get_browser_config(browser_config, task_id=task_id)
+            logger.debug("Configuração do navegador carregada")
         except ImportError:
             # Configuração de fallback se não puder importar
             browser_conf = BrowserConfig(
                 headless=True,
                 disable_security=True
             )
-            print("Usando configuração de fallback para o navegador")
-        
-        # Iniciar o navegador
-        print("Iniciando navegador...")
-        browser = Browser(config=browser_conf)
-        print("Navegador iniciado com sucesso")
-        
-        # Configurar e executar o agente
-        print("Configurando agente...")
-        agent = Agent(
-            task=task_instructions,
-            llm=llm_instance,
-            browser=browser,
+            logger.warning("Usando configuração de fallback para o navegador")
+        
+        # Iniciar o navegador: remoto (pool de endpoints CDP, ver utils/browser_pool.py) ou local.
+        # Perfis persistentes dependem de um diretório local e sempre usam o navegador local
+        logger.debug("Iniciando navegador...")
+        from utils.browser_pool import get_browser_pool, NoBrowserAvailable
+        uses_profile = bool(settings.get('profile_name') or browser_config.get('profile_name'))
+        browser_pool = None if uses_profile else get_browser_pool(browser_config)
+        if browser_pool:
+            try:
+                browser, browser_lease = await browser_pool.connect(
+                    browser_config,
+                    timeout=browser_config.get('remote_browser_timeout', 60)
+                )
+                metrics['remote_browser'] = browser_lease.stats()
+            except NoBrowserAvailable:
+                if not browser_config.get('remote_browser_fallback_local'):
+                    raise
+                logger.warning("Nenhum navegador remoto disponível; usando um navegador local")
+        if browser is None:
+            if uses_profile:
+                # O contexto persistente do perfil lança o Chromium; não iniciar um segundo navegador
+                from utils.browser_context import ProfileBrowser
+                browser = ProfileBrowser(config=browser_conf)
+            else:
+                browser = Browser(config=browser_conf)
+        logger.info("Navegador iniciado com sucesso")
+        
+        # Criar o contexto com interceptação de requisições (perfil global + sobrescritas da tarefa)
+        from utils.browser_config import get_request_blocker
+        from utils.browser_context import ManagedBrowserContext
+        blocker = get_request_blocker(browser_config, {
+            'block_profile': settings.get('block_profile'),
+            'block_url_patterns': settings.get('block_url_patterns'),
+        })
+        
+        # Perfil persistente (cookies, logins e cache HTTP) com uso exclusivo pela tarefa
+        persistent_options = None
+        profile_name = settings.get('profile_name') or browser_config.get('profile_name')
+        if profile_name:
+            from utils.browser_profiles import ProfileLease
+            from utils.browser_config import get_persistent_context_options
+            profile_lease = await ProfileLease(profile_name).acquire(
+                timeout=browser_config.get('profile_lock_timeout', 60)
+            )
+            persistent_options = get_persistent_context_options(browser_config, profile_lease, task_id=task_id)
+            metrics['profile'] = profile_lease.name
+            if blocker.enabled:
+                logger.info("Bloqueio de requisições ativo: o cache HTTP do perfil não é usado nesta tarefa")
+        
+        # Gravação ou replay do tráfego de rede em HAR
+        hooks = [blocker.attach]
+        context_config = browser_conf.new_context_config
+        har_archive = None
+        if settings['network_mode'] in ('record', 'replay'):
+            from utils.har_archive import HarArchive, get_har_path, fast_replay_config
+            if settings['network_mode'] == 'record':
+                har_archive = HarArchive('record', get_har_path(task_id))
+            else:
+                har_archive = HarArchive('replay', get_har_path(settings['har_source_task_id']))
+                context_config = fast_replay_config(context_config)
+            # Registrado por último para tratar as requisições antes do bloqueador
+            hooks.append(har_archive.attach)
+        
+        # Política de screenshots: o quadro do estado de cada passo é deduplicado ao final do passo;
+        # sem visão, apenas quando a página mudou
+        from utils.screenshot_policy import ScreenshotPolicy
+        screenshot_policy = ScreenshotPolicy(
+            screenshot_dir,
+            task_id,
+            mode=settings['screenshot_policy'],
+            crop_changes=settings['screenshot_crop_changes'],
+            vision=settings['use_vision']
         )
+        step_hooks = []
+        if screenshot_policy.mode != 'off':
+            if not settings['use_vision']:
+                hooks.append(screenshot_policy.attach)
+            step_hooks.append(screenshot_policy.after_step)
         
-        # Executar o agente e obter o histórico
-        print("Executando agente...")
-        history = await agent.run()
-        print("Execução do agente concluída")
+        # Checkpoints periódicos para retomar a tarefa se o processo for reiniciado
+        from utils.checkpoints import TaskCheckpointer, CHECKPOINT_EVERY_STEPS, resume_instructions
+        checkpointer = TaskCheckpointer(task_id, previous=checkpoint)
+        if CHECKPOINT_EVERY_STEPS > 0 and not subtasks:
+            step_hooks.append(checkpointer.after_step)
+        if checkpoint and checkpoint.get('storage_state'):
+            hooks.append(checkpointer.restore)
         
-        # Fechar o navegador
-        print("Fechando navegador...")
-        await browser.close()
-        print("Navegador fechado")
-        
-        # Copiar screenshots para o diretório temporário se existirem
-        print("Processando screenshots...")
-        screenshot_paths = []
-        for src_path in history.screenshots():
-            if os.path.exists(src_path):
-                # Criar nome de arquivo com base no original
-                screenshot_filename = f"{task_id}_{os.path.basename(src_path)}"
-                dst_path = screenshot_dir / screenshot_filename
-                
-                # Copiar o arquivo se possível
+        browser_context = ManagedBrowserContext(
+            browser=browser,
+            config=context_config,
+            hooks=hooks,
+            persistent_options=persistent_options
+        )
+        # Abrir o navegador e a primeira página aqui (o browser_use o faria no primeiro passo)
+        # para medir o custo de inicialização separado da execução do agente
+        if hasattr(browser_context, 'get_current_page'):
+            page = await browser_context.get_current_page()
+            if checkpoint and checkpoint.get('url'):
                 try:
-                    import shutil
-                    shutil.copy2(src_path, dst_path)
-                    screenshot_paths.append(str(dst_path))
-                    print(f"Screenshot copiado: {dst_path}")
+                    await page.goto(checkpoint['url'], wait_until='domcontentloaded')
                 except Exception as e:
-                    print(f"Erro ao copiar screenshot: {e}")
-                    screenshot_paths.append(src_path)
+                    logger.warning(f"Erro ao reabrir a página do checkpoint ({checkpoint['url']}): {e}")
+        phase_started = _end_phase(metrics, 'browser_start', phase_started)
+        
+        # Ações com retry (backoff exponencial) e circuit breakers por domínio
+        from utils.browser_config import create_controller_with_retry
+        controller = create_controller_with_retry(browser_config)
+        
+        # Reproduzir sem o LLM a macro gravada para a mesma instrução; o agente continua da divergência
+        macro = None
+        macro_replayer = None
+        agent_instructions = task_instructions
+        if checkpoint:
+            # Retomada: o agente continua do checkpoint, sem replay de macro
+            logger.info(f"Retomando a tarefa a partir do passo {checkpoint['step']}")
+            agent_instructions = resume_instructions(task_instructions, checkpoint)
+        elif settings['use_macros'] and not subtasks:
+            from utils.action_macros import load_macro, MacroReplayer, continuation_instructions
+            try:
+                macro = load_macro(task_instructions)
+            except Exception as e:
+                logger.error(f"Erro ao carregar macro: {e}")
+            if macro:
+                logger.info(f"Macro encontrada com {len(macro['actions'])} ações; reproduzindo sem o LLM...")
+                macro_replayer = MacroReplayer(browser_context, macro['actions'], controller=controller,
+                                               page_extraction_llm=llm_instance)
+                await macro_replayer.run()
+                agent_instructions = continuation_instructions(task_instructions, macro_replayer.replayed)
+                metrics['macro'] = {'id': macro['id'], **macro_replayer.stats()}
+                phase_started = _end_phase(metrics, 'macro_replay', phase_started)
+        
+        if macro_replayer is not None and macro_replayer.complete:
+            # Replay completo até o `done`: o resultado é montado sem o agente e sem o LLM de decisão
+            logger.info("Macro reproduzida por completo; agente dispensado")
+            history = macro_replayer.history()
+        else:
+            # Configurar e executar o agente
+            logger.debug("Configurando agente...")
+            from utils.managed_agent import ManagedAgent
+        
+            def make_agent(instructions, context):
+                return ManagedAgent(
+                    task=instructions,
+                    llm=llm_instance,
+                    browser=browser,
+                    browser_context=context,
+                    use_vision=settings['use_vision'],
+                    max_actions_per_step=settings['max_actions_per_step'],
+                    controller=controller,
+                    step_hooks=step_hooks,
+                )
+        
+            if subtasks:
+                from utils.subtasks import SubtaskRunner
+                from utils.checkpoints import apply_storage_state
+            
+                async def make_subtask_context(index):
+                    # A primeira subtarefa usa o contexto já aberto; as demais ganham contextos novos
+                    if index == 0:
+                        return browser_context
+                    subtask_hooks = list(hooks)
+                    if persistent_options:
+                        # Só um contexto pode usar o diretório do perfil: os demais recebem os cookies e o localStorage dele
+                        session = await browser_context.get_session()
+                        state = await session.context.storage_state()
+                        subtask_hooks.append(lambda context: apply_storage_state(context, state))
+                    return ManagedBrowserContext(browser=browser, config=context_config, hooks=subtask_hooks)
+            
+                runner = SubtaskRunner(
+                    subtasks,
+                    make_context=make_subtask_context,
+                    make_agent=make_agent,
+                    concurrency=settings['subtask_concurrency'],
+                    shared_context=browser_context
+                )
+                agent_coroutine = runner.run()
             else:
-                print(f"Screenshot não encontrado: {src_path}")
-                screenshot_paths.append(src_path)
+                agent_coroutine = make_agent(agent_instructions, browser_context).run()
+        
+            # Executar o agente sob o watchdog de memória do navegador
+            logger.debug("Executando agente...")
+            from utils.resource_watchdog import ResourceWatchdog, MemoryLimitExceeded, DEFAULT_MEMORY_LIMIT_MB
+            agent_run = asyncio.ensure_future(agent_coroutine)
+            watchdog = ResourceWatchdog(
+                task_id,
+                memory_limit_mb=settings.get('memory_limit_mb') or browser_config.get('memory_limit_mb', DEFAULT_MEMORY_LIMIT_MB),
+                on_exceeded=agent_run.cancel
+            )
+            watchdog_task = asyncio.ensure_future(watchdog.run())
+            try:
+                history = await agent_run
+            except asyncio.CancelledError:
+                if watchdog.exceeded:
+                    raise MemoryLimitExceeded(
+                        f"O navegador excedeu o teto de memória de {watchdog.memory_limit_mb} MB e foi encerrado"
+                    )
+                raise
+            logger.info("Execução do agente concluída")
+            phase_started = _end_phase(metrics, 'agent_run', phase_started)
+        
+        # Fechar o navegador
+        logger.debug("Fechando navegador...")
+        await _close_browser(browser, browser_context)
+        browser = browser_context = None
+        logger.debug("Navegador fechado")
+        phase_started = _end_phase(metrics, 'browser_close', phase_started)
+        logger.info(f"Requisições bloqueadas: {blocker.counters['blocked']}/{blocker.counters['total']}")
+        
+        # Gravar a macro da execução bem-sucedida (ações reproduzidas + ações decididas pelo LLM);
+        # execuções com erro ou com done malsucedido não viram macro, que seria reproduzida sem o LLM.
+        # Após um replay completo a macro é mantida, para não acumular ações extras do LLM
+        if settings['use_macros'] and not checkpoint and not subtasks:
+            from utils.action_macros import actions_from_history, save_macro, record_replay, run_succeeded
+            try:
+                if not run_succeeded(history):
+                    logger.info("Execução sem sucesso; macro não gravada")
+                else:
+                    if macro_replayer:
+                        record_replay(macro['id'], macro_replayer.complete)
+                    if not (macro_replayer and macro_replayer.complete):
+                        recorded = (macro_replayer.replayed if macro_replayer else []) + actions_from_history(history)
+                        if recorded:
+                            save_macro(task_instructions, recorded, task_id)
+            except Exception as e:
+                logger.error(f"Erro ao gravar macro: {e}")
+        
+        screenshot_paths = screenshot_policy.saved_paths()
+        logger.info(f"Screenshots gravados: {len(screenshot_paths)} "
+                    f"({screenshot_policy.counters['deduplicated']} repetidos ignorados)")
         
         # Preparar resultado
-        print("Preparando resultado...")
+        logger.debug("Preparando resultado...")
         result = {
             'id': task_id,
             'task': task_instructions,
@@ -191,7 +500,8 @@ async def run_agent_task(task_id, task_instructions, llm, browser_config, save_p
             'created_at': datetime.now().isoformat(),
             'finished_at': datetime.now().isoformat(),
             'output': history.final_result(),
-            'steps': [
+            # Numa retomada, os passos das execuções interrompidas vêm antes
+            'steps': checkpointer.merge_steps([
                 {
                     'id': f"step-{i}",
                     'step': i,
@@ -199,23 +509,45 @@ async def run_agent_task(task_id, task_instructions, llm, browser_config, save_p
                     'next_goal': str(action.get('action', {}).get('name', ''))
                 }
                 for i, action in enumerate(history.model_actions())
-            ],
+            ]),
             'urls': history.urls(),
             'screenshots': screenshot_paths,
             'extracted_content': history.extracted_content(),
             'errors': history.errors(),
             'is_done': history.is_done(),
             'has_errors': history.has_errors(),
+            'metrics': metrics,
         }
+        metrics['network'] = blocker.stats()
+        metrics['har'] = har_archive.stats() if har_archive else None
+        metrics['screenshots'] = screenshot_policy.stats()
+        metrics['is_done'] = history.is_done()
+        metrics['agent_steps'] = len(history.history)
+        if subtasks:
+            metrics['subtasks'] = history.stats()
+        # Uma linha por chamada ao LLM, com o passo do agente em que foi feita; chamadas fora
+        # dos passos (planejamento, etc.) ficam sem passo e com a etapa em 'scope'
+        metrics['token_usage'] = [
+            {
+                'step': call.get('step'),
+                'scope': call.get('scope'),
+                'hedge': call.get('hedge', False),
+                'input_tokens': call['input_tokens'],
+                'output_tokens': call['output_tokens'],
+                'latency': call['latency'],
+            }
+            for call in get_llm_calls(llm_instance)
+            if not call['error']
+        ]
         
-        print(f"Tarefa {task_id} concluída com sucesso")
+        _end_phase(metrics, 'post_processing', phase_started)
+        logger.info(f"Tarefa {task_id} concluída com sucesso")
         return result
         
     except Exception as e:
         # Em caso de erro, retornar informações de erro
         error_details = traceback.format_exc()
-        print(f"Erro na execução da tarefa {task_id}: {e}")
-        print(error_details)
+        logger.exception(f"Erro na execução da tarefa {task_id}: {e}")
         
         return {
             'id': task_id,
@@ -228,4 +560,31 @@ async def run_agent_task(task_id, task_instructions, llm, browser_config, save_p
             'errors': [str(e), error_details],
             'has_errors': True,
             'is_done': False,
-        }
\ No newline at end of file
+            'metrics': metrics,
+        }
+    finally:
+        if watchdog_task:
+            watchdog_task.cancel()
+            metrics['resources'] = watchdog.stats()
+        if controller is not None:
+            metrics['retries'] = controller.stats()
+        if checkpointer is not None:
+            metrics['checkpoints'] = checkpointer.stats()
+        if llm_instance is not None:
+            metrics['llm'] = get_llm_stats(llm_instance)
+        metrics['wall_time'] = round(time.monotonic() - started, 2)
+        await _close_browser(browser, browser_context)
+        if browser_lease:
+            browser_lease.release()
+        if profile_lease:
+            from utils.browser_profiles import enforce_profile_limits, DEFAULT_MAX_PROFILE_MB, DEFAULT_MAX_TOTAL_MB
+            profile_lease.release()
+            # Percorre e remove diretórios inteiros: fora do event loop
+            await asyncio.get_running_loop().run_in_executor(
+                None,
+                enforce_profile_limits,
+                browser_config.get('profile_max_mb', DEFAULT_MAX_PROFILE_MB),
+                browser_config.get('profiles_max_total_mb', DEFAULT_MAX_TOTAL_MB)
+            )
+        if profiler is not None:
+            metrics['profiling'] = profiler.stop()
\ No newline at end of file
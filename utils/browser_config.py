@@ -1,9 +1,48 @@
 import os
-import asyncio  # Adicionando importação que estava faltando
-from browser_use import BrowserConfig, Controller
+from browser_use import BrowserConfig
 from browser_use.browser.context import BrowserContextConfig
 
-def get_browser_config(browser_config_dict):
+# Flags do Chromium usadas em produção (containers sem GPU e com /dev/shm reduzido)
+PRODUCTION_CHROMIUM_ARGS = [
+    '--no-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-gpu',
+    '--disable-setuid-sandbox',
+    '--disable-software-rasterizer'
+]
+
+# Perfis de flags de inicialização do Chromium, do mais permissivo ao mais econômico
+LAUNCH_FLAG_PROFILES = {
+    'default': [],
+    'balanced': [
+        '--renderer-process-limit=4',
+        '--js-flags=--max-old-space-size=512',
+        '--disable-extensions',
+        '--disable-background-networking',
+        '--disable-component-update',
+    ],
+    'low_memory': [
+        '--renderer-process-limit=2',
+        '--js-flags=--max-old-space-size=256',
+        '--disable-extensions',
+        '--disable-background-networking',
+        '--disable-component-update',
+        '--disable-features=Translate,MediaRouter,OptimizationHints',
+        '--disable-backgrounding-occluded-windows',
+        '--process-per-site',
+        '--disk-cache-size=33554432',
+    ],
+}
+
+def get_launch_args(browser_config_dict, task_id=None):
+    """Flags extras do Chromium: perfil de inicialização e marcador da tarefa para o watchdog"""
+    args = list(LAUNCH_FLAG_PROFILES.get(browser_config_dict.get('launch_profile') or 'default', []))
+    if task_id:
+        from utils.resource_watchdog import task_marker_arg
+        args.append(task_marker_arg(task_id))
+    return args
+
+def get_browser_config(browser_config_dict, task_id=None):
     """
     Cria uma configuração otimizada para o navegador em ambientes de produção e desenvolvimento
     """
@@ -25,13 +64,7 @@ def get_browser_config(browser_config_dict):
             headless=True,  # Forçar headless em produção
             disable_security=True,
             new_context_config=context_config,
-            extra_chromium_args=[
-                '--no-sandbox',
-                '--disable-dev-shm-usage',
-                '--disable-gpu',
-                '--disable-setuid-sandbox',
-                '--disable-software-rasterizer'
-            ]
+            extra_chromium_args=list(PRODUCTION_CHROMIUM_ARGS) + get_launch_args(browser_config_dict, task_id)
         )
     else:
         # Em desenvolvimento, usar as configurações do usuário
@@ -39,34 +72,79 @@ def get_browser_config(browser_config_dict):
             headless=browser_config_dict.get('headless', False),
             disable_security=browser_config_dict.get('disable_security', True),
             new_context_config=context_config,
-            chrome_instance_path=browser_config_dict.get('chrome_instance_path')
+            chrome_instance_path=browser_config_dict.get('chrome_instance_path'),
+            extra_chromium_args=get_launch_args(browser_config_dict, task_id)
         )
     
     return browser_conf
 
-def create_controller_with_retry():
+def get_remote_browser_config(browser_config_dict, cdp_url):
+    """
+    Configuração para um navegador remoto acessado por CDP (ver utils/browser_pool.py).
+    As flags de inicialização não se aplicam: o processo do Chromium é do endpoint remoto
+    """
+    context_config = BrowserContextConfig(
+        browser_window_size={
+            'width': browser_config_dict.get('browser_window_width', 1280),
+            'height': browser_config_dict.get('browser_window_height', 1100)
+        },
+        highlight_elements=browser_config_dict.get('highlight_elements', True),
+    )
+    return BrowserConfig(
+        headless=True,
+        disable_security=browser_config_dict.get('disable_security', True),
+        cdp_url=cdp_url,
+        new_context_config=context_config
+    )
+
+def get_persistent_context_options(browser_config_dict, profile_lease, task_id=None):
     """
-    Cria um controlador com mecanismo de retry para ambientes de produção
+    Opções de launch_persistent_context para um perfil persistente: diretório de
+    dados do usuário e cache HTTP em disco com tamanho limitado
     """
-    controller = Controller()
+    is_production = os.environ.get('RAILWAY_ENVIRONMENT') or os.environ.get('PORT')
+    disable_security = True if is_production else browser_config_dict.get('disable_security', True)
+    cache_mb = int(browser_config_dict.get('profile_cache_mb') or 256)
+    
+    args = list(PRODUCTION_CHROMIUM_ARGS) if is_production else []
+    args += get_launch_args(browser_config_dict, task_id)
+    args += [
+        f'--disk-cache-dir={profile_lease.cache_dir}',
+        f'--disk-cache-size={cache_mb * 1024 * 1024}',
+    ]
+    if disable_security:
+        args += ['--disable-web-security', '--disable-site-isolation-trials', '--disable-features=IsolateOrigins,site-per-process']
     
-    # Adicionar ação customizada para retry em caso de falha
-    @controller.action('Retry failed action')
-    async def retry_action(action_name: str, params: dict, max_attempts: int = 3):
-        """Tenta executar uma ação várias vezes em caso de falha"""
-        attempts = 0
-        last_error = None
-        
-        while attempts < max_attempts:
-            try:
-                # Executar a ação desejada
-                result = await getattr(controller, action_name)(**params)
-                return result
-            except Exception as e:
-                attempts += 1
-                last_error = str(e)
-                await asyncio.sleep(1)  # Esperar 1 segundo antes de tentar novamente
-        
-        return f"Falha após {max_attempts} tentativas. Último erro: {last_error}"
+    return {
+        'user_data_dir': str(profile_lease.path),
+        'headless': True if is_production else browser_config_dict.get('headless', False),
+        'args': args,
+        'viewport': {
+            'width': browser_config_dict.get('browser_window_width', 1280),
+            'height': browser_config_dict.get('browser_window_height', 1100)
+        },
+        'bypass_csp': disable_security,
+        'ignore_https_errors': disable_security,
+        'executable_path': None if is_production else browser_config_dict.get('chrome_instance_path'),
+    }
+
+def get_request_blocker(browser_config_dict, overrides=None):
+    """
+    Cria o bloqueador de requisições a partir do perfil configurado no navegador,
+    aplicando as sobrescritas da tarefa (perfil, tipos de recurso, padrões de URL)
+    """
+    from utils.request_blocking import RequestBlocker, resolve_block_settings
     
-    return controller
\ No newline at end of file
+    settings = resolve_block_settings(browser_config_dict, overrides)
+    return RequestBlocker.from_settings(settings)
+
+def create_controller_with_retry(browser_config_dict=None):
+    """
+    Cria um controlador que repete ações idempotentes em erros transitórios
+    (backoff exponencial com jitter) e aplica circuit breakers por domínio
+    """
+    from utils.retry_policy import RetryingController, DEFAULT_RETRY_SETTINGS
+
+    browser_config_dict = browser_config_dict or {}
+    retry_settings = {key: browser_config_dict[key] for key in DEFAULT_RETRY_SETTINGS if key in browser_config_dict}
+    return RetryingController(retry_settings=retry_settings)
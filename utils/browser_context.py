@@ -0,0 +1,75 @@
+"""
+Contexto de navegador com ganchos executados sobre o contexto do Playwright.
+
+O browser_use cria o contexto do Playwright internamente; esta subclasse
+permite aplicar configurações extras (interceptação de requisições, etc.)
+a todo contexto criado para uma tarefa.
+"""
+import contextvars
+
+from browser_use import Browser
+from browser_use.browser.context import BrowserContext, BrowserContextConfig
+from playwright.async_api import async_playwright
+
+# Ligado enquanto um contexto persistente é inicializado: ele lança o próprio Chromium
+_persistent_session = contextvars.ContextVar('persistent_session', default=False)
+
+
+class ProfileBrowser(Browser):
+    """
+    Browser das tarefas com perfil persistente.
+
+    O contexto persistente lança o seu próprio Chromium (launch_persistent_context);
+    o navegador comum só é iniciado se um contexto não persistente precisar dele
+    (subtarefas paralelas), em vez de em toda tarefa com perfil.
+    """
+
+    async def get_playwright_browser(self):
+        if _persistent_session.get():
+            if self.playwright is None:
+                self.playwright = await async_playwright().start()
+            return None
+        return await super().get_playwright_browser()
+
+    async def _init(self):
+        # Reutiliza o Playwright já iniciado pelo contexto persistente
+        if self.playwright is None:
+            self.playwright = await async_playwright().start()
+        self.playwright_browser = await self._setup_browser(self.playwright)
+        return self.playwright_browser
+
+
+class ManagedBrowserContext(BrowserContext):
+    """
+    BrowserContext que executa ganchos assíncronos após criar o contexto do Playwright.
+
+    Com `persistent_options`, o contexto é criado com launch_persistent_context,
+    mantendo cookies, armazenamento e cache HTTP no diretório do perfil (use com
+    ProfileBrowser, para não lançar um segundo Chromium). A interceptação de
+    requisições (context.route) desativa o cache HTTP do Playwright: com um perfil
+    de bloqueio ativo, o cache em disco do perfil deixa de ser aproveitado.
+    """
+
+    def __init__(self, browser, config=None, hooks=None, persistent_options=None):
+        super().__init__(browser=browser, config=config or BrowserContextConfig())
+        self.hooks = list(hooks or [])
+        self.persistent_options = persistent_options
+
+    async def _initialize_session(self):
+        token = _persistent_session.set(bool(self.persistent_options))
+        try:
+            return await super()._initialize_session()
+        finally:
+            _persistent_session.reset(token)
+
+    async def _create_context(self, browser):
+        if self.persistent_options:
+            # O Playwright não aceita --user-data-dir em launch(); usar um contexto persistente
+            options = dict(self.persistent_options)
+            user_data_dir = options.pop('user_data_dir')
+            context = await self.browser.playwright.chromium.launch_persistent_context(user_data_dir, **options)
+        else:
+            context = await super()._create_context(browser)
+        for hook in self.hooks:
+            await hook(context)
+        return context
@@ -0,0 +1,272 @@
+"""
+Pool de navegadores remotos acessados por CDP (Chrome DevTools Protocol).
+
+Em vez de iniciar o Chromium no mesmo container da aplicação, as tarefas se
+conectam a endpoints remotos (containers headless-chrome, browserless, etc.),
+que escalam separadamente dos nós de interface e de execução. Cada endpoint tem
+uma capacidade (tarefas simultâneas neste processo); a escolha é pelo endpoint
+saudável menos carregado, com desempate pelo número de páginas abertas
+informado pelo próprio navegador (que inclui as de outros processos).
+
+A saúde é verificada com GET /json/version, no máximo a cada
+REMOTE_BROWSER_HEALTH_INTERVAL segundos por endpoint. Um endpoint que falha na
+conexão é marcado como indisponível até a próxima verificação e a tarefa tenta
+o próximo (failover). O failover acontece na conexão: uma tarefa cujo
+navegador remoto cai no meio da execução falha como uma tarefa local.
+
+Os endpoints vêm da configuração do navegador (`remote_browsers`) ou da
+variável REMOTE_BROWSER_URLS (URLs separadas por vírgula, com a capacidade
+opcional após '|', ex.: ws://chrome-1:3000|8).
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+import urllib.request
+from urllib.parse import urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+REMOTE_BROWSER_URLS = os.environ.get('REMOTE_BROWSER_URLS', '')
+DEFAULT_ENDPOINT_CAPACITY = int(os.environ.get('REMOTE_BROWSER_CAPACITY', 4))
+HEALTH_INTERVAL = float(os.environ.get('REMOTE_BROWSER_HEALTH_INTERVAL', 30))
+HEALTH_TIMEOUT = float(os.environ.get('REMOTE_BROWSER_HEALTH_TIMEOUT', 3))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class NoBrowserAvailable(Exception):
+    """Nenhum endpoint remoto saudável com capacidade livre"""
+
+
+def parse_endpoints(value):
+    """
+    Endpoints a partir da configuração: lista de dicionários {'url', 'capacity'},
+    ou texto com um endpoint por linha/vírgula no formato url|capacidade
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = [item for line in value.splitlines() for item in line.split(',')]
+    endpoints = []
+    for item in value:
+        if isinstance(item, dict):
+            url, capacity = item.get('url', ''), item.get('capacity')
+        else:
+            url, _, capacity = str(item).partition('|')
+        url = url.strip()
+        if url:
+            endpoints.append({'url': url, 'capacity': int(capacity or DEFAULT_ENDPOINT_CAPACITY)})
+    return endpoints
+
+
+def display_url(url):
+    """URL sem credenciais nem query string (tokens), para logs e métricas"""
+    parts = urlsplit(url)
+    host = (parts.hostname or '') + (f":{parts.port}" if parts.port else '')
+    return urlunsplit((parts.scheme, host, parts.path, '', ''))
+
+
+def devtools_http_url(url, path):
+    """Endpoint HTTP do DevTools (/json/...) correspondente a uma URL CDP http(s) ou ws(s)"""
+    parts = urlsplit(url)
+    scheme = {'ws': 'http', 'wss': 'https'}.get(parts.scheme, parts.scheme)
+    return urlunsplit((scheme, parts.netloc, path, parts.query, ''))
+
+
+class RemoteEndpoint:
+    """Estado de um endpoint: saúde, tarefas em uso neste processo e páginas abertas no navegador"""
+
+    def __init__(self, url, capacity=DEFAULT_ENDPOINT_CAPACITY):
+        self.url = url
+        self.capacity = max(1, int(capacity))
+        self.in_use = 0
+        self.healthy = None  # None = ainda não verificado
+        self.last_check = 0.0
+        self.last_error = None
+        self.pages = 0
+        self.version = None
+        self.last_acquired = 0.0
+        self.total_leases = 0
+        self.failures = 0
+
+    def check(self):
+        """Verificação de saúde síncrona (executada fora do event loop)"""
+        try:
+            with urllib.request.urlopen(devtools_http_url(self.url, '/json/version'), timeout=HEALTH_TIMEOUT) as response:
+                self.version = json.loads(response.read() or b'{}').get('Browser')
+            try:
+                with urllib.request.urlopen(devtools_http_url(self.url, '/json/list'), timeout=HEALTH_TIMEOUT) as response:
+                    self.pages = sum(1 for target in json.loads(response.read() or b'[]') if target.get('type') == 'page')
+            except (OSError, ValueError):
+                # Nem todo serviço expõe /json/list; a carga local continua valendo
+                self.pages = 0
+            if not self.healthy:
+                logger.info(f"Navegador remoto disponível: {display_url(self.url)} ({self.version})")
+            self.healthy = True
+            self.last_error = None
+        except (OSError, ValueError) as e:
+            if self.healthy is not False:
+                logger.warning(f"Navegador remoto indisponível: {display_url(self.url)}: {e}")
+            self.healthy = False
+            self.last_error = str(e)
+        self.last_check = time.monotonic()
+        return self.healthy
+
+    def needs_check(self):
+        return self.healthy is None or time.monotonic() - self.last_check >= HEALTH_INTERVAL
+
+    def mark_failed(self, error):
+        self.healthy = False
+        self.failures += 1
+        self.last_error = str(error)
+        self.last_check = time.monotonic()
+
+    def stats(self):
+        return {
+            'url': display_url(self.url),
+            'healthy': self.healthy,
+            'in_use': self.in_use,
+            'capacity': self.capacity,
+            'pages': self.pages,
+            'version': self.version,
+            'total_leases': self.total_leases,
+            'failures': self.failures,
+            'last_error': self.last_error,
+        }
+
+
+class BrowserLease:
+    """Uso de um endpoint por uma tarefa; release() devolve a capacidade"""
+
+    def __init__(self, pool, endpoint):
+        self.pool = pool
+        self.endpoint = endpoint
+        self.url = endpoint.url
+        self.failovers = 0
+        self._released = False
+
+    def fail(self, error):
+        """Conexão falhou: marca o endpoint como indisponível e libera a capacidade"""
+        logger.warning(f"Falha ao conectar ao navegador remoto {display_url(self.url)}: {error}")
+        with self.pool._lock:
+            self.endpoint.mark_failed(error)
+        self.release()
+
+    def release(self):
+        with self.pool._lock:
+            if not self._released:
+                self._released = True
+                self.endpoint.in_use -= 1
+
+    def stats(self):
+        return {'endpoint': display_url(self.url), 'failovers': self.failovers}
+
+
+class BrowserPool:
+    """Seleção do endpoint menos carregado, com verificação de saúde e limite de capacidade"""
+
+    def __init__(self, endpoints=None):
+        self._lock = threading.Lock()
+        self.endpoints = {}
+        self.configure(endpoints or [])
+
+    def configure(self, endpoints):
+        """Atualiza a lista de endpoints, preservando o estado dos que continuam configurados"""
+        with self._lock:
+            current = {}
+            for item in endpoints:
+                endpoint = self.endpoints.get(item['url']) or RemoteEndpoint(item['url'], item['capacity'])
+                endpoint.capacity = max(1, int(item['capacity']))
+                current[item['url']] = endpoint
+            self.endpoints = current
+
+    def __bool__(self):
+        return bool(self.endpoints)
+
+    async def refresh(self, force=False):
+        """Verifica, em paralelo e fora do event loop, os endpoints com verificação vencida"""
+        loop = asyncio.get_running_loop()
+        stale = [endpoint for endpoint in list(self.endpoints.values()) if force or endpoint.needs_check()]
+        if stale:
+            await asyncio.gather(*(loop.run_in_executor(None, endpoint.check) for endpoint in stale))
+
+    def try_acquire(self, exclude=()):
+        """Reserva o endpoint saudável menos carregado; None se não houver capacidade livre"""
+        with self._lock:
+            candidates = [
+                endpoint for endpoint in self.endpoints.values()
+                if endpoint.healthy and endpoint.in_use < endpoint.capacity and endpoint.url not in exclude
+            ]
+            if not candidates:
+                return None
+            endpoint = min(candidates, key=lambda e: (e.in_use / e.capacity, e.pages, e.last_acquired))
+            endpoint.in_use += 1
+            endpoint.total_leases += 1
+            endpoint.last_acquired = time.monotonic()
+            return BrowserLease(self, endpoint)
+
+    async def acquire(self, timeout=60.0, poll_interval=0.5, exclude=()):
+        """Aguarda um endpoint com capacidade livre, até `timeout` segundos"""
+        deadline = time.monotonic() + timeout
+        while True:
+            await self.refresh()
+            lease = self.try_acquire(exclude)
+            if lease is not None:
+                return lease
+            if not any(endpoint.healthy for endpoint in self.endpoints.values() if endpoint.url not in exclude):
+                # Sem endpoints saudáveis não adianta esperar pela capacidade; apenas pela próxima verificação
+                if time.monotonic() + HEALTH_INTERVAL > deadline:
+                    raise NoBrowserAvailable("Nenhum navegador remoto disponível")
+            if time.monotonic() >= deadline:
+                raise NoBrowserAvailable(f"Todos os navegadores remotos estão na capacidade máxima há {timeout:.0f}s")
+            await asyncio.sleep(poll_interval)
+
+    async def connect(self, browser_config_dict, timeout=60.0):
+        """
+        Conecta a um endpoint com failover e retorna (Browser, lease).
+
+        A conexão é feita aqui, e não no primeiro passo do agente, para que um endpoint
+        inacessível seja trocado pelo próximo antes de a tarefa começar.
+        """
+        from browser_use import Browser
+        from utils.browser_config import get_remote_browser_config
+
+        tried = set()
+        failovers = 0
+        while True:
+            lease = await self.acquire(timeout=timeout, exclude=tried)
+            browser = Browser(config=get_remote_browser_config(browser_config_dict, lease.url))
+            try:
+                await browser.get_playwright_browser()
+            except Exception as e:
+                lease.fail(e)
+                tried.add(lease.url)
+                failovers += 1
+                try:
+                    await browser.close()
+                except Exception:
+                    pass
+                continue
+            lease.failovers = failovers
+            logger.info(f"Conectado ao navegador remoto {display_url(lease.url)}")
+            return browser, lease
+
+    def stats(self):
+        with self._lock:
+            return [endpoint.stats() for endpoint in self.endpoints.values()]
+
+
+def get_browser_pool(browser_config_dict=None):
+    """Pool do processo, configurado com os endpoints atuais (None se nenhum estiver configurado)"""
+    global _pool
+    browser_config_dict = browser_config_dict or {}
+    endpoints = parse_endpoints(browser_config_dict.get('remote_browsers') or REMOTE_BROWSER_URLS)
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool()
+    _pool.configure(endpoints)
+    return _pool if _pool else None
@@ -0,0 +1,215 @@
+"""
+Perfis persistentes do navegador (diretório de dados do usuário + cache HTTP em disco).
+
+Cada perfil é um diretório em BROWSER_PROFILES_DIR. Um perfil só pode ser usado
+por uma tarefa por vez: o bloqueio combina um registro em memória (threads do
+mesmo processo) com flock em um arquivo de trava (processos diferentes), em
+PROFILES_DIR/.locks, fora do diretório do perfil: remover o perfil não apaga a
+trava que outra instância pode estar esperando.
+Após cada uso os limites de tamanho são aplicados, removendo primeiro o cache
+e depois os perfis menos usados recentemente.
+"""
+import os
+import re
+import time
+import logging
+import shutil
+import asyncio
+import threading
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: apenas o bloqueio em memória
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+PROFILES_DIR = Path(os.environ.get('BROWSER_PROFILES_DIR', Path.home() / '.browser_agent' / 'profiles'))
+
+# Limites padrão de tamanho (MB)
+DEFAULT_MAX_PROFILE_MB = 512
+DEFAULT_MAX_TOTAL_MB = 4096
+
+# Subdiretórios de cache do Chromium que podem ser descartados sem perder sessão
+CACHE_DIRS = ['cache', 'Default/Cache', 'Default/Code Cache', 'Default/GPUCache', 'Default/Service Worker/CacheStorage']
+
+LOCKS_DIR = '.locks'
+LAST_USED_FILE = '.last_used'
+
+_in_use = set()
+_in_use_lock = threading.Lock()
+
+
+class ProfileInUseError(Exception):
+    """O perfil já está sendo usado por outra tarefa"""
+
+
+def sanitize_profile_name(name):
+    """Normaliza o nome do perfil para uso como nome de diretório"""
+    name = re.sub(r'[^a-zA-Z0-9_-]+', '_', (name or '').strip())
+    return name.strip('_')[:64]
+
+
+def get_profile_path(name):
+    return PROFILES_DIR / sanitize_profile_name(name)
+
+
+def _profile_dirs():
+    # Nomes sanitizados nunca começam com '.': ignora .locks e afins
+    return [path for path in sorted(PROFILES_DIR.iterdir()) if path.is_dir() and not path.name.startswith('.')]
+
+
+def list_profiles():
+    """Lista os perfis existentes com tamanho e data do último uso"""
+    if not PROFILES_DIR.exists():
+        return []
+    return [
+        {
+            'name': path.name,
+            'size_mb': round(directory_size(path) / (1024 * 1024), 1),
+            'last_used': _last_used(path),
+            'in_use': path.name in _in_use,
+        }
+        for path in _profile_dirs()
+    ]
+
+
+def directory_size(path):
+    """Tamanho total de um diretório em bytes"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for filename in files:
+            try:
+                total += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass
+    return total
+
+
+def _last_used(path):
+    marker = Path(path) / LAST_USED_FILE
+    try:
+        return marker.stat().st_mtime
+    except OSError:
+        return 0.0
+
+
+class ProfileLease:
+    """Posse exclusiva de um perfil enquanto uma tarefa o utiliza"""
+
+    def __init__(self, name):
+        self.name = sanitize_profile_name(name)
+        if not self.name:
+            raise ValueError("Nome de perfil inválido")
+        self.path = PROFILES_DIR / self.name
+        self._lock_file = None
+
+    @property
+    def cache_dir(self):
+        return self.path / 'cache'
+
+    def try_acquire(self, touch=True):
+        """Tenta obter o perfil; retorna False se ele estiver em uso"""
+        with _in_use_lock:
+            if self.name in _in_use:
+                return False
+            _in_use.add(self.name)
+
+        if fcntl is not None:
+            locks_dir = PROFILES_DIR / LOCKS_DIR
+            locks_dir.mkdir(parents=True, exist_ok=True)
+            lock_file = open(locks_dir / f"{self.name}.lock", 'w')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                with _in_use_lock:
+                    _in_use.discard(self.name)
+                return False
+            self._lock_file = lock_file
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        if touch:
+            (self.path / LAST_USED_FILE).touch()
+        return True
+
+    async def acquire(self, timeout=60.0, poll_interval=0.5):
+        """Aguarda o perfil ficar livre, até `timeout` segundos"""
+        deadline = time.monotonic() + timeout
+        while not self.try_acquire():
+            if time.monotonic() >= deadline:
+                raise ProfileInUseError(f"Perfil '{self.name}' está em uso por outra tarefa")
+            await asyncio.sleep(poll_interval)
+        logger.info(f"Perfil do navegador em uso: {self.name}")
+        return self
+
+    def release(self):
+        if self._lock_file is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            finally:
+                self._lock_file.close()
+                self._lock_file = None
+        with _in_use_lock:
+            _in_use.discard(self.name)
+
+
+def clear_profile_cache(path):
+    """Remove os diretórios de cache de um perfil, preservando cookies e armazenamento"""
+    for cache_dir in CACHE_DIRS:
+        shutil.rmtree(Path(path) / cache_dir, ignore_errors=True)
+
+
+def enforce_profile_limits(max_profile_mb=DEFAULT_MAX_PROFILE_MB, max_total_mb=DEFAULT_MAX_TOTAL_MB):
+    """
+    Aplica os limites de tamanho: perfis acima do limite individual perdem o cache;
+    se o total ainda exceder o limite global, os perfis livres menos usados
+    recentemente perdem o cache e, por fim, são removidos.
+    """
+    if not PROFILES_DIR.exists():
+        return []
+
+    evicted = []
+    max_profile = (max_profile_mb or 0) * 1024 * 1024
+    max_total = (max_total_mb or 0) * 1024 * 1024
+
+    profiles = _profile_dirs()
+    sizes = {p: directory_size(p) for p in profiles}
+
+    def evict(path, remove):
+        # Só mexer em perfis livres (nesta e em outras instâncias)
+        lease = ProfileLease(path.name)
+        if not lease.try_acquire(touch=False):
+            return False
+        try:
+            if remove:
+                shutil.rmtree(path, ignore_errors=True)
+                sizes.pop(path, None)
+            else:
+                clear_profile_cache(path)
+                sizes[path] = directory_size(path)
+        finally:
+            lease.release()
+        evicted.append(path.name if remove else f"{path.name}:cache")
+        return True
+
+    if max_profile:
+        for path in profiles:
+            if sizes[path] > max_profile:
+                evict(path, remove=False)
+
+    if max_total and sum(sizes.values()) > max_total:
+        candidates = sorted(profiles, key=_last_used)
+        for path in candidates:
+            if sum(sizes.values()) <= max_total:
+                break
+            evict(path, remove=False)
+        for path in candidates:
+            if sum(sizes.values()) <= max_total:
+                break
+            evict(path, remove=True)
+
+    if evicted:
+        logger.info(f"Perfis do navegador reduzidos: {', '.join(evicted)}")
+    return evicted
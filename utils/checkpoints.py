@@ -0,0 +1,329 @@
+"""
+Checkpoints de tarefas em execução e recuperação após reinício do processo.
+
+Durante a execução, um gancho de passo do agente grava o último checkpoint da
+tarefa: resumo dos passos concluídos, ações executadas, memória do agente, URL
+atual e o storage state do Playwright (cookies e localStorage). Uma thread de
+heartbeat atualiza `tasks.heartbeat_at` das tarefas em execução neste
+processo.
+
+Na inicialização, `recover_orphaned_tasks` procura tarefas `running` cujo
+heartbeat parou (o processo que as executava morreu: deploy, OOM). Cada tarefa
+órfã é reivindicada com um UPDATE condicional, para que duas réplicas não a
+retomem ao mesmo tempo, e então é retomada do último checkpoint (sessão do
+navegador restaurada, agente instruído a continuar sem repetir os passos já
+feitos) ou marcada como falha se não houver checkpoint ou se já tiver sido
+retomada MAX_RESUMES vezes.
+"""
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from utils.action_macros import actions_from_history, describe_action
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_EVERY_STEPS = int(os.environ.get('CHECKPOINT_EVERY_STEPS', 1))
+HEARTBEAT_INTERVAL = float(os.environ.get('TASK_HEARTBEAT_INTERVAL', 30))
+# Sem heartbeat por este tempo, a tarefa é considerada órfã
+HEARTBEAT_TIMEOUT = float(os.environ.get('TASK_HEARTBEAT_TIMEOUT', 120))
+MAX_RESUMES = int(os.environ.get('TASK_MAX_RESUMES', 2))
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Tarefas em execução neste processo, mantidas vivas pelo heartbeat
+_running_tasks = set()
+_running_lock = threading.Lock()
+_heartbeat_thread = None
+_recovery_lock = threading.Lock()
+_recovery_done = False
+
+
+def _heartbeat_loop():
+    from db.database import get_db_session
+    from db.models import Task
+
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        with _running_lock:
+            task_ids = list(_running_tasks)
+        if not task_ids:
+            continue
+        try:
+            with get_db_session() as session:
+                session.query(Task).filter(Task.id.in_(task_ids)).update(
+                    {'heartbeat_at': datetime.now(), 'worker_id': WORKER_ID}, synchronize_session=False
+                )
+        except Exception as e:
+            logger.error(f"Erro ao gravar heartbeat das tarefas: {e}")
+
+
+def register_running_task(task_id):
+    """Inclui a tarefa no heartbeat deste processo (inicia a thread na primeira chamada)"""
+    global _heartbeat_thread
+    with _running_lock:
+        _running_tasks.add(task_id)
+        if _heartbeat_thread is None:
+            _heartbeat_thread = threading.Thread(target=_heartbeat_loop, name='task-heartbeat', daemon=True)
+            _heartbeat_thread.start()
+
+
+def unregister_running_task(task_id):
+    with _running_lock:
+        _running_tasks.discard(task_id)
+
+
+def load_checkpoint(task_id, with_storage_state=True):
+    """Retorna o último checkpoint da tarefa ou None (o storage state só é lido se pedido)"""
+    from sqlalchemy.orm import undefer
+    from db.database import get_db_session
+    from db.models import TaskCheckpoint
+
+    with get_db_session() as session:
+        query = session.query(TaskCheckpoint).filter(TaskCheckpoint.task_id == task_id)
+        if with_storage_state:
+            query = query.options(undefer(TaskCheckpoint.storage_state))
+        checkpoint = query.first()
+        if checkpoint is None:
+            return None
+        return {
+            'step': checkpoint.step or 0,
+            'url': checkpoint.url,
+            'steps': json.loads(checkpoint.steps) if checkpoint.steps else [],
+            'actions': json.loads(checkpoint.actions) if checkpoint.actions else [],
+            'memory': checkpoint.memory,
+            'storage_state': json.loads(checkpoint.storage_state) if with_storage_state and checkpoint.storage_state else None,
+            'updated_at': checkpoint.updated_at,
+            'resume_count': checkpoint.resume_count or 0,
+        }
+
+
+def save_checkpoint(task_id, data):
+    from db.database import get_db_session
+    from db.models import TaskCheckpoint
+
+    fields = {
+        'step': data['step'],
+        'url': data.get('url'),
+        'steps': json.dumps(data.get('steps', [])),
+        'actions': json.dumps(data.get('actions', [])),
+        'memory': data.get('memory'),
+        'storage_state': json.dumps(data['storage_state']) if data.get('storage_state') else None,
+        'updated_at': datetime.now(),
+    }
+    with get_db_session() as session:
+        checkpoint = session.query(TaskCheckpoint).filter(TaskCheckpoint.task_id == task_id).first()
+        if checkpoint:
+            for field, value in fields.items():
+                setattr(checkpoint, field, value)
+        else:
+            session.add(TaskCheckpoint(task_id=task_id, resume_count=data.get('resume_count', 0), **fields))
+
+
+def delete_checkpoint(task_id):
+    from db.database import get_db_session
+    from db.models import TaskCheckpoint
+
+    with get_db_session() as session:
+        session.query(TaskCheckpoint).filter(TaskCheckpoint.task_id == task_id).delete()
+
+
+def steps_from_history(history, first_step=1):
+    """Resumo dos passos do agente no formato exibido na página de detalhes"""
+    steps = []
+    for item in history.history:
+        output = getattr(item, 'model_output', None)
+        if output is None:
+            continue
+        state = output.current_state
+        steps.append({
+            'step': first_step + len(steps),
+            'evaluation_previous_goal': getattr(state, 'evaluation_previous_goal', ''),
+            'memory': getattr(state, 'memory', ''),
+            'next_goal': getattr(state, 'next_goal', ''),
+        })
+    return steps
+
+
+def resume_instructions(task_instructions, checkpoint):
+    """Instruções para o agente retomar a tarefa a partir do checkpoint"""
+    done_list = '\n'.join(f"- {describe_action(entry)}" for entry in checkpoint['actions'][-30:]) or '- (nenhuma)'
+    memory = f"\nMemória no último passo: {checkpoint['memory']}" if checkpoint.get('memory') else ''
+    return (
+        f"{task_instructions}\n\n"
+        f"Nota: esta tarefa foi interrompida e está sendo retomada após {checkpoint['step']} passos. "
+        f"A sessão do navegador (cookies e armazenamento) foi restaurada e a página atual é "
+        f"{checkpoint.get('url') or 'a inicial'}. Ações já executadas, que não devem ser repetidas:\n"
+        f"{done_list}{memory}"
+    )
+
+
+async def apply_storage_state(context, state):
+    """Aplica cookies e localStorage (formato storage_state do Playwright) a um contexto já criado"""
+    state = state or {}
+    if state.get('cookies'):
+        await context.add_cookies(state['cookies'])
+    for origin in state.get('origins', []):
+        items = {item['name']: item['value'] for item in origin.get('localStorage', [])}
+        if items:
+            await context.add_init_script(
+                f"if (location.origin === {json.dumps(origin['origin'])}) {{"
+                f" const items = {json.dumps(items)};"
+                f" for (const [key, value] of Object.entries(items)) {{"
+                f"  if (localStorage.getItem(key) === null) localStorage.setItem(key, value); }} }}"
+            )
+
+
+class TaskCheckpointer:
+    """Gancho de passo que grava o checkpoint da tarefa a cada `every` passos"""
+
+    def __init__(self, task_id, every=CHECKPOINT_EVERY_STEPS, previous=None):
+        self.task_id = task_id
+        self.every = max(1, int(every))
+        # Ao retomar, os passos e ações anteriores continuam fazendo parte do checkpoint
+        self.previous = previous or {'step': 0, 'steps': [], 'actions': [], 'resume_count': 0}
+        self.saved = 0
+        self.errors = 0
+        self.last_step = None
+        self.save_seconds = 0.0
+
+    async def restore(self, context):
+        """Gancho do contexto do Playwright: restaura cookies e localStorage do checkpoint"""
+        await apply_storage_state(context, self.previous.get('storage_state'))
+
+    async def after_step(self, agent):
+        step = getattr(agent, 'current_step', 0)
+        if step == self.last_step or step % self.every:
+            return
+        self.last_step = step
+        started = time.monotonic()
+        try:
+            browser_context = agent.browser_context
+            page = await browser_context.get_current_page()
+            session = await browser_context.get_session()
+            storage_state = await session.context.storage_state()
+            previous_steps = self.previous['steps']
+            steps = previous_steps + steps_from_history(agent.history, first_step=len(previous_steps) + 1)
+            data = {
+                'step': len(steps),
+                'url': page.url,
+                'steps': steps,
+                'actions': self.previous['actions'] + actions_from_history(agent.history),
+                'memory': steps[-1]['memory'] if steps else self.previous.get('memory'),
+                'storage_state': storage_state,
+                'resume_count': self.previous.get('resume_count', 0),
+            }
+            # Gravação no banco fora do event loop
+            await asyncio.get_running_loop().run_in_executor(None, save_checkpoint, self.task_id, data)
+            self.saved += 1
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Erro ao gravar checkpoint da tarefa {self.task_id}: {e}")
+        self.save_seconds += time.monotonic() - started
+
+    def merge_steps(self, steps):
+        """Passos da execução atual precedidos dos passos das execuções interrompidas"""
+        previous_steps = self.previous['steps']
+        if not previous_steps:
+            return steps
+        return previous_steps + [
+            {**step, 'step': len(previous_steps) + i + 1} for i, step in enumerate(steps)
+        ]
+
+    def stats(self):
+        return {
+            'saved': self.saved,
+            'errors': self.errors,
+            'save_seconds': round(self.save_seconds, 3),
+            'resumed_from_step': self.previous['step'] or None,
+            'resume_count': self.previous.get('resume_count', 0),
+        }
+
+
+def find_orphaned_tasks(timeout=HEARTBEAT_TIMEOUT):
+    """Tarefas em execução cujo heartbeat parou"""
+    from sqlalchemy import or_
+    from db.database import get_db_session
+    from db.models import Task
+
+    cutoff = datetime.now() - timedelta(seconds=timeout)
+    with get_db_session() as session:
+        return [
+            task_id for (task_id,) in session.query(Task.id).filter(
+                Task.status == 'running',
+                or_(Task.heartbeat_at.is_(None), Task.heartbeat_at < cutoff)
+            )
+        ]
+
+
+def claim_orphaned_task(task_id, timeout=HEARTBEAT_TIMEOUT):
+    """Reivindica a tarefa órfã para este processo; False se outro processo já o fez"""
+    from sqlalchemy import or_
+    from db.database import get_db_session
+    from db.models import Task
+
+    cutoff = datetime.now() - timedelta(seconds=timeout)
+    with get_db_session() as session:
+        claimed = session.query(Task).filter(
+            Task.id == task_id,
+            Task.status == 'running',
+            or_(Task.heartbeat_at.is_(None), Task.heartbeat_at < cutoff)
+        ).update({'heartbeat_at': datetime.now(), 'worker_id': WORKER_ID}, synchronize_session=False)
+    return claimed == 1
+
+
+def recover_orphaned_tasks(resume=True, browser_config=None):
+    """
+    Retoma (ou marca como falha) as tarefas órfãs. Executado uma vez por processo.
+
+    Retorna {'resumed': [...], 'failed': [...]}.
+    """
+    global _recovery_done
+    with _recovery_lock:
+        if _recovery_done:
+            return {'resumed': [], 'failed': []}
+        _recovery_done = True
+
+    from db.database import get_db_session
+    from db.models import Task, TaskCheckpoint
+
+    summary = {'resumed': [], 'failed': []}
+    for task_id in find_orphaned_tasks():
+        if not claim_orphaned_task(task_id):
+            continue
+        with get_db_session() as session:
+            checkpoint = session.query(TaskCheckpoint).filter(TaskCheckpoint.task_id == task_id).first()
+            can_resume = resume and checkpoint is not None and (checkpoint.resume_count or 0) < MAX_RESUMES
+            if can_resume:
+                checkpoint.resume_count = (checkpoint.resume_count or 0) + 1
+                step = checkpoint.step
+            else:
+                task = session.query(Task).filter(Task.id == task_id).first()
+                task.status = 'failed'
+                task.finished_at = datetime.now()
+                task.output = (
+                    "Erro: a tarefa foi interrompida por um reinício do processo"
+                    + (f" e já foi retomada {checkpoint.resume_count} vezes" if checkpoint is not None else "")
+                )
+        if can_resume:
+            from utils.task_executor import execute_task_blocking
+            logger.info(f"Retomando tarefa órfã {task_id} a partir do passo {step}")
+            threading.Thread(
+                target=execute_task_blocking,
+                args=(task_id, browser_config),
+                kwargs={'resume': True},
+                name=f"resume-{task_id[:8]}",
+                daemon=True
+            ).start()
+            summary['resumed'].append(task_id)
+        else:
+            from utils.webhooks import notify_task_event
+            logger.warning(f"Tarefa órfã {task_id} marcada como falha (sem checkpoint ou limite de retomadas atingido)")
+            notify_task_event(task_id, 'failed', output="Erro: a tarefa foi interrompida por um reinício do processo")
+            summary['failed'].append(task_id)
+    return summary
@@ -0,0 +1,71 @@
+"""
+Gravação e replay do tráfego de rede de uma tarefa em arquivos HAR.
+
+No modo 'record' todo o tráfego do contexto é gravado em um HAR (compactado
+em .zip, com os corpos das respostas). No modo 'replay' as requisições são
+atendidas a partir do HAR e qualquer requisição que não esteja no arquivo é
+abortada, de forma que a execução não acessa a rede.
+"""
+import os
+import copy
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+HAR_DIR = Path(os.environ.get('HAR_DIR', Path.home() / '.browser_agent' / 'har'))
+
+NETWORK_MODES = ['live', 'record', 'replay']
+
+
+def get_har_path(task_id):
+    """Caminho do HAR gravado por uma tarefa"""
+    return HAR_DIR / f"{task_id}.har.zip"
+
+
+class HarArchive:
+    """Gancho de contexto que grava ou reproduz o tráfego de rede via HAR"""
+
+    def __init__(self, mode, path):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Modo de rede inválido para HAR: {mode}")
+        self.mode = mode
+        self.path = Path(path)
+
+    async def attach(self, context):
+        """Registra a gravação ou o replay no contexto do Playwright"""
+        if self.mode == 'record':
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # O arquivo é escrito quando o contexto é fechado
+            await context.route_from_har(
+                str(self.path),
+                update=True,
+                update_content='attach',
+                update_mode='full'
+            )
+            logger.info(f"Gravando tráfego de rede em {self.path}")
+        else:
+            if not self.path.exists():
+                raise FileNotFoundError(f"Arquivo HAR não encontrado: {self.path}")
+            # Requisições ausentes do HAR são abortadas: nenhum acesso à rede
+            await context.route_from_har(str(self.path), not_found='abort')
+            logger.info(f"Reproduzindo tráfego de rede de {self.path}")
+
+    def stats(self):
+        info = {'mode': self.mode, 'path': str(self.path)}
+        if self.path.exists():
+            info['size_bytes'] = self.path.stat().st_size
+        return info
+
+
+def fast_replay_config(context_config):
+    """Reduz as esperas de carregamento do browser_use, já que o replay responde do disco"""
+    config = copy.copy(context_config)
+    for attr, value in (
+        ('minimum_wait_page_load_time', 0.05),
+        ('wait_for_network_idle_page_load_time', 0.1),
+        ('wait_between_actions', 0.1),
+    ):
+        if hasattr(config, attr):
+            setattr(config, attr, value)
+    return config
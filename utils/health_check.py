@@ -1,8 +1,11 @@
 import os
+import logging
 import http.server
 import socketserver
 import threading
 
+logger = logging.getLogger(__name__)
+
 def start_healthcheck_server():
     """Inicia um servidor HTTP simples para healthchecks"""
     class HealthCheckHandler(http.server.SimpleHTTPRequestHandler):
@@ -20,14 +23,14 @@ def start_healthcheck_server():
     
     try:
         httpd = socketserver.TCPServer(('', port), HealthCheckHandler)
-        print(f"Iniciando servidor healthcheck na porta {port}")
+        logger.info(f"Iniciando servidor healthcheck na porta {port}")
         httpd.serve_forever()
     except Exception as e:
-        print(f"Erro ao iniciar servidor healthcheck: {e}")
+        logger.error(f"Erro ao iniciar servidor healthcheck: {e}")
 
 def setup_healthcheck():
     """Configura o healthcheck em uma thread separada"""
     thread = threading.Thread(target=start_healthcheck_server)
     thread.daemon = True
     thread.start()
-    print("Servidor healthcheck iniciado em thread separada")
\ No newline at end of file
+    logger.info("Servidor healthcheck iniciado em thread separada")
\ No newline at end of file
@@ -0,0 +1,401 @@
+"""
+Camada de controle das chamadas ao LLM.
+
+Instrumenta uma instância de chat model do LangChain substituindo os métodos
+`_agenerate`/`_generate` da própria instância. Assim a classe original é
+preservada (o browser_use escolhe o modo de tool calling pelo nome da classe)
+e todas as cadeias derivadas (bind_tools, with_structured_output) passam pelos
+controles de limitação de taxa, pelo hedging e pelas estatísticas de chamadas.
+"""
+import time
+import logging
+import asyncio
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from collections import deque
+
+try:
+    from langchain_core.language_models.chat_models import BaseChatModel, SimpleChatModel
+    # Implementações padrão de _agenerate, que apenas executam o _generate em um executor
+    _DEFAULT_AGENERATE = {BaseChatModel._agenerate, SimpleChatModel._agenerate}
+except ImportError:
+    _DEFAULT_AGENERATE = set()
+
+logger = logging.getLogger(__name__)
+
+# Origem das chamadas ao LLM: o passo do agente ou outra etapa (planejamento, etc.)
+current_llm_scope = contextvars.ContextVar('current_llm_scope', default=None)
+
+
+@contextmanager
+def llm_call_scope(label, step=None):
+    """Marca as chamadas ao LLM feitas neste contexto com o passo do agente ou a etapa"""
+    token = current_llm_scope.set({'scope': label, 'step': step})
+    try:
+        yield
+    finally:
+        current_llm_scope.reset(token)
+
+
+def _call_scope():
+    return current_llm_scope.get() or {'scope': 'other', 'step': None}
+
+
+def estimate_tokens(messages):
+    """Estimativa simples de tokens de entrada (~4 caracteres por token)"""
+    total_chars = 0
+    for message in messages:
+        content = getattr(message, 'content', message)
+        if isinstance(content, str):
+            total_chars += len(content)
+        elif isinstance(content, list):
+            for part in content:
+                if isinstance(part, dict) and part.get('type') == 'text':
+                    total_chars += len(part.get('text', ''))
+                elif isinstance(part, dict):
+                    # Imagens custam aproximadamente um valor fixo de tokens
+                    total_chars += 3000
+                else:
+                    total_chars += len(str(part))
+    return max(1, total_chars // 4)
+
+
+def extract_token_usage(result):
+    """Extrai o uso de tokens (entrada, saída) de um ChatResult do LangChain"""
+    input_tokens = output_tokens = None
+
+    llm_output = getattr(result, 'llm_output', None) or {}
+    usage = llm_output.get('token_usage') or llm_output.get('usage') or {}
+    if usage:
+        input_tokens = usage.get('prompt_tokens', usage.get('input_tokens'))
+        output_tokens = usage.get('completion_tokens', usage.get('output_tokens'))
+
+    if input_tokens is None:
+        for generation in getattr(result, 'generations', None) or []:
+            message = getattr(generation, 'message', None)
+            metadata = getattr(message, 'usage_metadata', None)
+            if metadata:
+                input_tokens = metadata.get('input_tokens')
+                output_tokens = metadata.get('output_tokens')
+                break
+
+    return input_tokens, output_tokens
+
+
+def _copy_message(message, content):
+    """Copia uma mensagem do LangChain trocando o conteúdo (pydantic v1 ou v2)"""
+    if hasattr(message, 'model_copy'):
+        return message.model_copy(update={'content': content})
+    return message.copy(update={'content': content})
+
+
+def downscale_image_url(url, max_width, quality=80):
+    """Reduz uma imagem em data URL base64 para a largura máxima, reencodando em JPEG"""
+    if not url.startswith('data:image'):
+        return url
+    try:
+        import base64
+        import io
+        from PIL import Image
+
+        header, data = url.split(',', 1)
+        image = Image.open(io.BytesIO(base64.b64decode(data)))
+        if image.width <= max_width:
+            return url
+        height = int(image.height * max_width / image.width)
+        image = image.convert('RGB').resize((max_width, height), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=quality)
+        return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+    except Exception as e:
+        logger.warning(f"Erro ao reduzir screenshot: {e}")
+        return url
+
+
+def trim_history(messages, max_history_messages, head=2):
+    """
+    Mantém as `head` primeiras mensagens (sistema e tarefa) e as últimas
+    `max_history_messages`, sem deixar ToolMessages órfãs no início do recorte.
+    """
+    if not max_history_messages or len(messages) <= head + max_history_messages:
+        return messages
+    tail = list(messages[-max_history_messages:])
+    # Uma ToolMessage precisa da AIMessage com a chamada de ferramenta correspondente
+    while tail and getattr(tail[0], 'type', None) == 'tool':
+        tail.pop(0)
+    return list(messages[:head]) + tail
+
+
+def apply_context_budget(messages, budget):
+    """Aplica o orçamento de contexto (histórico e screenshots) às mensagens enviadas ao LLM"""
+    if not budget:
+        return messages
+    messages = trim_history(messages, budget.get('max_history_messages'))
+
+    max_width = budget.get('screenshot_max_width')
+    if not max_width:
+        return messages
+    prepared = []
+    for message in messages:
+        content = getattr(message, 'content', None)
+        if isinstance(content, list) and any(isinstance(p, dict) and p.get('type') == 'image_url' for p in content):
+            new_content = []
+            for part in content:
+                if isinstance(part, dict) and part.get('type') == 'image_url':
+                    image_url = part['image_url']
+                    url = image_url['url'] if isinstance(image_url, dict) else image_url
+                    new_url = downscale_image_url(url, max_width)
+                    if isinstance(image_url, dict):
+                        part = {**part, 'image_url': {**image_url, 'url': new_url}}
+                    else:
+                        part = {**part, 'image_url': new_url}
+                new_content.append(part)
+            message = _copy_message(message, new_content)
+        prepared.append(message)
+    return prepared
+
+
+class LLMCallStats:
+    """Estatísticas das chamadas feitas por uma instância de LLM"""
+
+    def __init__(self):
+        self.calls = []
+        self.hedges = []
+        self._lock = threading.Lock()
+
+    def record(self, latency, input_tokens=None, output_tokens=None, error=None, **extra):
+        with self._lock:
+            self.calls.append({
+                'latency': round(latency, 3),
+                'input_tokens': input_tokens,
+                'output_tokens': output_tokens,
+                'error': error,
+                **extra,
+            })
+
+    def record_hedge(self, winner, latency):
+        """Registra uma chamada que disparou requisição duplicada e qual resposta venceu"""
+        with self._lock:
+            self.hedges.append({'winner': winner, 'latency': round(latency, 3)})
+
+    def summary(self):
+        """Resumo agregado: número de chamadas, tokens e latências"""
+        with self._lock:
+            calls = list(self.calls)
+            hedges = list(self.hedges)
+        latencies = sorted(call['latency'] for call in calls if not call['error'])
+        return {
+            'calls': len(calls),
+            'errors': sum(1 for call in calls if call['error']),
+            'hedged': len(hedges),
+            'hedge_wins': sum(1 for hedge in hedges if hedge['winner'] == 'hedge'),
+            'input_tokens': sum(call['input_tokens'] or 0 for call in calls),
+            'output_tokens': sum(call['output_tokens'] or 0 for call in calls),
+            'latency_mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'latency_max': latencies[-1] if latencies else None,
+        }
+
+
+class LatencyTracker:
+    """Janela deslizante de latências de um provedor/modelo, compartilhada entre tarefas"""
+
+    def __init__(self, window=200):
+        self.samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        with self._lock:
+            self.samples.append(latency)
+
+    def percentile(self, pct, min_samples=20):
+        """Retorna o percentil `pct` das latências ou None se houver poucas amostras"""
+        with self._lock:
+            samples = sorted(self.samples)
+        if len(samples) < min_samples:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+
+_latency_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def get_latency_tracker(provider, model):
+    """Retorna o rastreador de latência compartilhado para o par provedor/modelo"""
+    key = f"{provider}:{model}"
+    with _trackers_lock:
+        if key not in _latency_trackers:
+            _latency_trackers[key] = LatencyTracker()
+        return _latency_trackers[key]
+
+
+class HedgePolicy:
+    """
+    Política de hedging: se uma chamada ultrapassar o percentil configurado da
+    latência histórica, dispara uma requisição duplicada (no mesmo modelo ou em
+    um modelo de fallback) e usa a primeira resposta válida, cancelando a outra.
+    """
+
+    def __init__(self, tracker, percentile=95, min_samples=20, min_delay=1.0, max_delay=60.0, fallback=None):
+        self.tracker = tracker
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.fallback = fallback
+
+    def delay(self):
+        """Tempo de espera antes de disparar a requisição duplicada (None = sem hedge)"""
+        value = self.tracker.percentile(self.percentile, self.min_samples)
+        if value is None:
+            return None
+        return max(self.min_delay, min(self.max_delay, value))
+
+
+def instrument_llm(llm, limiter=None, stats=None, hedge=None):
+    """Envolve as chamadas de geração da instância com limitação de taxa, hedging e estatísticas"""
+    stats = stats or LLMCallStats()
+    budget = {}
+    original_generate = llm._generate
+    if type(llm)._agenerate in _DEFAULT_AGENERATE:
+        # Sem implementação assíncrona própria, o _agenerate padrão do LangChain chamaria o _generate
+        # instrumentado em um executor, contando a chamada duas vezes. Chamar o original diretamente
+        async def original_agenerate(messages, stop=None, run_manager=None, **kwargs):
+            call = functools.partial(original_generate, messages, stop=stop,
+                                     run_manager=run_manager.get_sync() if run_manager else None, **kwargs)
+            return await asyncio.get_running_loop().run_in_executor(None, call)
+    else:
+        original_agenerate = llm._agenerate
+
+    async def _hedged_agenerate(messages, stop=None, run_manager=None, **kwargs):
+        delay = hedge.delay()
+        started = time.monotonic()
+        primary = asyncio.ensure_future(
+            _limited_agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        )
+        pending = {primary}
+        winner = None
+        try:
+            if delay is None:
+                return await primary
+
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary.result()
+
+            # A chamada principal passou do percentil: disparar a duplicata
+            if hedge.fallback is not None:
+                backup_call = hedge.fallback._agenerate(apply_context_budget(messages, budget), stop=stop, **kwargs)
+            else:
+                backup_call = _limited_agenerate(messages, stop=stop, _hedge=True, **kwargs)
+            backup = asyncio.ensure_future(backup_call)
+            names = {primary: 'primary', backup: 'hedge'}
+            pending = {primary, backup}
+            first_error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        stats.record_hedge(names[task], time.monotonic() - started)
+                        return task.result()
+                    first_error = first_error or task.exception()
+            raise first_error
+        finally:
+            # Cancelar a requisição perdedora (ou ambas, se a chamada foi cancelada)
+            for task in pending:
+                task.cancel()
+            if winner is not None and winner is not primary and primary in pending:
+                # A principal cancelada levaria pelo menos o tempo decorrido: sem essa amostra (limite
+                # inferior), o percentil só veria as chamadas rápidas e o hedge dispararia cada vez mais cedo
+                hedge.tracker.record(time.monotonic() - started)
+
+    async def _limited_agenerate(messages, stop=None, run_manager=None, _hedge=False, **kwargs):
+        scope = _call_scope()
+        messages = apply_context_budget(messages, budget)
+        estimated = estimate_tokens(messages)
+        if limiter:
+            await limiter.acquire(estimated)
+        start = time.monotonic()
+        try:
+            result = await original_agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        except Exception as e:
+            if limiter:
+                limiter.record_failure(e)
+            stats.record(time.monotonic() - start, error=str(e)[:200], hedge=_hedge, **scope)
+            raise
+        finally:
+            if limiter:
+                limiter.release()
+        latency = time.monotonic() - start
+        input_tokens, output_tokens = extract_token_usage(result)
+        if limiter:
+            actual = (input_tokens or 0) + (output_tokens or 0) if input_tokens is not None else None
+            limiter.record_success(estimated, actual)
+        if hedge:
+            hedge.tracker.record(latency)
+        stats.record(latency, input_tokens, output_tokens, hedge=_hedge, **scope)
+        return result
+
+    def _generate(messages, stop=None, run_manager=None, **kwargs):
+        scope = _call_scope()
+        messages = apply_context_budget(messages, budget)
+        estimated = estimate_tokens(messages)
+        if limiter:
+            limiter.acquire_sync(estimated)
+        start = time.monotonic()
+        try:
+            result = original_generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        except Exception as e:
+            if limiter:
+                limiter.record_failure(e)
+            stats.record(time.monotonic() - start, error=str(e)[:200], hedge=False, **scope)
+            raise
+        finally:
+            if limiter:
+                limiter.release()
+        input_tokens, output_tokens = extract_token_usage(result)
+        if limiter:
+            actual = (input_tokens or 0) + (output_tokens or 0) if input_tokens is not None else None
+            limiter.record_success(estimated, actual)
+        stats.record(time.monotonic() - start, input_tokens, output_tokens, hedge=False, **scope)
+        return result
+
+    # Os modelos do LangChain são objetos pydantic; object.__setattr__ evita a validação
+    object.__setattr__(llm, '_agenerate', _hedged_agenerate if hedge else _limited_agenerate)
+    object.__setattr__(llm, '_generate', _generate)
+    object.__setattr__(llm, '_call_stats', stats)
+    object.__setattr__(llm, '_rate_limiter', limiter)
+    object.__setattr__(llm, '_context_budget', budget)
+    return llm
+
+
+def set_context_budget(llm, max_history_messages=None, screenshot_max_width=None):
+    """Define o orçamento de contexto de uma instância instrumentada"""
+    budget = getattr(llm, '_context_budget', None)
+    if budget is None:
+        return
+    budget['max_history_messages'] = max_history_messages or None
+    budget['screenshot_max_width'] = screenshot_max_width or None
+
+
+def get_llm_calls(llm):
+    """Retorna a lista de chamadas registradas (latência e tokens por chamada)"""
+    stats = getattr(llm, '_call_stats', None)
+    if stats is None:
+        return []
+    with stats._lock:
+        return list(stats.calls)
+
+
+def get_llm_stats(llm):
+    """Retorna o resumo das chamadas de uma instância instrumentada (ou None)"""
+    stats = getattr(llm, '_call_stats', None)
+    summary = stats.summary() if stats else None
+    limiter = getattr(llm, '_rate_limiter', None)
+    if summary is not None and limiter is not None:
+        summary['rate_limiter'] = limiter.stats()
+    return summary
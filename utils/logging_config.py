@@ -0,0 +1,237 @@
+"""
+Logging estruturado e não bloqueante, com captura dos logs de cada tarefa.
+
+Os módulos usam `logging.getLogger(__name__)`. O logger raiz recebe apenas um
+QueueHandler: emitir um log é colocar o registro numa fila limitada, sem
+escrita síncrona em stdout no caminho da tarefa. Uma thread (QueueListener)
+formata os registros como JSON, uma linha por registro, e os escreve em
+stdout. Se a fila encher, os registros excedentes são descartados e contados,
+em vez de bloquear quem emitiu.
+
+O id da tarefa e a fase atual ficam em contextvars: tudo que roda dentro de
+`task_log_context` (inclusive tarefas asyncio criadas a partir dele) é marcado
+com o task_id, e os registros da tarefa são guardados em memória para serem
+gravados, comprimidos, no histórico da tarefa.
+
+Variáveis de ambiente: LOG_LEVEL (padrão INFO), LOG_FORMAT (json ou text) e
+LOG_QUEUE_SIZE.
+"""
+import os
+import sys
+import copy
+import json
+import zlib
+import queue
+import logging
+import threading
+import contextvars
+import logging.handlers
+from datetime import datetime, timezone
+from contextlib import contextmanager
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+# Limite de registros guardados por tarefa (os mais antigos são descartados)
+MAX_TASK_LOG_RECORDS = 5000
+
+current_task_id = contextvars.ContextVar('current_task_id', default=None)
+current_phase = contextvars.ContextVar('current_phase', default=None)
+
+# Atributos padrão do LogRecord que não entram como campos extras no JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+_queue_handler = None
+_setup_lock = threading.Lock()
+_task_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+def record_to_dict(record):
+    """Campos do registro: horário, nível, logger, mensagem, task_id, fase e extras"""
+    data = {
+        'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+        'level': record.levelname,
+        'logger': record.name,
+        'message': record.getMessage(),
+    }
+    for key, value in vars(record).items():
+        if key not in _RECORD_ATTRIBUTES and not key.startswith('_') and value is not None:
+            data[key] = value
+    if record.exc_info:
+        data['exc'] = logging.Formatter().formatException(record.exc_info)
+    elif record.exc_text:
+        data['exc'] = record.exc_text
+    return data
+
+
+class JsonFormatter(logging.Formatter):
+    """Um objeto JSON por linha"""
+
+    def format(self, record):
+        return json.dumps(record_to_dict(record), ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Formato legível para desenvolvimento local, com o task_id abreviado"""
+
+    def format(self, record):
+        task_id = getattr(record, 'task_id', None)
+        prefix = f"[{task_id[:8]}] " if task_id else ''
+        line = f"{self.formatTime(record, '%H:%M:%S')} {record.levelname:<7} {prefix}{record.getMessage()}"
+        if record.exc_text:
+            line += '\n' + record.exc_text
+        return line
+
+
+class TaskContextFilter(logging.Filter):
+    """Copia o task_id e a fase dos contextvars para o registro, na thread que emitiu"""
+
+    def filter(self, record):
+        if getattr(record, 'task_id', None) is None:
+            record.task_id = current_task_id.get()
+        if getattr(record, 'phase', None) is None:
+            record.phase = current_phase.get()
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que descarta (e conta) registros quando a fila está cheia"""
+
+    dropped = 0
+
+    def prepare(self, record):
+        # Resolver a mensagem e a exceção na thread que emitiu (args e tracebacks não atravessam a fila),
+        # mantendo a exceção em um campo próprio em vez de concatená-la à mensagem
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
+class TaskLogCapture(logging.Handler):
+    """Guarda em memória os registros das tarefas com captura ativa"""
+
+    def emit(self, record):
+        task_id = getattr(record, 'task_id', None)
+        if task_id is None:
+            return
+        with _buffers_lock:
+            buffer = _task_buffers.get(task_id)
+            if buffer is None:
+                return
+            buffer.append(record_to_dict(record))
+            if len(buffer) > MAX_TASK_LOG_RECORDS:
+                del buffer[0]
+
+
+class _FlushListener(logging.handlers.QueueListener):
+    """QueueListener que reconhece marcadores de flush colocados na fila"""
+
+    def handle(self, record):
+        flushed = getattr(record, 'flush_event', None)
+        if flushed is not None:
+            flushed.set()
+            return
+        super().handle(record)
+
+
+def setup_logging(level=None, log_format=None, stream=None):
+    """
+    Configura o logger raiz com a fila e a thread de escrita (idempotente).
+    `stream` substitui stdout (a CLI escreve os logs em stderr e os resultados em stdout).
+    """
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _listener is not None:
+            return
+        stream_handler = logging.StreamHandler(stream or sys.stdout)
+        stream_handler.setFormatter(TextFormatter() if (log_format or LOG_FORMAT) == 'text' else JsonFormatter())
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        _queue_handler = NonBlockingQueueHandler(log_queue)
+        _queue_handler.addFilter(TaskContextFilter())
+        _listener = _FlushListener(log_queue, stream_handler, TaskLogCapture())
+        _listener.start()
+
+        root = logging.getLogger()
+        root.addHandler(_queue_handler)
+        root.setLevel(level or LOG_LEVEL)
+        # Bibliotecas muito verbosas em INFO/DEBUG
+        for noisy in ('httpx', 'httpcore', 'urllib3', 'asyncio', 'PIL'):
+            logging.getLogger(noisy).setLevel(logging.WARNING)
+
+
+def flush_logs(timeout=2.0):
+    """Espera a thread de escrita processar os registros já enfileirados"""
+    if _listener is None:
+        return
+    marker = logging.LogRecord('logging_config', logging.DEBUG, __file__, 0, 'flush', None, None)
+    marker.flush_event = threading.Event()
+    try:
+        _listener.queue.put(marker, timeout=timeout)
+    except queue.Full:
+        return
+    marker.flush_event.wait(timeout)
+
+
+def logging_stats():
+    return {'dropped': NonBlockingQueueHandler.dropped}
+
+
+class TaskLogs:
+    """Registros capturados de uma tarefa, disponíveis ao sair do task_log_context"""
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.records = []
+
+
+@contextmanager
+def task_log_context(task_id):
+    """Marca os logs emitidos neste contexto com o task_id e os captura para o histórico"""
+    logs = TaskLogs(task_id)
+    with _buffers_lock:
+        _task_buffers[task_id] = logs.records
+    token = current_task_id.set(task_id)
+    try:
+        yield logs
+    finally:
+        current_task_id.reset(token)
+        flush_logs()
+        with _buffers_lock:
+            _task_buffers.pop(task_id, None)
+
+
+@contextmanager
+def log_phase(name):
+    """Marca os logs emitidos neste contexto com a fase da execução"""
+    token = current_phase.set(name)
+    try:
+        yield
+    finally:
+        current_phase.reset(token)
+
+
+def compress_logs(records):
+    """Registros de uma tarefa como JSON Lines comprimido com zlib"""
+    lines = '\n'.join(json.dumps(record, ensure_ascii=False, default=str) for record in records)
+    return zlib.compress(lines.encode('utf-8'), 6)
+
+
+def decompress_logs(blob):
+    """Inverso de compress_logs: lista de registros (dicionários)"""
+    if not blob:
+        return []
+    text = zlib.decompress(blob).decode('utf-8')
+    return [json.loads(line) for line in text.splitlines() if line]
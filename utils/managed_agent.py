@@ -0,0 +1,39 @@
+"""
+Agente do browser_use com ganchos executados ao final de cada passo.
+
+Os ganchos recebem o próprio agente e podem inspecionar a página atual, o
+histórico ou o número do passo (captura de screenshots, checkpoints, etc.).
+Erros em ganchos são registrados e não interrompem a execução do agente.
+As chamadas ao LLM feitas durante o passo são marcadas com o número do passo.
+"""
+import logging
+
+from browser_use import Agent
+
+from utils.llm_control import llm_call_scope
+
+logger = logging.getLogger(__name__)
+
+
+class ManagedAgent(Agent):
+    """Agent que executa ganchos assíncronos após cada passo"""
+
+    def __init__(self, *args, step_hooks=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.step_hooks = list(step_hooks or [])
+
+    @property
+    def current_step(self):
+        state = getattr(self, 'state', None)
+        if state is not None and hasattr(state, 'n_steps'):
+            return state.n_steps
+        return getattr(self, 'n_steps', 0)
+
+    async def step(self, step_info=None):
+        with llm_call_scope('step', step=self.current_step):
+            await super().step(step_info)
+        for hook in self.step_hooks:
+            try:
+                await hook(self)
+            except Exception as e:
+                logger.warning(f"Erro no gancho de passo {getattr(hook, '__name__', hook)}: {e}")
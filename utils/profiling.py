@@ -0,0 +1,285 @@
+"""
+Perfilamento sob demanda de tarefas e renderizações de página.
+
+Dois modos:
+- sampling: uma thread auxiliar lê a pilha da thread perfilada com
+  sys._current_frames() em intervalos fixos (10 ms por padrão). O custo é
+  proporcional à taxa de amostragem e não ao número de chamadas, o que permite
+  deixá-lo ligado para uma fração das tarefas (PROFILE_SAMPLE_RATE). Gera as
+  pilhas agregadas no formato "collapsed" (compatível com flamegraph.pl e
+  speedscope) e um flamegraph SVG.
+- cprofile: cProfile determinístico na thread da tarefa. Mais preciso e mais
+  caro; gera o arquivo .prof (pstats/snakeviz) e um resumo das funções mais
+  custosas.
+
+Os arquivos são gravados em PROFILE_DIR e os mais antigos são removidos
+quando o diretório passa de PROFILE_MAX_FILES arquivos.
+"""
+import os
+import io
+import sys
+import time
+import logging
+import uuid
+import random
+import pstats
+import cProfile
+import hashlib
+import tempfile
+import threading
+from html import escape
+from pathlib import Path
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PROFILER_MODES = ['off', 'sampling', 'cprofile']
+
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR') or Path(tempfile.gettempdir()) / 'browser_agent_profiles')
+# Fração das tarefas perfiladas automaticamente (modo sampling) quando a tarefa não pede perfil
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+# Fração das renderizações de página perfiladas automaticamente
+PROFILE_PAGE_SAMPLE_RATE = float(os.environ.get('PROFILE_PAGE_SAMPLE_RATE', 0))
+DEFAULT_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 10)) / 1000
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 300))
+
+
+def _frame_label(code, cache):
+    label = cache.get(code)
+    if label is None:
+        # Apenas os dois últimos componentes do caminho, sem ';' (separador do formato collapsed)
+        filename = '/'.join(Path(code.co_filename).parts[-2:])
+        label = f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(';', ',')
+        cache[code] = label
+    return label
+
+
+class StackSampler:
+    """Amostra periodicamente a pilha de uma thread e agrega as pilhas iguais"""
+
+    def __init__(self, thread_id=None, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.sampling_seconds = 0.0
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        stack = []
+        while frame is not None:
+            stack.append(_frame_label(frame.f_code, self._labels))
+            frame = frame.f_back
+        stack.reverse()
+        self.stacks[';'.join(stack)] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            started = time.perf_counter()
+            self._sample()
+            self.sampling_seconds += time.perf_counter() - started
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{self.thread_id}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def collapsed(self):
+        """Pilhas no formato collapsed: "raiz;...;folha contagem" por linha"""
+        return '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + '\n'
+
+
+def _frame_color(name):
+    # Paleta quente clássica dos flamegraphs, estável por nome de função
+    digest = hashlib.md5(name.encode()).digest()
+    return f"rgb({205 + digest[0] % 50},{digest[1] % 200},{digest[2] % 55})"
+
+
+def render_flamegraph(stacks, title="Flamegraph", width=1200, frame_height=16):
+    """Gera um flamegraph SVG a partir de um dicionário {pilha collapsed: contagem}"""
+    root = {'children': {}, 'value': 0}
+    for stack, count in stacks.items():
+        root['value'] += count
+        node = root
+        for name in stack.split(';'):
+            node = node['children'].setdefault(name, {'children': {}, 'value': 0})
+            node['value'] += count
+
+    total = root['value'] or 1
+    scale = (width - 20) / total
+    rects = []
+    max_depth = 0
+
+    def layout(node, x, depth):
+        nonlocal max_depth
+        for name, child in node['children'].items():
+            child_width = child['value'] * scale
+            if child_width >= 0.5:
+                max_depth = max(max_depth, depth)
+                rects.append((name, child['value'], x, depth, child_width))
+                layout(child, x, depth + 1)
+            x += child_width
+
+    layout(root, 10.0, 0)
+    height = (max_depth + 1) * frame_height + 50
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}" font-family="Verdana, sans-serif" font-size="11">',
+        '<rect width="100%" height="100%" fill="#fdf8ee"/>',
+        f'<text x="{width / 2}" y="20" text-anchor="middle" font-size="15">{escape(title)}</text>',
+        f'<text x="10" y="{height - 8}" fill="#555">{total} amostras</text>',
+    ]
+    for name, value, x, depth, rect_width in rects:
+        y = height - 30 - (depth + 1) * frame_height
+        label = escape(name)
+        # ~7 px por caractere na fonte de 11 px
+        max_chars = int((rect_width - 6) / 7)
+        text = label if len(name) <= max_chars else (escape(name[:max_chars - 2]) + '..' if max_chars > 3 else '')
+        parts.append(
+            f'<g><title>{label} ({value} amostras, {value / total:.1%})</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{rect_width:.1f}" height="{frame_height - 1}" '
+            f'fill="{_frame_color(name)}" rx="2"/>'
+            + (f'<text x="{x + 3:.1f}" y="{y + frame_height - 4}">{text}</text>' if text else '')
+            + '</g>'
+        )
+    parts.append('</svg>')
+    return '\n'.join(parts)
+
+
+def prune_profiles(directory=PROFILE_DIR, max_files=PROFILE_MAX_FILES):
+    """Remove os arquivos de perfil mais antigos além do limite"""
+    try:
+        files = sorted((path for path in Path(directory).iterdir() if path.is_file()),
+                       key=lambda path: path.stat().st_mtime)
+    except OSError:
+        return
+    for path in files[:max(0, len(files) - max_files)]:
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+class Profiler:
+    """Perfila a thread atual entre start() e stop() e grava os artefatos em disco"""
+
+    def __init__(self, name, mode='sampling', interval=DEFAULT_SAMPLE_INTERVAL, directory=None):
+        if mode not in PROFILER_MODES or mode == 'off':
+            raise ValueError(f"Modo de perfilamento inválido: {mode}")
+        self.name = name
+        self.mode = mode
+        self.interval = interval
+        self.directory = Path(directory or PROFILE_DIR)
+        self.artifacts = None
+        self._sampler = None
+        self._profile = None
+        self._started = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        if self.mode == 'sampling':
+            self._sampler = StackSampler(interval=self.interval)
+            self._sampler.start()
+        else:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        return self
+
+    def stop(self):
+        """Encerra o perfilamento e retorna os caminhos e estatísticas dos artefatos"""
+        if self.artifacts is not None:
+            return self.artifacts
+        duration = time.perf_counter() - self._started
+        if self._sampler is not None:
+            self._sampler.stop()
+        if self._profile is not None:
+            self._profile.disable()
+
+        self.artifacts = {'mode': self.mode, 'duration': round(duration, 3)}
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            base = self.directory / f"{self.name}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+            if self._sampler is not None:
+                self._write_sampling(base, duration)
+            else:
+                self._write_cprofile(base)
+            prune_profiles(self.directory)
+        except OSError as e:
+            logger.error(f"Erro ao gravar perfil {self.name}: {e}")
+            self.artifacts['error'] = str(e)
+        return self.artifacts
+
+    def _write_sampling(self, base, duration):
+        sampler = self._sampler
+        collapsed_path = base.with_suffix('.collapsed.txt')
+        svg_path = base.with_suffix('.svg')
+        collapsed_path.write_text(sampler.collapsed())
+        svg_path.write_text(render_flamegraph(
+            sampler.stacks,
+            title=f"{self.name} ({duration:.1f}s, amostra a cada {self.interval * 1000:.0f} ms)"
+        ))
+        self.artifacts.update({
+            'samples': sampler.samples,
+            'interval_ms': round(self.interval * 1000, 1),
+            # Fração do tempo gasta lendo pilhas (custo do perfilamento)
+            'overhead': round(sampler.sampling_seconds / duration, 4) if duration else 0.0,
+            'collapsed': str(collapsed_path),
+            'svg': str(svg_path),
+        })
+
+    def _write_cprofile(self, base):
+        prof_path = base.with_suffix('.prof')
+        self._profile.dump_stats(str(prof_path))
+        summary = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=summary)
+        stats.sort_stats('cumulative').print_stats(40)
+        top_path = base.with_suffix('.top.txt')
+        top_path.write_text(summary.getvalue())
+        self.artifacts.update({
+            'calls': stats.total_calls,
+            'prof': str(prof_path),
+            'top': str(top_path),
+        })
+
+
+def start_task_profiler(task_id, settings):
+    """Inicia o perfilamento da tarefa se pedido nas configurações ou sorteado pela taxa de amostragem"""
+    mode = settings.get('profiler') or 'off'
+    if mode == 'off' and PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        mode = 'sampling'
+    if mode == 'off':
+        return None
+    try:
+        return Profiler(f"task-{task_id}", mode=mode).start()
+    except Exception as e:
+        logger.error(f"Erro ao iniciar perfilamento da tarefa {task_id}: {e}")
+        return None
+
+
+@contextmanager
+def profile_page(page_name, mode=None):
+    """Perfila a renderização de uma página se `mode` for informado ou sorteado pela taxa de amostragem"""
+    if not mode and PROFILE_PAGE_SAMPLE_RATE > 0 and random.random() < PROFILE_PAGE_SAMPLE_RATE:
+        mode = 'sampling'
+    if not mode or mode == 'off':
+        yield None
+        return
+    # Páginas renderizam em milissegundos: amostrar com mais frequência
+    profiler = Profiler(f"page-{page_name}", mode=mode, interval=min(DEFAULT_SAMPLE_INTERVAL, 0.002)).start()
+    try:
+        yield profiler
+    finally:
+        artifacts = profiler.stop()
+        logger.info(f"Perfil da página {page_name} gravado: {artifacts.get('svg') or artifacts.get('prof')}")
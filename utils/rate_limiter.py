@@ -0,0 +1,294 @@
+"""
+Limitação de taxa por provedor de LLM com concorrência adaptativa (AIMD).
+
+Os limitadores são compartilhados por todas as tarefas do processo. Como cada
+tarefa roda em sua própria thread com um event loop próprio, a sincronização
+usa primitivas de threading e a espera assíncrona é feita com asyncio.sleep.
+"""
+import time
+import asyncio
+import hashlib
+import threading
+
+# Limites padrão por provedor (requisições/min, tokens/min, concorrência máxima).
+# Valores conservadores; podem ser ajustados na página de Configuração.
+DEFAULT_PROVIDER_LIMITS = {
+    'openai': {'requests_per_minute': 500, 'tokens_per_minute': 200000, 'max_concurrency': 16},
+    'anthropic': {'requests_per_minute': 50, 'tokens_per_minute': 40000, 'max_concurrency': 8},
+    'azure': {'requests_per_minute': 300, 'tokens_per_minute': 120000, 'max_concurrency': 12},
+    'gemini': {'requests_per_minute': 60, 'tokens_per_minute': 1000000, 'max_concurrency': 8},
+    'deepseek': {'requests_per_minute': 60, 'tokens_per_minute': 100000, 'max_concurrency': 8},
+    'ollama': {'requests_per_minute': None, 'tokens_per_minute': None, 'max_concurrency': 2},
+}
+
+FALLBACK_LIMITS = {'requests_per_minute': 60, 'tokens_per_minute': 60000, 'max_concurrency': 4}
+
+# Códigos HTTP que indicam sobrecarga do provedor
+OVERLOAD_STATUS_CODES = {429, 500, 502, 503, 504, 529}
+
+
+class TokenBucket:
+    """Balde de tokens com reposição contínua, seguro entre threads"""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(capacity or rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def try_consume(self, amount=1.0):
+        """Consome `amount` tokens; retorna 0 em caso de sucesso ou os segundos até haver saldo"""
+        amount = min(float(amount), self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            self._refill(now)
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / self.rate
+
+    def adjust(self, delta):
+        """Corrige o saldo após conhecer o consumo real (delta positivo devolve tokens)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = max(-self.capacity, min(self.capacity, self.tokens + delta))
+
+    def pause(self, seconds):
+        """Bloqueia o balde por alguns segundos (ex.: cabeçalho Retry-After)"""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class AdaptiveConcurrency:
+    """Limite de concorrência AIMD: cresce +1 por janela saudável e cai pela metade em sobrecarga"""
+
+    def __init__(self, max_limit, min_limit=1, initial=None, decrease_factor=0.5, cooldown=5.0):
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        self.limit = float(initial or max(self.min_limit, self.max_limit // 2))
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """Tenta ocupar uma vaga de concorrência"""
+        with self._lock:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def release(self):
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+    def on_success(self):
+        """Aumento aditivo: +1 a cada `limit` respostas saudáveis"""
+        with self._lock:
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / max(self.limit, 1.0))
+
+    def on_overload(self):
+        """Redução multiplicativa, no máximo uma vez por período de cooldown"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self.last_decrease < self.cooldown:
+                return
+            self.last_decrease = now
+            self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+
+
+def extract_status_code(exc):
+    """Extrai o código HTTP de uma exceção de cliente de LLM, se houver"""
+    for attr in ('status_code', 'http_status', 'status'):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+
+    response = getattr(exc, 'response', None)
+    if response is not None:
+        value = getattr(response, 'status_code', None) or getattr(response, 'status', None)
+        if isinstance(value, int):
+            return value
+
+    name = exc.__class__.__name__
+    if 'RateLimit' in name or 'ResourceExhausted' in name:
+        return 429
+    if 'InternalServer' in name or 'ServiceUnavailable' in name or 'Overloaded' in name:
+        return 503
+    # Números na mensagem não são confiáveis ("max_tokens 500", "index 503")
+    return None
+
+
+def extract_retry_after(exc):
+    """Lê o cabeçalho Retry-After da resposta associada à exceção, em segundos"""
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None) if response is not None else None
+    if not headers:
+        return None
+    try:
+        value = headers.get('retry-after') or headers.get('Retry-After')
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class ProviderLimiter:
+    """Limitador de requisições, tokens e concorrência para um provedor/chave de API"""
+
+    def __init__(self, provider, requests_per_minute=None, tokens_per_minute=None,
+                 max_concurrency=8, min_concurrency=1):
+        self.provider = provider
+        self.configure(requests_per_minute, tokens_per_minute, max_concurrency, min_concurrency)
+        self.counters = {'requests': 0, 'overloads': 0, 'errors': 0, 'wait_seconds': 0.0}
+        self._counter_lock = threading.Lock()
+
+    def configure(self, requests_per_minute=None, tokens_per_minute=None, max_concurrency=8, min_concurrency=1):
+        """(Re)define os limites; None desativa o respectivo balde"""
+        self.limits = {
+            'requests_per_minute': requests_per_minute,
+            'tokens_per_minute': tokens_per_minute,
+            'max_concurrency': max_concurrency,
+            'min_concurrency': min_concurrency,
+        }
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        previous = getattr(self, 'concurrency', None)
+        self.concurrency = AdaptiveConcurrency(max_concurrency, min_limit=min_concurrency)
+        if previous is not None:
+            # Preservar as chamadas em andamento para que os releases continuem consistentes
+            self.concurrency.in_flight = previous.in_flight
+
+    def _try_acquire(self, estimated_tokens, state):
+        """Uma tentativa de aquisição; retorna 0 quando liberado ou o tempo sugerido de espera"""
+        if not state['slot']:
+            if not self.concurrency.try_acquire():
+                return 0.05
+            state['slot'] = True
+        if not state['request'] and self.request_bucket:
+            wait = self.request_bucket.try_consume(1)
+            if wait:
+                return wait
+        state['request'] = True
+        if self.token_bucket and estimated_tokens:
+            wait = self.token_bucket.try_consume(estimated_tokens)
+            if wait:
+                return wait
+        return 0.0
+
+    async def acquire(self, estimated_tokens=0, max_poll=1.0):
+        """Aguarda (sem bloquear o event loop) até haver vaga e saldo para a chamada"""
+        state = {'slot': False, 'request': False}
+        started = time.monotonic()
+        try:
+            while True:
+                wait = self._try_acquire(estimated_tokens, state)
+                if not wait:
+                    break
+                await asyncio.sleep(min(wait, max_poll))
+        except asyncio.CancelledError:
+            # Chamada cancelada durante a espera: devolver a vaga já ocupada
+            if state['slot']:
+                self.release()
+            raise
+        self._count('requests', 1)
+        self._count('wait_seconds', time.monotonic() - started)
+
+    def acquire_sync(self, estimated_tokens=0, max_poll=1.0):
+        """Versão síncrona de `acquire` para chamadas bloqueantes"""
+        state = {'slot': False, 'request': False}
+        started = time.monotonic()
+        while True:
+            wait = self._try_acquire(estimated_tokens, state)
+            if not wait:
+                break
+            time.sleep(min(wait, max_poll))
+        self._count('requests', 1)
+        self._count('wait_seconds', time.monotonic() - started)
+
+    def release(self):
+        self.concurrency.release()
+
+    def record_success(self, estimated_tokens=0, actual_tokens=None):
+        """Registra uma resposta saudável e corrige a estimativa de tokens"""
+        self.concurrency.on_success()
+        if self.token_bucket and actual_tokens is not None:
+            self.token_bucket.adjust(estimated_tokens - actual_tokens)
+
+    def record_failure(self, exc):
+        """Registra uma falha; em 429/5xx reduz a concorrência e respeita o Retry-After"""
+        status = extract_status_code(exc)
+        if status in OVERLOAD_STATUS_CODES:
+            self._count('overloads', 1)
+            self.concurrency.on_overload()
+            retry_after = extract_retry_after(exc)
+            if status == 429:
+                pause = retry_after if retry_after is not None else 1.0
+                if self.request_bucket:
+                    self.request_bucket.pause(pause)
+                if self.token_bucket:
+                    self.token_bucket.pause(pause)
+        else:
+            self._count('errors', 1)
+        return status
+
+    def _count(self, name, value):
+        with self._counter_lock:
+            self.counters[name] += value
+
+    def stats(self):
+        """Retorna um resumo do estado atual do limitador"""
+        with self._counter_lock:
+            counters = dict(self.counters)
+        counters['wait_seconds'] = round(counters['wait_seconds'], 3)
+        return {
+            'provider': self.provider,
+            'concurrency_limit': round(self.concurrency.limit, 2),
+            'in_flight': self.concurrency.in_flight,
+            **self.limits,
+            **counters,
+        }
+
+
+# Registro global de limitadores, compartilhado entre todas as tarefas do processo
+_limiters = {}
+_registry_lock = threading.Lock()
+
+
+def _limiter_key(provider, api_key):
+    digest = hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:12]
+    return f"{provider}:{digest}"
+
+
+def get_provider_limiter(provider, api_key=None, **overrides):
+    """Retorna o limitador compartilhado para o par provedor/chave de API"""
+    limits = dict(DEFAULT_PROVIDER_LIMITS.get(provider, FALLBACK_LIMITS))
+    limits.update({k: v for k, v in overrides.items() if k in limits or k == 'min_concurrency'})
+
+    key = _limiter_key(provider, api_key)
+    with _registry_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = ProviderLimiter(provider, **limits)
+            _limiters[key] = limiter
+        elif any(limiter.limits.get(k) != v for k, v in limits.items()):
+            # Limites alterados na configuração: reconfigurar mantendo os contadores
+            limiter.configure(**limits)
+        return limiter
+
+
+def get_all_limiter_stats():
+    """Retorna as estatísticas de todos os limitadores ativos"""
+    with _registry_lock:
+        return {key: limiter.stats() for key, limiter in _limiters.items()}
@@ -0,0 +1,182 @@
+"""
+Bloqueio de requisições do navegador para carregamento enxuto das páginas.
+
+Os perfis definem quais tipos de recurso e quais padrões de URL são abortados
+antes de sair do navegador. Uma lista local de domínios (formato hosts ou um
+domínio por linha) pode complementar qualquer perfil.
+"""
+import os
+import logging
+import fnmatch
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# Padrões comuns de analytics e anúncios
+ANALYTICS_PATTERNS = [
+    '*google-analytics.com/*',
+    '*googletagmanager.com/*',
+    '*analytics.google.com/*',
+    '*hotjar.com/*',
+    '*segment.io/*',
+    '*segment.com/analytics*',
+    '*mixpanel.com/*',
+    '*clarity.ms/*',
+    '*connect.facebook.net/*',
+    '*facebook.com/tr*',
+]
+
+AD_PATTERNS = [
+    '*doubleclick.net/*',
+    '*googlesyndication.com/*',
+    '*googleadservices.com/*',
+    '*adservice.google.*',
+    '*amazon-adsystem.com/*',
+    '*adnxs.com/*',
+    '*taboola.com/*',
+    '*outbrain.com/*',
+    '*criteo.com/*',
+]
+
+BLOCK_PROFILES = {
+    # Não bloqueia nada
+    'none': {'resource_types': [], 'url_patterns': []},
+    # Apenas analytics e anúncios; a página continua visualmente idêntica
+    'trackers': {'resource_types': [], 'url_patterns': ANALYTICS_PATTERNS + AD_PATTERNS},
+    # Remove mídia pesada e fontes; recomendado para tarefas baseadas em texto
+    'lean': {
+        'resource_types': ['image', 'media', 'font'],
+        'url_patterns': ANALYTICS_PATTERNS + AD_PATTERNS,
+    },
+    # Também remove folhas de estilo; o layout pode quebrar em alguns sites
+    'minimal': {
+        'resource_types': ['image', 'media', 'font', 'stylesheet', 'texttrack', 'eventsource', 'manifest'],
+        'url_patterns': ANALYTICS_PATTERNS + AD_PATTERNS,
+    },
+}
+
+DEFAULT_BLOCK_PROFILE = 'none'
+
+# Cache das listas de domínios já carregadas, por caminho e data de modificação
+_blocklist_cache = {}
+
+
+def load_domain_blocklist(path):
+    """Carrega uma lista de domínios (formato hosts ou um domínio por linha)"""
+    if not path or not os.path.exists(path):
+        return frozenset()
+
+    mtime = os.path.getmtime(path)
+    cached = _blocklist_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    domains = set()
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            parts = line.split()
+            # Formato hosts: "0.0.0.0 dominio.com"
+            domain = parts[1] if len(parts) > 1 else parts[0]
+            domains.add(domain.lower().lstrip('.'))
+
+    domains = frozenset(domains)
+    _blocklist_cache[path] = (mtime, domains)
+    logger.info(f"Lista de bloqueio carregada: {len(domains)} domínios de {path}")
+    return domains
+
+
+def resolve_block_settings(browser_config_dict, overrides=None):
+    """Combina o perfil global da configuração do navegador com as sobrescritas da tarefa"""
+    settings = {
+        'block_profile': browser_config_dict.get('block_profile', DEFAULT_BLOCK_PROFILE),
+        'block_resource_types': browser_config_dict.get('block_resource_types') or [],
+        'block_url_patterns': browser_config_dict.get('block_url_patterns') or [],
+        'blocklist_path': browser_config_dict.get('blocklist_path') or os.environ.get('BROWSER_BLOCKLIST_PATH'),
+    }
+    for key, value in (overrides or {}).items():
+        if key not in settings or value in (None, '') or value == []:
+            continue
+        if isinstance(settings[key], list):
+            # Padrões e tipos da tarefa somam-se aos globais em vez de substituí-los
+            settings[key] = settings[key] + [item for item in value if item not in settings[key]]
+        else:
+            settings[key] = value
+    return settings
+
+
+class RequestBlocker:
+    """Intercepta as requisições de um contexto do navegador e aborta as bloqueadas"""
+
+    def __init__(self, profile=DEFAULT_BLOCK_PROFILE, resource_types=None, url_patterns=None, blocklist_path=None):
+        base = BLOCK_PROFILES.get(profile, BLOCK_PROFILES[DEFAULT_BLOCK_PROFILE])
+        self.profile = profile
+        self.resource_types = set(base['resource_types']) | set(resource_types or [])
+        self.url_patterns = list(base['url_patterns']) + list(url_patterns or [])
+        self.blocked_domains = load_domain_blocklist(blocklist_path)
+        self.counters = {
+            'total': 0,
+            'blocked': 0,
+            'by_resource_type': {},
+            'by_reason': {'resource_type': 0, 'domain': 0, 'url_pattern': 0},
+        }
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            profile=settings.get('block_profile', DEFAULT_BLOCK_PROFILE),
+            resource_types=settings.get('block_resource_types'),
+            url_patterns=settings.get('block_url_patterns'),
+            blocklist_path=settings.get('blocklist_path'),
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.resource_types or self.url_patterns or self.blocked_domains)
+
+    def _domain_blocked(self, host):
+        # Verifica o host e todos os domínios pai (ads.exemplo.com -> exemplo.com)
+        parts = host.split('.')
+        return any('.'.join(parts[i:]) in self.blocked_domains for i in range(len(parts) - 1))
+
+    def match(self, url, resource_type):
+        """Retorna o motivo do bloqueio da requisição ou None se ela deve seguir"""
+        if resource_type in self.resource_types:
+            return 'resource_type'
+        if self.blocked_domains:
+            host = (urlparse(url).hostname or '').lower()
+            if host and self._domain_blocked(host):
+                return 'domain'
+        for pattern in self.url_patterns:
+            if fnmatch.fnmatch(url, pattern):
+                return 'url_pattern'
+        return None
+
+    async def handle_route(self, route):
+        request = route.request
+        self.counters['total'] += 1
+        reason = self.match(request.url, request.resource_type)
+        if reason is None:
+            # fallback() permite que outros handlers (ex.: replay de HAR) tratem a requisição
+            await route.fallback()
+            return
+        self.counters['blocked'] += 1
+        self.counters['by_reason'][reason] += 1
+        by_type = self.counters['by_resource_type']
+        by_type[request.resource_type] = by_type.get(request.resource_type, 0) + 1
+        await route.abort('blockedbyclient')
+
+    async def attach(self, context):
+        """
+        Registra a interceptação em um contexto do Playwright. Com rotas registradas o
+        Playwright desativa o cache HTTP do contexto, inclusive o de perfis persistentes
+        """
+        if not self.enabled:
+            return
+        await context.route('**/*', self.handle_route)
+        logger.info(f"Bloqueio de requisições ativo (perfil: {self.profile})")
+
+    def stats(self):
+        return {'profile': self.profile, **self.counters}
@@ -0,0 +1,143 @@
+"""
+Watchdog de memória e CPU dos processos do navegador de cada tarefa.
+
+O Chromium de cada tarefa é iniciado com uma flag marcadora
+(--browser-agent-task=<id>), o que permite encontrar o processo principal do
+navegador entre os filhos deste processo e somar o consumo de toda a árvore
+(renderers, GPU, utilitários). Se o teto de memória da tarefa for excedido,
+apenas essa árvore é encerrada e a tarefa falha, em vez de o container
+inteiro ser morto por OOM.
+"""
+import os
+import logging
+import asyncio
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+TASK_MARKER_FLAG = '--browser-agent-task'
+
+DEFAULT_MEMORY_LIMIT_MB = int(os.environ.get('BROWSER_MEMORY_LIMIT_MB', 1536))
+
+
+class MemoryLimitExceeded(Exception):
+    """O navegador da tarefa excedeu o teto de memória configurado"""
+
+
+def task_marker_arg(task_id):
+    """Flag inofensiva para o Chromium que identifica os processos da tarefa"""
+    return f"{TASK_MARKER_FLAG}={task_id}"
+
+
+class ResourceWatchdog:
+    """Amostra RSS/CPU da árvore de processos do navegador de uma tarefa e aplica o teto de memória"""
+
+    def __init__(self, task_id, memory_limit_mb=DEFAULT_MEMORY_LIMIT_MB, interval=1.0, on_exceeded=None):
+        self.task_id = task_id
+        self.marker = task_marker_arg(task_id)
+        self.memory_limit_mb = memory_limit_mb
+        self.interval = interval
+        self.on_exceeded = on_exceeded
+        self.exceeded = False
+        self.peak_rss_mb = 0.0
+        self.peak_cpu_percent = 0.0
+        self.peak_processes = 0
+        self.samples = 0
+        self._root = None
+        self._cpu_cache = {}
+
+    @property
+    def available(self):
+        return psutil is not None
+
+    def _find_root(self):
+        """Procura, entre os descendentes deste processo, o Chromium com a flag da tarefa"""
+        try:
+            for proc in psutil.Process(os.getpid()).children(recursive=True):
+                try:
+                    if self.marker in proc.cmdline():
+                        # O processo principal do navegador é o ancestral mais alto com a flag
+                        parent = proc.parent()
+                        while parent is not None and self.marker in parent.cmdline():
+                            proc, parent = parent, parent.parent()
+                        return proc
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    continue
+        except psutil.Error:
+            pass
+        return None
+
+    def _tree(self):
+        if self._root is None or not self._root.is_running():
+            self._root = self._find_root()
+        if self._root is None:
+            return []
+        try:
+            return [self._root] + self._root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            self._root = None
+            return []
+
+    def sample(self):
+        """Coleta uma amostra; retorna (rss_mb, cpu_percent, número de processos)"""
+        rss = 0
+        cpu = 0.0
+        processes = self._tree()
+        for proc in processes:
+            try:
+                rss += proc.memory_info().rss
+                # cpu_percent precisa do mesmo objeto Process entre chamadas
+                cached = self._cpu_cache.setdefault(proc.pid, proc)
+                cpu += cached.cpu_percent(None)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        rss_mb = rss / (1024 * 1024)
+        self.samples += 1
+        self.peak_rss_mb = max(self.peak_rss_mb, rss_mb)
+        self.peak_cpu_percent = max(self.peak_cpu_percent, cpu)
+        self.peak_processes = max(self.peak_processes, len(processes))
+        return rss_mb, cpu, len(processes)
+
+    def kill(self):
+        """Encerra toda a árvore de processos do navegador da tarefa"""
+        processes = self._tree()
+        for proc in reversed(processes):
+            try:
+                proc.kill()
+            except psutil.Error:
+                pass
+        psutil.wait_procs(processes, timeout=5)
+        logger.warning(f"Navegador da tarefa {self.task_id} encerrado pelo watchdog ({len(processes)} processos)")
+
+    async def run(self):
+        """Laço de monitoramento; termina ao ser cancelado ou ao exceder o teto"""
+        if not self.available:
+            logger.warning("psutil não disponível; watchdog de recursos desativado")
+            return
+        loop = asyncio.get_running_loop()
+        while True:
+            rss_mb, _, _ = await loop.run_in_executor(None, self.sample)
+            if self.memory_limit_mb and rss_mb > self.memory_limit_mb:
+                self.exceeded = True
+                logger.warning(f"Tarefa {self.task_id} excedeu o teto de memória: {rss_mb:.0f} MB > {self.memory_limit_mb} MB")
+                # wait_procs pode levar até 5 s; fora do event loop, que precisa cancelar o agente
+                await loop.run_in_executor(None, self.kill)
+                if self.on_exceeded:
+                    self.on_exceeded()
+                return
+            await asyncio.sleep(self.interval)
+
+    def stats(self):
+        return {
+            'memory_limit_mb': self.memory_limit_mb,
+            'peak_rss_mb': round(self.peak_rss_mb, 1),
+            'peak_cpu_percent': round(self.peak_cpu_percent, 1),
+            'peak_processes': self.peak_processes,
+            'samples': self.samples,
+            'exceeded': self.exceeded,
+            'monitored': self.available,
+        }
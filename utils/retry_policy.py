@@ -0,0 +1,312 @@
+"""
+Política de retry para ações do navegador com backoff exponencial e circuit breakers.
+
+Os erros são classificados em transitórios (timeouts, conexão reiniciada,
+sobrecarga do servidor) e permanentes (elemento inexistente, DNS, certificado).
+Apenas erros transitórios em ações idempotentes são repetidos, com espera
+exponencial e jitter. Falhas transitórias seguidas em um mesmo domínio abrem
+o circuito desse domínio: novas ações nele falham imediatamente até o fim do
+período de espera, em vez de consumir passos do agente.
+
+Os circuit breakers são compartilhados por todas as tarefas do processo.
+"""
+import time
+import logging
+import random
+import asyncio
+import threading
+from urllib.parse import urlparse
+
+from browser_use import Controller
+from browser_use.agent.views import ActionResult
+
+from utils.rate_limiter import extract_status_code
+
+logger = logging.getLogger(__name__)
+
+# Trechos de mensagens de erro do Playwright/Chromium que indicam falha transitória
+TRANSIENT_ERROR_MARKERS = [
+    'timeout',
+    'timed out',
+    'net::err_connection_reset',
+    'net::err_connection_closed',
+    'net::err_connection_refused',
+    'net::err_connection_timed_out',
+    'net::err_timed_out',
+    'net::err_network_changed',
+    'net::err_internet_disconnected',
+    'net::err_empty_response',
+    'net::err_http2_protocol_error',
+    'execution context was destroyed',
+    'navigation interrupted',
+    'frame was detached',
+    'target page, context or browser has been closed',
+]
+
+# Trechos que indicam falha permanente: repetir não muda o resultado
+PERMANENT_ERROR_MARKERS = [
+    'net::err_name_not_resolved',
+    'net::err_cert',
+    'net::err_ssl',
+    'net::err_blocked_by_client',
+    'net::err_file_not_found',
+    'net::err_invalid_url',
+    'element with index',
+    'does not exist',
+    'not found',
+    'invalid',
+]
+
+TRANSIENT_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+# Ações que podem ser repetidas sem efeito colateral duplicado
+IDEMPOTENT_ACTIONS = {
+    'go_to_url', 'open_tab', 'switch_tab', 'go_back', 'search_google',
+    'scroll_down', 'scroll_up', 'scroll_to_text', 'extract_content',
+    'get_dropdown_options', 'wait',
+}
+
+# Ações que não tocam a rede nem a página e nunca passam pelo retry
+PASSTHROUGH_ACTIONS = {'done'}
+
+DEFAULT_RETRY_SETTINGS = {
+    'retry_max_attempts': 3,
+    'retry_base_delay': 0.5,
+    'retry_max_delay': 8.0,
+    'circuit_failure_threshold': 5,
+    'circuit_reset_seconds': 30.0,
+}
+
+
+def classify_error(error):
+    """Classifica um erro (exceção ou mensagem) como 'transient' ou 'permanent'"""
+    message = str(error).lower()
+    # Marcadores permanentes têm prioridade sobre tudo: "Element ... not found (timeout)" não deve ser repetido
+    if any(marker in message for marker in PERMANENT_ERROR_MARKERS):
+        return 'permanent'
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return 'transient'
+    if isinstance(error, BaseException):
+        # Apenas códigos estruturados (atributos ou resposta); números na mensagem não contam
+        status = extract_status_code(error)
+        if status is not None:
+            return 'transient' if status in TRANSIENT_STATUS_CODES else 'permanent'
+    if any(marker in message for marker in TRANSIENT_ERROR_MARKERS):
+        return 'transient'
+    return 'permanent'
+
+
+class RetryPolicy:
+    """Número de tentativas e espera exponencial com jitter completo"""
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=8.0):
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            max_attempts=settings.get('retry_max_attempts', DEFAULT_RETRY_SETTINGS['retry_max_attempts']),
+            base_delay=settings.get('retry_base_delay', DEFAULT_RETRY_SETTINGS['retry_base_delay']),
+            max_delay=settings.get('retry_max_delay', DEFAULT_RETRY_SETTINGS['retry_max_delay']),
+        )
+
+    def delay(self, attempt):
+        """Espera antes da tentativa `attempt + 1` (attempt começa em 1)"""
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+
+class CircuitBreaker:
+    """Circuit breaker de um domínio: closed -> open após falhas seguidas -> half_open após o timeout"""
+
+    def __init__(self, domain, failure_threshold=5, reset_seconds=30.0):
+        self.domain = domain
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_seconds = float(reset_seconds)
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Indica se uma ação no domínio pode ser executada agora"""
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.reset_seconds:
+                    self.rejected += 1
+                    return False
+                self.state = 'half_open'
+                self._probe_in_flight = False
+            if self.state == 'half_open':
+                # Apenas uma tentativa de sondagem por vez
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def retry_in(self):
+        """Segundos até o circuito aceitar uma nova sondagem"""
+        with self._lock:
+            return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.times_opened += 1
+                    logger.warning(f"Circuito aberto para {self.domain} após {self.failures} falhas")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def release_probe(self):
+        """Libera a sondagem quando a ação terminou sem indicar a saúde do domínio"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected,
+            }
+
+
+# Registro global de circuit breakers por domínio
+_breakers = {}
+_registry_lock = threading.Lock()
+
+
+def get_circuit_breaker(domain, failure_threshold=5, reset_seconds=30.0):
+    """Retorna o circuit breaker compartilhado do domínio"""
+    with _registry_lock:
+        breaker = _breakers.get(domain)
+        if breaker is None:
+            breaker = CircuitBreaker(domain, failure_threshold, reset_seconds)
+            _breakers[domain] = breaker
+        else:
+            breaker.failure_threshold = max(1, int(failure_threshold))
+            breaker.reset_seconds = float(reset_seconds)
+        return breaker
+
+
+def get_all_breaker_stats():
+    """Retorna o estado de todos os circuit breakers ativos"""
+    with _registry_lock:
+        return {domain: breaker.stats() for domain, breaker in _breakers.items()}
+
+
+def get_domain(url):
+    return (urlparse(url or '').hostname or '').lower() or None
+
+
+class RetryingController(Controller):
+    """Controller que aplica a política de retry e os circuit breakers a cada ação"""
+
+    def __init__(self, *args, retry_settings=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        settings = {**DEFAULT_RETRY_SETTINGS, **(retry_settings or {})}
+        self.policy = RetryPolicy.from_settings(settings)
+        self.failure_threshold = settings['circuit_failure_threshold']
+        self.reset_seconds = settings['circuit_reset_seconds']
+        self.counters = {
+            'actions': 0,
+            'retries': 0,
+            'recovered': 0,
+            'transient_errors': 0,
+            'permanent_errors': 0,
+            'circuit_rejections': 0,
+            'backoff_seconds': 0.0,
+            'by_action': {},
+        }
+        self.domains = set()
+
+    async def _action_domain(self, action_name, params, browser_context):
+        if isinstance(params, dict) and params.get('url'):
+            return get_domain(params['url'])
+        if action_name == 'search_google':
+            return 'www.google.com'
+        try:
+            page = await browser_context.get_current_page()
+            return get_domain(page.url)
+        except Exception:
+            return None
+
+    def _count_action(self, action_name, key):
+        by_action = self.counters['by_action'].setdefault(action_name, {'retries': 0, 'failures': 0})
+        by_action[key] += 1
+
+    async def act(self, action, browser_context, *args, **kwargs):
+        action_data = action.model_dump(exclude_unset=True)
+        action_name = next((name for name, params in action_data.items() if params is not None), None)
+        if action_name is None or action_name in PASSTHROUGH_ACTIONS:
+            return await super().act(action, browser_context, *args, **kwargs)
+
+        self.counters['actions'] += 1
+        domain = await self._action_domain(action_name, action_data.get(action_name), browser_context)
+        breaker = get_circuit_breaker(domain, self.failure_threshold, self.reset_seconds) if domain else None
+        if domain:
+            self.domains.add(domain)
+
+        if breaker is not None and not breaker.allow():
+            self.counters['circuit_rejections'] += 1
+            # Retornar um erro ao modelo em vez de esperar: ele pode escolher outro caminho
+            return ActionResult(
+                error=f"O site {domain} está falhando repetidamente; nova tentativa possível em "
+                      f"{breaker.retry_in():.0f}s. Tente outra abordagem ou outro site.",
+                include_in_memory=True
+            )
+
+        max_attempts = self.policy.max_attempts if action_name in IDEMPOTENT_ACTIONS else 1
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = await super().act(action, browser_context, *args, **kwargs)
+            except Exception as e:
+                kind = classify_error(e)
+                self.counters[f"{kind}_errors"] += 1
+                if kind == 'transient' and breaker is not None:
+                    breaker.record_failure()
+                elif breaker is not None:
+                    # Erro permanente da ação (ex.: índice inválido) não diz nada sobre o site
+                    breaker.release_probe()
+                if kind == 'permanent' or attempt >= max_attempts or (breaker is not None and not breaker.allow()):
+                    self._count_action(action_name, 'failures')
+                    raise
+                delay = self.policy.delay(attempt)
+                self.counters['retries'] += 1
+                self.counters['backoff_seconds'] += delay
+                self._count_action(action_name, 'retries')
+                logger.warning(f"Erro transitório em {action_name} ({domain}), tentativa {attempt + 1} "
+                           f"de {max_attempts} em {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+                continue
+
+            if breaker is not None:
+                breaker.record_success()
+            if attempt > 1:
+                self.counters['recovered'] += 1
+            return result
+
+    def stats(self):
+        counters = dict(self.counters)
+        counters['backoff_seconds'] = round(counters['backoff_seconds'], 2)
+        counters['circuits'] = {domain: stats for domain, stats in get_all_breaker_stats().items()
+                                if domain in self.domains}
+        return counters
@@ -0,0 +1,197 @@
+"""
+Política adaptativa de captura e armazenamento de screenshots.
+
+Os quadros são os screenshots que o browser_use já tira para o estado de cada
+passo, processados ao final do passo (sem uma segunda captura). Cada quadro
+recebe um hash perceptual (dHash) antes de ser gravado. Quadros praticamente
+iguais ao anterior não são gravados: apenas uma referência ao último quadro
+salvo é registrada. Opcionalmente, quando só uma parte da página mudou, apenas a região
+alterada é gravada.
+"""
+import io
+import base64
+import threading
+from pathlib import Path
+
+SCREENSHOT_POLICIES = ['adaptive', 'every_step', 'off']
+
+# Distância de Hamming (de 64 bits) abaixo da qual dois quadros são considerados iguais
+DEFAULT_DEDUP_THRESHOLD = 4
+
+# Script que conta mutações do DOM, usado para decidir quando capturar sem visão
+MUTATION_COUNTER_SCRIPT = """
+(() => {
+    if (window.__agentMutationCount !== undefined) return;
+    window.__agentMutationCount = 0;
+    const start = () => new MutationObserver((mutations) => {
+        window.__agentMutationCount += mutations.length;
+    }).observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', start);
+    } else {
+        start();
+    }
+})();
+"""
+
+
+def dhash(image, hash_size=8):
+    """Hash perceptual por diferença de gradiente (64 bits para hash_size=8)"""
+    from PIL import Image
+
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def decode_screenshot(data):
+    """Aceita bytes, base64 ou caminho de arquivo e retorna os bytes da imagem"""
+    if isinstance(data, bytes):
+        return data
+    if isinstance(data, str) and len(data) < 1024 and Path(data).exists():
+        return Path(data).read_bytes()
+    if isinstance(data, str):
+        if data.startswith('data:image'):
+            data = data.split(',', 1)[1]
+        return base64.b64decode(data)
+    raise ValueError("Formato de screenshot não suportado")
+
+
+class ScreenshotPolicy:
+    """Decide quais quadros gravar e mantém o registro de quadros da tarefa"""
+
+    def __init__(self, output_dir, task_id, mode='adaptive', dedup_threshold=DEFAULT_DEDUP_THRESHOLD,
+                 crop_changes=False, max_crop_ratio=0.5, vision=True):
+        self.output_dir = Path(output_dir)
+        self.vision = vision
+        self.task_id = task_id
+        self.mode = mode
+        self.dedup_threshold = dedup_threshold
+        self.crop_changes = crop_changes
+        self.max_crop_ratio = max_crop_ratio
+        self.frames = []
+        self.counters = {'offered': 0, 'saved': 0, 'deduplicated': 0, 'cropped': 0, 'bytes_written': 0}
+        self._last_saved = None  # (hash, imagem, índice do quadro)
+        self._last_url = None
+        self._last_mutations = None
+        self._lock = threading.Lock()
+
+    def should_capture(self, url, mutation_count=None):
+        """Sem visão, capturar apenas em navegação ou quando o DOM mudou"""
+        if self.mode == 'off':
+            return False
+        if self.mode == 'every_step':
+            return True
+        changed = url != self._last_url or mutation_count is None or mutation_count != self._last_mutations
+        self._last_url = url
+        self._last_mutations = mutation_count
+        return changed
+
+    def process(self, step, url, data):
+        """Processa um quadro; grava-o, grava a região alterada ou apenas referencia o anterior"""
+        # Subtarefas paralelas compartilham a política e processam quadros em threads diferentes
+        with self._lock:
+            return self._process(step, url, data)
+
+    def _process(self, step, url, data):
+        if self.mode == 'off' or data is None:
+            return None
+        from PIL import Image, ImageChops
+
+        raw = decode_screenshot(data)
+        image = Image.open(io.BytesIO(raw))
+        frame_hash = dhash(image)
+        self.counters['offered'] += 1
+
+        navigated = bool(self.frames) and url != self.frames[-1]['url']
+        if self.mode == 'adaptive' and self._last_saved is not None and not navigated:
+            last_hash, last_image, last_index = self._last_saved
+            if hamming_distance(frame_hash, last_hash) <= self.dedup_threshold:
+                self.counters['deduplicated'] += 1
+                frame = {'step': step, 'url': url, 'hash': f"{frame_hash:016x}", 'ref': last_index}
+                self.frames.append(frame)
+                return frame
+
+        frame = {'step': step, 'url': url, 'hash': f"{frame_hash:016x}"}
+        path = self.output_dir / f"{self.task_id}_step{step:03d}_{len(self.frames):03d}.png"
+
+        region = None
+        if self.crop_changes and self._last_saved is not None and not navigated:
+            last_image = self._last_saved[1]
+            if last_image.size == image.size:
+                bbox = ImageChops.difference(image.convert('RGB'), last_image.convert('RGB')).getbbox()
+                if bbox:
+                    area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+                    if area <= self.max_crop_ratio * image.width * image.height:
+                        region = bbox
+
+        if region:
+            buffer = io.BytesIO()
+            image.crop(region).save(buffer, format='PNG')
+            raw = buffer.getvalue()
+            frame['region'] = list(region)
+            frame['base'] = self._last_saved[2]
+            self.counters['cropped'] += 1
+
+        path.write_bytes(raw)
+        self.counters['saved'] += 1
+        self.counters['bytes_written'] += len(raw)
+        frame['path'] = str(path)
+        self.frames.append(frame)
+        # A comparação seguinte usa a imagem completa, mesmo que só a região tenha sido gravada
+        self._last_saved = (frame_hash, image, len(self.frames) - 1)
+        return frame
+
+    async def attach(self, context):
+        """Gancho de contexto: instala o contador de mutações do DOM"""
+        if self.mode == 'adaptive':
+            await context.add_init_script(MUTATION_COUNTER_SCRIPT)
+
+    async def after_step(self, agent):
+        """
+        Gancho de passo: processa o screenshot que o browser_use já tirou para o estado do
+        passo, sem uma segunda captura. Sem visão, só quando a página mudou
+        """
+        import asyncio
+
+        history = getattr(agent, 'history', None)
+        item = history.history[-1] if history is not None and history.history else None
+        state = getattr(item, 'state', None)
+        data = getattr(state, 'screenshot', None)
+        url = getattr(state, 'url', None)
+
+        mutation_count = None
+        if self.mode == 'adaptive' and not self.vision:
+            page = await agent.browser_context.get_current_page()
+            url = url or page.url
+            try:
+                mutation_count = await page.evaluate('window.__agentMutationCount')
+            except Exception:
+                mutation_count = None
+            if not self.should_capture(url, mutation_count):
+                return
+        if data is None:
+            # Estado sem screenshot (passo que falhou antes de obter o estado): capturar o viewport
+            page = await agent.browser_context.get_current_page()
+            url = page.url
+            data = await page.screenshot(type='png')
+        # Decodificação, hash e (se o quadro não for repetido) gravação fora do event loop
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.process, agent.current_step, url, data
+        )
+
+    def saved_paths(self):
+        return [frame['path'] for frame in self.frames if 'path' in frame]
+
+    def stats(self):
+        return {'mode': self.mode, **self.counters, 'frames': self.frames}
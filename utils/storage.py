@@ -0,0 +1,207 @@
+"""
+Armazenamento dos arquivos gerados pelas tarefas (screenshots).
+
+Dois backends, escolhidos por STORAGE_BACKEND:
+- local (padrão): os arquivos ficam no disco. Com STORAGE_DIR, são movidos do
+  diretório temporário para esse diretório (por exemplo, um volume persistente);
+  sem ele, ficam onde foram gravados, como antes.
+- s3: os arquivos são enviados a um bucket S3 ou compatível (MinIO, R2, etc.)
+  por uma fila de uploads em segundo plano (multipart acima de 8 MB), e a tarefa
+  termina sem esperar por eles. A interface exibe as imagens por URLs
+  pré-assinadas: o navegador do usuário baixa direto do bucket, sem passar pelo
+  processo do Streamlit. Após o upload, a cópia local é removida.
+
+O histórico guarda referências: caminhos locais (também os gravados antes desta
+camada existir) ou s3://bucket/chave. Enquanto o upload não termina, a
+referência s3:// é resolvida para o arquivo local no processo que o gravou.
+
+Variáveis de ambiente: STORAGE_BACKEND, STORAGE_DIR, S3_BUCKET, S3_PREFIX,
+S3_ENDPOINT_URL, S3_REGION, STORAGE_URL_EXPIRES e STORAGE_UPLOAD_WORKERS; as
+credenciais seguem a cadeia padrão do boto3 (AWS_ACCESS_KEY_ID, etc.).
+"""
+import os
+import time
+import shutil
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+except ImportError:
+    boto3 = TransferConfig = None
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local').lower()
+STORAGE_DIR = os.environ.get('STORAGE_DIR')
+S3_BUCKET = os.environ.get('S3_BUCKET')
+S3_PREFIX = os.environ.get('S3_PREFIX', 'browser-agent').strip('/')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or None
+S3_REGION = os.environ.get('S3_REGION') or None
+STORAGE_URL_EXPIRES = int(os.environ.get('STORAGE_URL_EXPIRES', 3600))
+STORAGE_UPLOAD_WORKERS = int(os.environ.get('STORAGE_UPLOAD_WORKERS', 4))
+UPLOAD_ATTEMPTS = 3
+
+S3_SCHEME = 's3://'
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+class LocalStorage:
+    """Arquivos no disco local, opcionalmente movidos para um diretório persistente"""
+
+    name = 'local'
+
+    def __init__(self, root=None):
+        self.root = Path(root) if root else None
+
+    def store(self, local_path, key):
+        if self.root is None:
+            return str(local_path)
+        target = self.root / key
+        if Path(local_path).resolve() == target.resolve():
+            return str(target)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(str(local_path), target)
+        return str(target)
+
+    def stats(self):
+        return {'backend': self.name, 'root': str(self.root) if self.root else None}
+
+
+class S3Storage:
+    """Bucket S3 ou compatível, com uploads em segundo plano e URLs pré-assinadas"""
+
+    name = 's3'
+
+    def __init__(self, bucket, prefix=S3_PREFIX, endpoint_url=S3_ENDPOINT_URL, region=S3_REGION,
+                 workers=STORAGE_UPLOAD_WORKERS, url_expires=STORAGE_URL_EXPIRES):
+        if boto3 is None:
+            raise RuntimeError("O backend s3 requer o pacote boto3")
+        if not bucket:
+            raise ValueError("S3_BUCKET não configurado")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.url_expires = url_expires
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        # Uploads acima de 8 MB em partes de 8 MB, enviadas em paralelo pelo boto3
+        self.transfer_config = TransferConfig(multipart_threshold=8 * 1024 * 1024,
+                                              multipart_chunksize=8 * 1024 * 1024)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='storage-upload')
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.counters = {'queued': 0, 'uploaded': 0, 'failed': 0, 'bytes_uploaded': 0}
+
+    def _key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def store(self, local_path, key):
+        """Enfileira o upload e retorna a referência s3:// imediatamente"""
+        object_key = self._key(key)
+        ref = f"{S3_SCHEME}{self.bucket}/{object_key}"
+        with self._lock:
+            self._pending[ref] = str(local_path)
+            self.counters['queued'] += 1
+        self._executor.submit(self._upload, ref, str(local_path), object_key)
+        return ref
+
+    def _upload(self, ref, local_path, object_key):
+        for attempt in range(1, UPLOAD_ATTEMPTS + 1):
+            try:
+                size = os.path.getsize(local_path)
+                self.client.upload_file(
+                    local_path, self.bucket, object_key,
+                    ExtraArgs={'ContentType': 'image/png' if local_path.endswith('.png') else 'application/octet-stream'},
+                    Config=self.transfer_config
+                )
+                break
+            except Exception as e:
+                if attempt == UPLOAD_ATTEMPTS:
+                    # A cópia local é mantida: continua visível neste processo
+                    logger.error(f"Erro ao enviar {local_path} para o armazenamento: {e}")
+                    with self._lock:
+                        self.counters['failed'] += 1
+                    return
+                time.sleep(2 ** attempt)
+        with self._lock:
+            self._pending.pop(ref, None)
+            self.counters['uploaded'] += 1
+            self.counters['bytes_uploaded'] += size
+        try:
+            os.remove(local_path)
+        except OSError:
+            pass
+
+    def url(self, ref):
+        """URL para exibição: arquivo local enquanto o upload não termina, senão URL pré-assinada"""
+        with self._lock:
+            local_path = self._pending.get(ref)
+        if local_path and os.path.exists(local_path):
+            return local_path
+        bucket, _, object_key = ref[len(S3_SCHEME):].partition('/')
+        try:
+            return self.client.generate_presigned_url(
+                'get_object', Params={'Bucket': bucket, 'Key': object_key}, ExpiresIn=self.url_expires
+            )
+        except Exception as e:
+            logger.error(f"Erro ao gerar URL para {ref}: {e}")
+            return None
+
+    def stats(self):
+        with self._lock:
+            return {'backend': self.name, 'bucket': self.bucket, 'pending': len(self._pending), **self.counters}
+
+
+def get_storage():
+    """Backend configurado para o processo"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if STORAGE_BACKEND == 's3':
+                _backend = S3Storage(S3_BUCKET)
+            else:
+                _backend = LocalStorage(STORAGE_DIR)
+            logger.info(f"Armazenamento de arquivos: {_backend.name}")
+        return _backend
+
+
+def store_screenshots(task_id, result):
+    """
+    Envia os screenshots da tarefa ao armazenamento e troca, no resultado, os caminhos
+    locais pelas referências (inclusive nos quadros das métricas de screenshots)
+    """
+    paths = result.get('screenshots') or []
+    if not paths:
+        return []
+    storage = get_storage()
+    refs = {}
+    for path in paths:
+        if not os.path.exists(path):
+            refs[path] = path
+            continue
+        try:
+            refs[path] = storage.store(path, f"{task_id}/screenshots/{Path(path).name}")
+        except Exception as e:
+            logger.error(f"Erro ao armazenar screenshot {path}: {e}")
+            refs[path] = path
+    result['screenshots'] = [refs[path] for path in paths]
+    screenshot_metrics = (result.get('metrics') or {}).get('screenshots') or {}
+    for frame in screenshot_metrics.get('frames', []):
+        if frame.get('path') in refs:
+            frame['path'] = refs[frame['path']]
+    return result['screenshots']
+
+
+def resolve_url(ref):
+    """URL ou caminho local para exibir uma referência; None se o arquivo não estiver disponível"""
+    if ref.startswith(S3_SCHEME):
+        storage = get_storage()
+        if not isinstance(storage, S3Storage):
+            logger.warning(f"Referência {ref} exige o backend s3")
+            return None
+        return storage.url(ref)
+    return ref if os.path.exists(ref) else None
@@ -0,0 +1,178 @@
+"""
+Decomposição de instruções em subtarefas independentes executadas em paralelo.
+
+Uma etapa de planejamento pede ao LLM que divida a instrução em subtarefas que
+não dependem umas das outras ("verificar o preço nos sites A, B e C"). Cada
+subtarefa roda com seu próprio agente em um contexto de navegador separado
+(no mesmo processo do Chromium), com no máximo `subtask_concurrency` agentes
+simultâneos; o tempo total tende ao da subtarefa mais lenta. Os históricos são
+combinados em um MergedHistory, com a mesma interface do AgentHistoryList usada
+por run_agent_task, e as respostas finais são reunidas em uma só.
+
+Instruções que o planejador não divide, ou cujo planejamento falha, seguem o
+caminho normal com um único agente.
+"""
+import re
+import json
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+PLANNER_PROMPT = (
+    "Você divide instruções de automação de navegador em subtarefas independentes, que possam ser "
+    "executadas em paralelo por agentes diferentes, cada um com o seu próprio navegador.\n"
+    "Divida apenas quando as partes não dependem umas das outras (por exemplo, consultar vários sites "
+    "diferentes). Se uma parte precisa do resultado de outra, ou se a instrução é uma sequência de "
+    "passos no mesmo site, não divida.\n"
+    "Cada subtarefa deve ser autocontida: repita nela o contexto necessário (o que procurar, o formato "
+    "da resposta), pois o agente não verá a instrução original.\n"
+    "Responda apenas com JSON no formato {{\"subtasks\": [\"...\", \"...\"]}}, com no máximo {max_subtasks} "
+    "subtarefas, ou {{\"subtasks\": []}} se a instrução não deve ser dividida."
+)
+
+
+def parse_subtasks(text, max_subtasks):
+    """Extrai a lista de subtarefas da resposta do planejador (lista vazia se não houver divisão)"""
+    match = re.search(r'\{.*\}', text or '', re.DOTALL)
+    if not match:
+        return []
+    try:
+        data = json.loads(match.group(0))
+    except ValueError:
+        return []
+    subtasks = data.get('subtasks') if isinstance(data, dict) else None
+    if not isinstance(subtasks, list):
+        return []
+    subtasks = [str(item).strip() for item in subtasks if str(item).strip()][:max_subtasks]
+    # Uma única subtarefa equivale à instrução original
+    return subtasks if len(subtasks) > 1 else []
+
+
+async def plan_subtasks(llm, task_instructions, max_subtasks=4):
+    """Pede ao LLM a divisão da instrução; retorna [] se ela deve rodar com um único agente"""
+    from langchain_core.messages import SystemMessage, HumanMessage
+    from utils.llm_control import llm_call_scope
+
+    try:
+        with llm_call_scope('planning'):
+            response = await llm.ainvoke([
+                SystemMessage(content=PLANNER_PROMPT.format(max_subtasks=max_subtasks)),
+                HumanMessage(content=task_instructions),
+            ])
+    except Exception as e:
+        logger.warning(f"Erro no planejamento de subtarefas; executando com um único agente: {e}")
+        return []
+    content = response.content if isinstance(response.content, str) else json.dumps(response.content)
+    subtasks = parse_subtasks(content, max_subtasks)
+    if subtasks:
+        logger.info(f"Instrução dividida em {len(subtasks)} subtarefas independentes")
+    return subtasks
+
+
+class MergedHistory:
+    """Históricos das subtarefas combinados com a interface do AgentHistoryList"""
+
+    def __init__(self, subtasks, histories, errors, durations):
+        self.subtasks = subtasks
+        self.histories = histories  # None para subtarefas que falharam
+        self.branch_errors = errors  # mensagem de erro ou None, por subtarefa
+        self.durations = durations
+
+    def _completed(self):
+        return [(i, history) for i, history in enumerate(self.histories) if history is not None]
+
+    @property
+    def history(self):
+        return [item for _, history in self._completed() for item in history.history]
+
+    def final_result(self):
+        parts = []
+        for i, subtask in enumerate(self.subtasks):
+            history = self.histories[i]
+            if history is None:
+                answer = f"Erro: {self.branch_errors[i]}"
+            else:
+                answer = history.final_result() or "(sem resultado)"
+            parts.append(f"[{i + 1}] {subtask}\n{answer}")
+        return '\n\n'.join(parts)
+
+    def model_actions(self):
+        return [{**action, 'subtask': i + 1} for i, history in self._completed() for action in history.model_actions()]
+
+    def urls(self):
+        return [url for _, history in self._completed() for url in history.urls()]
+
+    def extracted_content(self):
+        return [content for _, history in self._completed() for content in history.extracted_content()]
+
+    def errors(self):
+        errors = [error for _, history in self._completed() for error in history.errors()]
+        return errors + [f"Subtarefa {i + 1}: {error}" for i, error in enumerate(self.branch_errors) if error]
+
+    def is_done(self):
+        return all(history is not None and history.is_done() for history in self.histories)
+
+    def has_errors(self):
+        return any(self.branch_errors) or any(history.has_errors() for _, history in self._completed())
+
+    def stats(self):
+        return [
+            {
+                'subtask': i + 1,
+                'instruction': subtask,
+                'is_done': self.histories[i] is not None and self.histories[i].is_done(),
+                'steps': len(self.histories[i].history) if self.histories[i] is not None else 0,
+                'duration': self.durations[i],
+                'error': self.branch_errors[i],
+            }
+            for i, subtask in enumerate(self.subtasks)
+        ]
+
+
+class SubtaskRunner:
+    """
+    Executa as subtarefas em paralelo, um agente por contexto de navegador.
+
+    `make_context(index)` cria o contexto de cada subtarefa e `make_agent(instructions, context)`
+    o agente. Os contextos são fechados ao final de cada subtarefa, exceto `shared_context`
+    (o contexto principal da tarefa, fechado por quem o criou).
+    """
+
+    def __init__(self, subtasks, make_context, make_agent, concurrency=3, shared_context=None):
+        self.subtasks = subtasks
+        self.make_context = make_context
+        self.make_agent = make_agent
+        self.concurrency = max(1, int(concurrency))
+        self.shared_context = shared_context
+
+    async def _run_one(self, index, semaphore, results):
+        async with semaphore:
+            started = time.monotonic()
+            context = None
+            try:
+                context = await self.make_context(index)
+                agent = self.make_agent(self.subtasks[index], context)
+                results['histories'][index] = await agent.run()
+                logger.info(f"Subtarefa {index + 1} concluída em {time.monotonic() - started:.1f}s")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Erro na subtarefa {index + 1}: {e}")
+                results['errors'][index] = str(e)
+            finally:
+                results['durations'][index] = round(time.monotonic() - started, 2)
+                if context is not None and context is not self.shared_context:
+                    try:
+                        await context.close()
+                    except Exception as e:
+                        logger.warning(f"Erro ao fechar o contexto da subtarefa {index + 1}: {e}")
+
+    async def run(self):
+        count = len(self.subtasks)
+        results = {'histories': [None] * count, 'errors': [None] * count, 'durations': [None] * count}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # Cancelar run() (teto de memória) cancela todas as subtarefas em andamento
+        await asyncio.gather(*(self._run_one(i, semaphore, results) for i in range(count)))
+        return MergedHistory(self.subtasks, results['histories'], results['errors'], results['durations'])
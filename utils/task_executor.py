@@ -0,0 +1,555 @@
+"""
+Execução de tarefas fora da interface: tarefas avulsas e lotes criados a partir de CSV.
+
+Cada tarefa roda em uma thread com seu próprio event loop (o mesmo modelo da
+execução pela página de detalhes). Os lotes usam um pool de threads com o
+limite de concorrência do lote, para que centenas de tarefas não abram
+centenas de navegadores ao mesmo tempo.
+"""
+import os
+import json
+import hashlib
+import logging
+import asyncio
+import threading
+from string import Formatter
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from db.database import get_db_session
+from db.models import Task, TaskHistory, ApiKey, Batch
+from utils.helpers import generate_unique_id
+from utils.logging_config import task_log_context, compress_logs
+from utils.webhooks import notify_task_event, build_subscription, get_default_secret
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_CONCURRENCY = 2
+MAX_BATCH_CONCURRENCY = 16
+
+# Envios idênticos da mesma sessão dentro desta janela são tratados como o mesmo pedido
+
+# Tarefas avulsas executadas ao mesmo tempo por processo (start_task)
+MAX_CONCURRENT_TASKS = int(os.environ.get('MAX_CONCURRENT_TASKS', 4))
+
+# Lotes com execução em andamento neste processo
+_running_batches = set()
+_running_lock = threading.Lock()
+_task_pool = None
+
+
+def load_api_keys():
+    with get_db_session() as session:
+        return {key.provider: key.api_key for key in session.query(ApiKey).all()}
+
+
+def load_browser_config(api_keys=None):
+    """Configuração do navegador salva na página de Configuração"""
+    api_keys = api_keys if api_keys is not None else load_api_keys()
+    try:
+        return json.loads(api_keys['browser_config']) if api_keys.get('browser_config') else {}
+    except ValueError:
+        return {}
+
+
+def build_llm_info(llm_provider, llm_model, api_keys):
+    """Monta as informações do LLM (chave, limites de requisição e hedging) para o provedor da tarefa"""
+    llm_info = {
+        'provider': llm_provider,
+        'model': llm_model,
+        'api_key': api_keys.get(llm_provider, ''),
+    }
+    if llm_provider == 'azure':
+        llm_info['endpoint'] = api_keys.get('azure_endpoint', '')
+
+    # Limites de requisição configurados para o provedor
+    llm_config = json.loads(api_keys['llm_config']) if api_keys.get('llm_config') else {}
+    llm_info['rate_limits'] = llm_config.get('rate_limits', {}).get(llm_provider)
+
+    # Hedging: o fallback usa a chave configurada para o seu provedor
+    hedge_config = dict(llm_config.get('hedge', {}))
+    if hedge_config.get('enabled'):
+        fallback_provider = hedge_config.get('fallback_provider') or llm_provider
+        hedge_config['fallback_api_key'] = api_keys.get(fallback_provider, '')
+        if fallback_provider == 'azure':
+            hedge_config['fallback_endpoint'] = api_keys.get('azure_endpoint', '')
+        llm_info['hedge'] = hedge_config
+    return llm_info
+
+
+def make_idempotency_key(*parts):
+    """
+    Chave de idempotência (hash de tamanho fixo) a partir do identificador do envio.
+
+    As partes identificam o envio, e não o seu conteúdo: na interface, o nonce do
+    formulário, trocado após cada envio bem-sucedido; na API, a chave do cliente.
+    """
+    payload = json.dumps(list(parts), sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def create_task(instruction, llm_provider, llm_model, settings, idempotency_key=None,
+                webhook_url=None, webhook_events=None, webhook_secret=None):
+    """
+    Cria a tarefa e retorna (task_id, criada). Se já existir uma tarefa com a mesma chave
+    de idempotência, nenhuma tarefa é criada e o id da existente é retornado.
+    Com `webhook_url`, a assinatura da tarefa é criada na mesma transação.
+    """
+    if idempotency_key:
+        with get_db_session() as session:
+            existing = session.query(Task.id).filter(Task.idempotency_key == idempotency_key).scalar()
+        if existing:
+            return existing, False
+
+    task_id = generate_unique_id()
+    if webhook_url and not webhook_secret:
+        # Lido (ou gerado) antes da transação, em sua própria sessão
+        webhook_secret = get_default_secret()
+    try:
+        with get_db_session() as session:
+            session.add(Task(
+                id=task_id,
+                task=instruction,
+                status='created',
+                created_at=datetime.now(),
+                llm_provider=llm_provider,
+                llm_model=llm_model,
+                settings=json.dumps(settings),
+                idempotency_key=idempotency_key
+            ))
+            if webhook_url:
+                session.add(build_subscription(webhook_url, task_id=task_id, events=webhook_events,
+                                               secret=webhook_secret))
+    except IntegrityError:
+        # Outro envio com a mesma chave venceu a corrida entre a consulta e a inserção
+        if not idempotency_key:
+            raise
+        with get_db_session() as session:
+            existing = session.query(Task.id).filter(Task.idempotency_key == idempotency_key).scalar()
+        logger.info(f"Envio duplicado ignorado; tarefa existente {existing}")
+        return existing, False
+    return task_id, True
+
+
+def create_tasks(items):
+    """
+    Cria várias tarefas em uma única transação. Cada item tem instruction, llm_provider,
+    llm_model, settings e, opcionalmente, idempotency_key e webhook_url/webhook_events (a
+    assinatura da tarefa é criada na mesma transação). Retorna [(task_id, criada)] na ordem dos itens.
+    """
+    keys = [item['idempotency_key'] for item in items if item.get('idempotency_key')]
+    # O segredo padrão é lido (ou gerado) antes da transação, em sua própria sessão
+    webhook_secret = get_default_secret() if any(item.get('webhook_url') for item in items) else None
+    results = []
+    try:
+        with get_db_session() as session:
+            known = dict(session.query(Task.idempotency_key, Task.id).filter(Task.idempotency_key.in_(keys))) if keys else {}
+            for item in items:
+                key = item.get('idempotency_key')
+                if key and key in known:
+                    results.append((known[key], False))
+                    continue
+                task_id = generate_unique_id()
+                session.add(Task(
+                    id=task_id,
+                    task=item['instruction'],
+                    status='created',
+                    created_at=datetime.now(),
+                    llm_provider=item['llm_provider'],
+                    llm_model=item['llm_model'],
+                    settings=json.dumps(item.get('settings') or {}),
+                    idempotency_key=key
+                ))
+                if item.get('webhook_url'):
+                    session.add(build_subscription(item['webhook_url'], task_id=task_id,
+                                                   events=item.get('webhook_events'), secret=webhook_secret))
+                if key:
+                    known[key] = task_id
+                results.append((task_id, True))
+    except IntegrityError:
+        # Uma chave foi usada por outro envio durante a transação: criar um a um
+        return [
+            create_task(item['instruction'], item['llm_provider'], item['llm_model'], item.get('settings') or {},
+                        idempotency_key=item.get('idempotency_key'), webhook_url=item.get('webhook_url'),
+                        webhook_events=item.get('webhook_events'), webhook_secret=webhook_secret)
+            for item in items
+        ]
+    return results
+
+
+def claim_task(task_id):
+    """
+    Transição atômica created -> running. Retorna True apenas para o único chamador que
+    conseguiu reivindicar a tarefa, entre sessões e processos.
+    """
+    from utils.checkpoints import WORKER_ID
+
+    with get_db_session() as session:
+        claimed = session.query(Task).filter(Task.id == task_id, Task.status == 'created').update(
+            {'status': 'running', 'heartbeat_at': datetime.now(), 'worker_id': WORKER_ID},
+            synchronize_session=False
+        )
+    if claimed == 1:
+        notify_task_event(task_id, 'running')
+    return claimed == 1
+
+
+def save_task_result(task_id, result):
+    """Grava o status, a saída e o histórico detalhado da tarefa"""
+    from utils.storage import store_screenshots
+
+    # Screenshots vão para o armazenamento configurado (disco ou S3) antes de serem referenciados no histórico
+    store_screenshots(task_id, result)
+    with get_db_session() as session:
+        task = session.query(Task).filter(Task.id == task_id).first()
+        task.status = result['status']
+        task.finished_at = datetime.now() if result['status'] in ['finished', 'failed'] else None
+        task.output = result.get('output', '')
+
+        history_fields = {
+            'steps': json.dumps(result.get('steps', [])),
+            'urls': json.dumps(result.get('urls', [])),
+            'screenshots': json.dumps(result.get('screenshots', [])),
+            'errors': json.dumps(result.get('errors', [])),
+            'metrics': json.dumps(result.get('metrics', {})),
+            'extracted_content': json.dumps(result.get('extracted_content', [])),
+            'logs': compress_logs(result['logs']) if result.get('logs') else None,
+        }
+        task_history = session.query(TaskHistory).filter(TaskHistory.task_id == task_id).first()
+        if task_history:
+            for field, value in history_fields.items():
+                setattr(task_history, field, value)
+        else:
+            session.add(TaskHistory(task_id=task_id, **history_fields))
+    notify_task_event(task_id, result['status'], output=result.get('output'))
+
+
+async def execute_task(task_id, browser_config=None, resume=False, claimed=False):
+    """
+    Executa uma tarefa já criada e grava o resultado no banco de dados.
+    
+    A tarefa só é executada se este chamador conseguir reivindicá-la (created -> running);
+    com `claimed`, a reivindicação já foi feita com claim_task. Com `resume`, a execução
+    continua a partir do último checkpoint da tarefa (ver utils/checkpoints.py).
+    """
+    from utils.agent_runner import run_agent_task
+    from utils.checkpoints import load_checkpoint, delete_checkpoint, register_running_task, unregister_running_task
+
+    if not (resume or claimed) and not claim_task(task_id):
+        logger.warning(f"Tarefa {task_id} não executada: inexistente ou já iniciada por outro executor")
+        return {"error": "Tarefa não encontrada ou já iniciada"}
+
+    api_keys = load_api_keys()
+
+    # Obter os dados da tarefa
+    with get_db_session() as session:
+        task = session.query(Task).filter(Task.id == task_id).first()
+        if not task:
+            return {"error": "Tarefa não encontrada"}
+
+        task_data = {
+            'task': task.task,
+            'llm_provider': task.llm_provider,
+            'llm_model': task.llm_model,
+            'settings': json.loads(task.settings) if task.settings else {}
+        }
+
+    if browser_config is None:
+        browser_config = load_browser_config(api_keys)
+
+    checkpoint = load_checkpoint(task_id) if resume else None
+    if not resume:
+        # Checkpoint de uma execução anterior não vale para uma nova execução
+        delete_checkpoint(task_id)
+
+    # Os logs emitidos durante a execução são marcados com o task_id e gravados no histórico
+    register_running_task(task_id)
+    try:
+        with task_log_context(task_id) as task_logs:
+            result = await run_agent_task(
+                task_id=task_id,
+                task_instructions=task_data['task'],
+                llm=build_llm_info(task_data['llm_provider'], task_data['llm_model'], api_keys),
+                browser_config=browser_config,
+                agent_settings=task_data['settings'],
+                checkpoint=checkpoint
+            )
+        result['logs'] = task_logs.records
+        save_task_result(task_id, result)
+        delete_checkpoint(task_id)
+    finally:
+        unregister_running_task(task_id)
+    return result
+
+
+def execute_task_blocking(task_id, browser_config=None, resume=False, claimed=False):
+    """Executa a tarefa em um event loop novo na thread atual"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(execute_task(task_id, browser_config, resume=resume, claimed=claimed))
+    except Exception as e:
+        logger.error(f"Erro ao executar tarefa {task_id}: {e}")
+        output = None
+        with get_db_session() as session:
+            task = session.query(Task).filter(Task.id == task_id).first()
+            if task and task.status == 'running':
+                task.status = 'failed'
+                task.finished_at = datetime.now()
+                task.output = output = f"Erro: {e}"
+        # Notificar só depois do commit: o receptor pode consultar a tarefa ao receber o evento
+        if output is not None:
+            notify_task_event(task_id, 'failed', output=output)
+        return {"error": str(e)}
+    finally:
+        loop.close()
+
+
+def start_task(task_id, browser_config=None):
+    """
+    Agenda a execução da tarefa no pool do processo (até MAX_CONCURRENT_TASKS simultâneas).
+    A tarefa continua 'created' na fila e é reivindicada quando um executor fica livre.
+    """
+    global _task_pool
+    with _running_lock:
+        if _task_pool is None:
+            _task_pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_TASKS, thread_name_prefix='task')
+    return _task_pool.submit(execute_task_blocking, task_id, browser_config)
+
+
+def template_fields(template):
+    """
+    Nomes dos marcadores {coluna} usados no modelo de instrução. Levanta ValueError para
+    marcadores com acesso a atributo ou índice ({produto.nome}, {a[0]}), que o format trataria
+    como expressões em vez de nomes de coluna
+    """
+    fields = [field for _, field, _, _ in Formatter().parse(template) if field is not None]
+    invalid = [field for field in fields if not field or '.' in field or '[' in field]
+    if invalid:
+        raise ValueError(f"Marcadores inválidos: {', '.join('{' + field + '}' for field in invalid)}")
+    return fields
+
+
+def render_template(template, row):
+    """Substitui os marcadores pelos valores da linha ({{ e }} produzem chaves literais)"""
+    template_fields(template)
+    try:
+        return template.format_map({key: '' if value is None else str(value) for key, value in row.items()})
+    except KeyError as e:
+        raise ValueError(f"Coluna ausente: {e}")
+
+
+def create_batch(template, rows, llm_provider, llm_model, settings, concurrency=DEFAULT_BATCH_CONCURRENCY, name=None):
+    """Cria o lote e todas as suas tarefas em uma única inserção em massa"""
+    missing = [field for field in template_fields(template) if rows and field not in rows[0]]
+    if missing:
+        raise ValueError(f"Colunas ausentes no CSV: {', '.join(missing)}")
+
+    batch_id = generate_unique_id()
+    now = datetime.now()
+    settings_json = json.dumps(settings)
+    task_rows = [
+        {
+            'id': generate_unique_id(),
+            'task': render_template(template, row),
+            'status': 'created',
+            'created_at': now,
+            'llm_provider': llm_provider,
+            'llm_model': llm_model,
+            'settings': settings_json,
+            'batch_id': batch_id,
+            'batch_index': index,
+            'batch_row': json.dumps(row),
+        }
+        for index, row in enumerate(rows)
+    ]
+
+    with get_db_session() as session:
+        session.add(Batch(
+            id=batch_id,
+            name=name,
+            kind='csv',
+            template=template,
+            status='created',
+            created_at=now,
+            concurrency=concurrency,
+            total_tasks=len(task_rows)
+        ))
+        session.flush()
+        session.bulk_insert_mappings(Task, task_rows)
+
+    logger.info(f"Lote {batch_id} criado com {len(task_rows)} tarefas")
+    return batch_id
+
+
+def create_ab_batch(instruction, models, settings, repetitions=1, name=None):
+    """
+    Cria um lote A/B: a mesma instrução para cada par (provedor, modelo), todos
+    executados ao mesmo tempo em navegadores isolados
+    """
+    if not models:
+        raise ValueError("Selecione ao menos um modelo")
+
+    # Isolamento entre as execuções: sem perfil persistente compartilhado e sem
+    # macros (o replay de uma execução aceleraria as seguintes e distorceria a comparação)
+    settings = {**settings, 'profile_name': None, 'use_macros': False, 'network_mode': 'live'}
+    settings_json = json.dumps(settings)
+
+    batch_id = generate_unique_id()
+    now = datetime.now()
+    task_rows = []
+    for repetition in range(1, repetitions + 1):
+        for provider, model in models:
+            task_rows.append({
+                'id': generate_unique_id(),
+                'task': instruction,
+                'status': 'created',
+                'created_at': now,
+                'llm_provider': provider,
+                'llm_model': model,
+                'settings': settings_json,
+                'batch_id': batch_id,
+                'batch_index': len(task_rows),
+                'batch_row': json.dumps({'provider': provider, 'model': model, 'repetition': repetition}),
+            })
+
+    with get_db_session() as session:
+        session.add(Batch(
+            id=batch_id,
+            name=name,
+            kind='ab',
+            template=instruction,
+            status='created',
+            created_at=now,
+            concurrency=min(len(task_rows), MAX_BATCH_CONCURRENCY),
+            total_tasks=len(task_rows)
+        ))
+        session.flush()
+        session.bulk_insert_mappings(Task, task_rows)
+
+    logger.info(f"Lote A/B {batch_id} criado: {len(models)} modelos x {repetitions} repetições")
+    return batch_id
+
+
+def get_ab_comparison(batch_id):
+    """
+    Métricas por execução de um lote A/B: tempo total, passos, tokens, latência
+    média do LLM e sucesso (tarefa concluída pelo agente)
+    """
+    with get_db_session() as session:
+        rows = (
+            session.query(Task.llm_provider, Task.llm_model, Task.status, TaskHistory.metrics)
+            .outerjoin(TaskHistory, TaskHistory.task_id == Task.id)
+            .filter(Task.batch_id == batch_id)
+            .order_by(Task.batch_index)
+            .all()
+        )
+
+    runs = []
+    for provider, model, status, metrics_json in rows:
+        metrics = json.loads(metrics_json) if metrics_json else {}
+        llm = metrics.get('llm') or {}
+        runs.append({
+            'provider': provider,
+            'model': model,
+            'status': status,
+            'success': status == 'finished' and bool(metrics.get('is_done')),
+            'wall_time': metrics.get('wall_time'),
+            'steps': metrics.get('agent_steps'),
+            'input_tokens': llm.get('input_tokens'),
+            'output_tokens': llm.get('output_tokens'),
+            'llm_calls': llm.get('calls'),
+            'llm_latency_mean': llm.get('latency_mean'),
+        })
+    return runs
+
+
+def _run_batch(batch_id, concurrency, browser_config):
+    try:
+        with get_db_session() as session:
+            task_ids = [
+                task_id for (task_id,) in session.query(Task.id)
+                .filter(Task.batch_id == batch_id, Task.status == 'created')
+                .order_by(Task.batch_index)
+            ]
+            batch = session.query(Batch).filter(Batch.id == batch_id).first()
+            batch.status = 'running'
+
+        logger.info(f"Executando lote {batch_id}: {len(task_ids)} tarefas, concorrência {concurrency}")
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"batch-{batch_id[:8]}") as pool:
+            list(pool.map(lambda task_id: execute_task_blocking(task_id, browser_config), task_ids))
+
+        with get_db_session() as session:
+            batch = session.query(Batch).filter(Batch.id == batch_id).first()
+            batch.status = 'finished'
+            batch.finished_at = datetime.now()
+        logger.info(f"Lote {batch_id} concluído")
+    except Exception as e:
+        # Sem isso o lote ficaria 'running' para sempre; as tarefas pendentes podem ser executadas de novo
+        logger.exception(f"Erro ao executar o lote {batch_id}: {e}")
+        try:
+            with get_db_session() as session:
+                batch = session.query(Batch).filter(Batch.id == batch_id).first()
+                if batch:
+                    batch.status = 'failed'
+                    batch.finished_at = datetime.now()
+        except Exception as db_error:
+            logger.error(f"Erro ao marcar o lote {batch_id} como falho: {db_error}")
+    finally:
+        with _running_lock:
+            _running_batches.discard(batch_id)
+
+
+def start_batch(batch_id, concurrency=None, browser_config=None):
+    """Inicia a execução das tarefas pendentes do lote em segundo plano; retorna False se já estiver rodando"""
+    with _running_lock:
+        if batch_id in _running_batches:
+            return False
+        _running_batches.add(batch_id)
+
+    if concurrency is None:
+        with get_db_session() as session:
+            concurrency = session.query(Batch.concurrency).filter(Batch.id == batch_id).scalar()
+    concurrency = max(1, min(int(concurrency or DEFAULT_BATCH_CONCURRENCY), MAX_BATCH_CONCURRENCY))
+
+    thread = threading.Thread(target=_run_batch, args=(batch_id, concurrency, browser_config), daemon=True)
+    thread.start()
+    return True
+
+
+def is_batch_running(batch_id):
+    with _running_lock:
+        return batch_id in _running_batches
+
+
+def get_batch_progress(batch_id):
+    """Contagem das tarefas do lote por status"""
+    with get_db_session() as session:
+        counts = dict(
+            session.query(Task.status, func.count(Task.id))
+            .filter(Task.batch_id == batch_id)
+            .group_by(Task.status)
+            .all()
+        )
+    total = sum(counts.values())
+    done = counts.get('finished', 0) + counts.get('failed', 0)
+    return {'total': total, 'done': done, 'counts': counts}
+
+
+def get_batch_results(batch_id):
+    """Resultados por linha do lote: valores da linha, status e saída de cada tarefa"""
+    with get_db_session() as session:
+        tasks = (
+            session.query(Task.id, Task.batch_row, Task.status, Task.output, Task.finished_at)
+            .filter(Task.batch_id == batch_id)
+            .order_by(Task.batch_index)
+            .all()
+        )
+        results = []
+        for task_id, batch_row, status, output, finished_at in tasks:
+            row = json.loads(batch_row) if batch_row else {}
+            results.append({**row, 'task_id': task_id, 'status': status, 'output': output, 'finished_at': finished_at})
+    return results
@@ -0,0 +1,340 @@
+"""
+Notificações de mudança de status das tarefas por webhook.
+
+Assinaturas (tabela webhook_subscriptions) valem para uma tarefa ou, sem
+task_id, para todas, e escolhem os eventos: running, finished e failed.
+notify_task_event apenas enfileira as entregas; uma thread despachante as
+envia por POST em segundo plano, com novas tentativas e espera exponencial em
+erros de rede, 5xx, 408 e 429. Quem emite o evento (a execução da tarefa)
+nunca espera pelo receptor. Os eventos são emitidos após a gravação do novo
+status no banco.
+
+Cada entrega é um JSON assinado com HMAC-SHA256 sobre "<timestamp>.<corpo>",
+com o segredo da assinatura:
+    X-Webhook-Id: id da entrega (o mesmo em todas as tentativas)
+    X-Webhook-Event: task.finished, task.failed, ...
+    X-Webhook-Timestamp: segundos desde a época
+    X-Webhook-Signature: sha256=<hex>
+O receptor pode validar com verify_signature.
+
+Variáveis de ambiente: WEBHOOK_TIMEOUT, WEBHOOK_MAX_ATTEMPTS,
+WEBHOOK_BACKOFF_BASE e WEBHOOK_WORKERS.
+"""
+import os
+import hmac
+import json
+import time
+import heapq
+import random
+import hashlib
+import logging
+import secrets
+import itertools
+import threading
+import urllib.error
+import urllib.request
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_EVENTS = ['running', 'finished', 'failed']
+DEFAULT_EVENTS = ['finished', 'failed']
+WEBHOOK_TIMEOUT = float(os.environ.get('WEBHOOK_TIMEOUT', 10))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 6))
+WEBHOOK_BACKOFF_BASE = float(os.environ.get('WEBHOOK_BACKOFF_BASE', 2))
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 4))
+# Tamanho máximo da saída da tarefa incluída no corpo do evento
+MAX_OUTPUT_CHARS = 4000
+
+RETRYABLE_STATUS = {408, 429}
+
+
+def sign_payload(secret, timestamp, body):
+    """Assinatura HMAC-SHA256 de "<timestamp>.<corpo>" em hexadecimal"""
+    message = f"{timestamp}.".encode('utf-8') + body
+    return hmac.new(secret.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+
+def verify_signature(secret, timestamp, body, signature, tolerance=300):
+    """Valida o cabeçalho X-Webhook-Signature; rejeita timestamps fora da tolerância (replay)"""
+    try:
+        if abs(time.time() - int(timestamp)) > tolerance:
+            return False
+    except (TypeError, ValueError):
+        return False
+    expected = 'sha256=' + sign_payload(secret, timestamp, body)
+    return hmac.compare_digest(expected, signature or '')
+
+
+class WebhookDispatcher:
+    """Fila de entregas com agendamento das novas tentativas, enviada por um pool de threads"""
+
+    def __init__(self, workers=WEBHOOK_WORKERS, max_attempts=WEBHOOK_MAX_ATTEMPTS,
+                 backoff_base=WEBHOOK_BACKOFF_BASE, timeout=WEBHOOK_TIMEOUT):
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.timeout = timeout
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='webhook')
+        self._thread = None
+        self.counters = {'queued': 0, 'delivered': 0, 'retried': 0, 'failed': 0}
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='webhook-dispatcher', daemon=True)
+            self._thread.start()
+
+    def enqueue(self, delivery, delay=0.0):
+        with self._condition:
+            self._ensure_started()
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence), delivery))
+            self.counters['queued'] += 1
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._condition.wait(timeout)
+                _, _, delivery = heapq.heappop(self._heap)
+                self._in_flight += 1
+            self._executor.submit(self._deliver, delivery)
+
+    def _count(self, name):
+        with self._condition:
+            self.counters[name] += 1
+
+    def _deliver(self, delivery):
+        try:
+            delivery['attempts'] += 1
+            ok, retryable, status = self._send(delivery)
+            if ok:
+                self._count('delivered')
+                _record_delivery(delivery['subscription_id'], status, success=True)
+            elif retryable and delivery['attempts'] < self.max_attempts:
+                # Espera exponencial com jitter: 2, 4, 8, 16... segundos
+                delay = self.backoff_base ** delivery['attempts'] * random.uniform(0.8, 1.2)
+                logger.info(f"Webhook {delivery['id']} falhou ({status}); nova tentativa em {delay:.0f}s")
+                self._count('retried')
+                self.enqueue(delivery, delay)
+            else:
+                logger.warning(f"Webhook {delivery['id']} para {delivery['url']} descartado após "
+                               f"{delivery['attempts']} tentativa(s): {status}")
+                self._count('failed')
+                _record_delivery(delivery['subscription_id'], status, success=False)
+        except Exception as e:
+            logger.exception(f"Erro ao entregar webhook {delivery.get('id')}: {e}")
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    def _send(self, delivery):
+        """Envia a entrega; retorna (sucesso, pode repetir, descrição do status)"""
+        timestamp = str(int(time.time()))
+        body = delivery['body']
+        request = urllib.request.Request(delivery['url'], data=body, method='POST', headers={
+            'Content-Type': 'application/json',
+            'User-Agent': 'browser-agent-webhooks',
+            'X-Webhook-Id': delivery['id'],
+            'X-Webhook-Event': delivery['event'],
+            'X-Webhook-Timestamp': timestamp,
+            'X-Webhook-Signature': 'sha256=' + sign_payload(delivery['secret'], timestamp, body),
+        })
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return True, False, f"HTTP {response.status}"
+        except urllib.error.HTTPError as e:
+            return False, e.code >= 500 or e.code in RETRYABLE_STATUS, f"HTTP {e.code}"
+        except (OSError, ValueError) as e:
+            return False, True, str(e)[:200]
+
+    def wait(self, timeout=10.0):
+        """Espera as entregas pendentes (inclusive novas tentativas); False se o tempo acabar"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._heap or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(min(remaining, 0.5))
+        return True
+
+    def stats(self):
+        with self._condition:
+            return {'pending': len(self._heap) + self._in_flight, **self.counters}
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = WebhookDispatcher()
+        return _dispatcher
+
+
+def _record_delivery(subscription_id, status, success):
+    from db.database import get_db_session
+    from db.models import WebhookSubscription
+
+    with get_db_session() as session:
+        subscription = session.query(WebhookSubscription).filter(WebhookSubscription.id == subscription_id).first()
+        if subscription is None:
+            return
+        subscription.last_delivery_at = datetime.now()
+        subscription.last_status = status[:200]
+        subscription.failure_count = 0 if success else (subscription.failure_count or 0) + 1
+
+
+def get_default_secret():
+    """Segredo padrão das assinaturas, gerado no primeiro uso e guardado com as configurações"""
+    from db.database import get_db_session
+    from db.models import ApiKey
+
+    with get_db_session() as session:
+        key = session.query(ApiKey).filter(ApiKey.provider == 'webhook_secret').first()
+        if key is None:
+            key = ApiKey(provider='webhook_secret', api_key=secrets.token_hex(32))
+            session.add(key)
+        return key.api_key
+
+
+def validate_subscription(url, events=None):
+    """Valida a URL e os eventos de uma assinatura; retorna a lista de eventos"""
+    if not isinstance(url, str) or not url.startswith(('http://', 'https://')):
+        raise ValueError("A URL do webhook deve começar com http:// ou https://")
+    if events is None:
+        return list(DEFAULT_EVENTS)
+    if not isinstance(events, (list, tuple)) or not events:
+        raise ValueError(f"Os eventos devem ser uma lista não vazia com: {', '.join(WEBHOOK_EVENTS)}")
+    invalid = [str(event) for event in events if event not in WEBHOOK_EVENTS]
+    if invalid:
+        raise ValueError(f"Eventos inválidos: {', '.join(invalid)}")
+    return list(events)
+
+
+def build_subscription(url, task_id=None, events=None, secret=None):
+    """
+    Assinatura validada, ainda não gravada: quem cria a tarefa pode adicioná-la na mesma
+    transação. Sem `secret`, usa o segredo padrão (que abre a sua própria sessão)
+    """
+    from db.models import WebhookSubscription
+    from utils.helpers import generate_unique_id
+
+    events = validate_subscription(url, events)
+    return WebhookSubscription(
+        id=generate_unique_id(),
+        url=url,
+        secret=secret or get_default_secret(),
+        task_id=task_id,
+        events=','.join(events),
+        active=True,
+        created_at=datetime.now()
+    )
+
+
+def subscribe(url, task_id=None, events=None, secret=None):
+    """Cria uma assinatura (de uma tarefa ou global) e retorna (id, segredo)"""
+    from db.database import get_db_session
+
+    subscription = build_subscription(url, task_id=task_id, events=events, secret=secret)
+    subscription_id, secret = subscription.id, subscription.secret
+    with get_db_session() as session:
+        session.add(subscription)
+    return subscription_id, secret
+
+
+def unsubscribe(subscription_id):
+    from db.database import get_db_session
+    from db.models import WebhookSubscription
+
+    with get_db_session() as session:
+        session.query(WebhookSubscription).filter(WebhookSubscription.id == subscription_id).delete()
+
+
+def list_subscriptions(task_id=None, include_global=True):
+    """Assinaturas de uma tarefa (e as globais) ou, sem task_id, apenas as globais"""
+    from sqlalchemy import or_
+    from db.database import get_db_session
+    from db.models import WebhookSubscription
+
+    with get_db_session() as session:
+        query = session.query(WebhookSubscription)
+        if task_id is None:
+            query = query.filter(WebhookSubscription.task_id.is_(None))
+        elif include_global:
+            query = query.filter(or_(WebhookSubscription.task_id == task_id, WebhookSubscription.task_id.is_(None)))
+        else:
+            query = query.filter(WebhookSubscription.task_id == task_id)
+        return [
+            {
+                'id': subscription.id,
+                'url': subscription.url,
+                'task_id': subscription.task_id,
+                'events': subscription.events.split(','),
+                'active': subscription.active,
+                'last_delivery_at': subscription.last_delivery_at,
+                'last_status': subscription.last_status,
+                'failure_count': subscription.failure_count or 0,
+            }
+            for subscription in query.order_by(WebhookSubscription.created_at)
+        ]
+
+
+def notify_task_event(task_id, status, output=None, **data):
+    """
+    Enfileira o evento de mudança de status para as assinaturas interessadas.
+    Nunca levanta exceção: uma falha de notificação não pode afetar a tarefa.
+    """
+    try:
+        from sqlalchemy import or_
+        from db.database import get_db_session
+        from db.models import WebhookSubscription
+        from utils.helpers import generate_unique_id
+
+        with get_db_session() as session:
+            subscriptions = [
+                (subscription.id, subscription.url, subscription.secret)
+                for subscription in session.query(WebhookSubscription).filter(
+                    WebhookSubscription.active.is_(True),
+                    or_(WebhookSubscription.task_id == task_id, WebhookSubscription.task_id.is_(None))
+                )
+                if status in subscription.events.split(',')
+            ]
+        if not subscriptions:
+            return 0
+
+        payload = {
+            'event': f"task.{status}",
+            'task_id': task_id,
+            'status': status,
+            'occurred_at': datetime.now().isoformat(),
+            **data,
+        }
+        if output is not None:
+            payload['output'] = str(output)[:MAX_OUTPUT_CHARS]
+        dispatcher = get_dispatcher()
+        for subscription_id, url, secret in subscriptions:
+            delivery_id = generate_unique_id()
+            dispatcher.enqueue({
+                'id': delivery_id,
+                'subscription_id': subscription_id,
+                'url': url,
+                'secret': secret,
+                'event': payload['event'],
+                'body': json.dumps({'id': delivery_id, **payload}, ensure_ascii=False, default=str).encode('utf-8'),
+                'attempts': 0,
+            })
+        return len(subscriptions)
+    except Exception as e:
+        logger.error(f"Erro ao notificar webhooks da tarefa {task_id}: {e}")
+        return 0